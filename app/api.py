@@ -0,0 +1,327 @@
+"""Local HTTP screening API, for the services which need scans without the streamlit app.
+
+The universe stays loaded in memory between requests, and follows the
+datasets like in the app (`models.universe.UniverseCache`). Scans are cached
+by configuration and dataset version: identical requests are computed once,
+and a scan of new datasets only scores again the assets whose files changed.
+
+    python app/api.py --port 8502 --workers 4
+
+    POST /scan
+    {"indicators": [{"name": "RSI", "period": 14}, {"name": "MACD"}],
+     "interval": "1d", "kinds": ["index", "stock"], "min_score": 1, "limit": 50}
+
+    GET /health
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import math
+import multiprocessing as mp
+import os
+import sys
+from dataclasses import dataclass
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+sys.path.append(os.getcwd())
+
+import pandas as pd
+import toml
+from get_data.manifest import Manifest, ThrottledManifest, changed_symbols
+from get_data.ohlcv import SCAN_INTERVALS
+from models.asset import AssetScore, compute_scores
+from models.indicator import default_indicators, indicators_from_config
+from models.scan import ScanCache, config_key
+from models.universe import Universe, UniverseCache
+
+KINDS = ["index", "stock"]
+
+
+@dataclass(frozen=True)
+class Screen:
+    """Scores of a scan through the API, on one version of the datasets."""
+
+    version: str
+    manifest: Manifest
+    scores: Dict[str, List[AssetScore]]
+    """kind -> scores of the assets of this kind"""
+    elapsed_time: float
+
+
+def config_hash(config: Tuple) -> str:
+    """Short, stable identifier of a scan configuration, returned to the clients."""
+    return hashlib.sha1(repr(config).encode()).hexdigest()[:16]
+
+
+class ScreeningService:
+    """Scans the resident universe, caching the scans by configuration and dataset version.
+    Thread-safe: requests are served concurrently."""
+
+    def __init__(
+        self,
+        index_symbols: List[str],
+        stock_symbols: List[str],
+        path_to_datasets: Path,
+        max_workers: int = None,
+        manifest_ttl: float = 5,
+    ) -> None:
+        """
+        Args:
+            index_symbols (List[str]): symbols of the indices
+            stock_symbols (List[str]): symbols of the stocks
+            path_to_datasets (Path): path to the datasets
+            max_workers (int): number of processes computing the scores. Defaults to the number of CPUs.
+            manifest_ttl (float): seconds between two listings of the datasets
+        """
+        self.index_symbols = index_symbols
+        self.stock_symbols = stock_symbols
+        self.path_to_datasets = path_to_datasets
+        self.manifest_ttl = manifest_ttl
+        self.universes = UniverseCache()
+        self.screens = ScanCache(max_size=64)
+        # started once: spawning processes is slower than most cached requests
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=mp.get_context("spawn")
+        )
+        self._manifest = ThrottledManifest(path_to_datasets, manifest_ttl)
+
+    def manifest(self) -> Manifest:
+        """Manifest of the datasets, listed again at most every `manifest_ttl` seconds."""
+        return self._manifest.get()
+
+    def universe(self, interval: str, wait: bool = False) -> Universe:
+        return self.universes.get(
+            self.index_symbols,
+            self.stock_symbols,
+            self.path_to_datasets,
+            interval,
+            manifest=self.manifest(),
+            wait=wait,
+        )
+
+    def scan(self, request: dict) -> dict:
+        """Scans the universe as configured by `request`, see the module docstring.
+
+        Raises:
+            ValueError: if the request is invalid
+
+        Returns:
+            dict: version of the datasets, configuration hash, whether the scan was cached,
+                and the scores of the assets, highest absolute global score first
+        """
+        if not isinstance(request, dict):
+            raise ValueError("The request must be a JSON object.")
+        if "indicators" in request:
+            indicators = indicators_from_config(request["indicators"])
+        else:
+            indicators = default_indicators()
+        interval = request.get("interval", "1d")
+        if interval not in SCAN_INTERVALS:
+            raise ValueError(
+                f"Unknown interval {interval!r}, expected one of {SCAN_INTERVALS}."
+            )
+        kinds = request.get("kinds", KINDS)
+        if not isinstance(kinds, list):
+            raise ValueError(f"kinds must be a list, eg {KINDS}.")
+        unknown_kinds = [kind for kind in kinds if kind not in KINDS]
+        if len(unknown_kinds) > 0:
+            raise ValueError(f"Unknown kinds {unknown_kinds}, expected some of {KINDS}.")
+        min_score = float(request.get("min_score", 0))
+        if not math.isfinite(min_score):
+            raise ValueError("min_score must be a finite number.")
+        limit = request.get("limit")
+        if limit is not None and (
+            not isinstance(limit, int) or isinstance(limit, bool) or limit < 0
+        ):
+            raise ValueError("limit must be a non-negative integer.")
+
+        try:
+            universe = self.universe(interval)
+        except FileNotFoundError as error:
+            # eg an intraday timeframe which was never downloaded
+            raise ValueError(f"No {interval} datasets to scan: {error}") from error
+        config = (interval, tuple(kinds), config_key(indicators))
+        screen, computed = self.screens.get_or_compute(
+            universe.version,
+            config,
+            lambda previous: self._compute(universe, kinds, indicators, previous),
+        )
+
+        rows = [
+            {
+                "kind": kind,
+                "symbol": score.symbol,
+                "global_score": float(score.global_score),
+                "detailed_score": {
+                    name: float(value) for name, value in score.detailed_score.items()
+                },
+            }
+            for kind in kinds
+            for score in screen.scores[kind]
+            if abs(score.global_score) >= min_score
+        ]
+        rows.sort(key=lambda row: (-abs(row["global_score"]), row["symbol"]))
+        if limit is not None:
+            rows = rows[:limit]
+        return {
+            "version": universe.version,
+            "updated_at": universe.updated_at.isoformat(),
+            "config_hash": config_hash(config),
+            "cached": not computed,
+            "elapsed_time": screen.elapsed_time,
+            "results": rows,
+        }
+
+    def _compute(
+        self, universe: Universe, kinds: List[str], indicators, previous: Screen = None
+    ) -> Screen:
+        """Scores the assets of `universe`, reusing the scores of `previous` for the unchanged assets."""
+        start = perf_counter()
+        changed = None
+        if previous is not None:
+            changed = changed_symbols(previous.manifest, universe.manifest)
+        assets = {"index": universe.indices, "stock": universe.stocks}
+        scores = {}
+        for kind in kinds:
+            kept_scores = []
+            if changed is not None:
+                kept_scores = [
+                    score
+                    for score in previous.scores[kind]
+                    if score.symbol not in changed
+                ]
+            kept_symbols = set(score.symbol for score in kept_scores)
+            to_score = [
+                asset for asset in assets[kind] if asset.symbol not in kept_symbols
+            ]
+            scores[kind] = kept_scores + compute_scores(
+                to_score, indicators, executor=self.executor
+            )
+        return Screen(
+            version=universe.version,
+            manifest=universe.manifest,
+            scores=scores,
+            elapsed_time=perf_counter() - start,
+        )
+
+    def health(self) -> dict:
+        return {
+            "status": "ok",
+            "symbols": len(self.index_symbols) + len(self.stock_symbols),
+            "cached_scans": len(self.screens),
+        }
+
+    def close(self) -> None:
+        self.executor.shutdown()
+
+
+class ScreeningHandler(BaseHTTPRequestHandler):
+    """Routes the requests to the `ScreeningService` of the server."""
+
+    server: "ScreeningServer"
+
+    def _send_json(self, status: HTTPStatus, body: dict) -> None:
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self) -> None:
+        if self.path == "/health":
+            self._send_json(HTTPStatus.OK, self.server.service.health())
+        else:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self) -> None:
+        if self.path != "/scan":
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            response = self.server.service.scan(request)
+        except (ValueError, TypeError) as error:
+            # json.JSONDecodeError is a ValueError
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": str(error)})
+            return
+        except Exception as error:
+            self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": repr(error)})
+            return
+        self._send_json(HTTPStatus.OK, response)
+
+    def log_message(self, format: str, *args) -> None:
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class ScreeningServer(ThreadingHTTPServer):
+    """HTTP server answering each request in its own thread."""
+
+    daemon_threads = True
+
+    def __init__(
+        self, address: Tuple[str, int], service: ScreeningService, quiet: bool = False
+    ) -> None:
+        super().__init__(address, ScreeningHandler)
+        self.service = service
+        self.quiet = quiet
+
+
+def create_server(
+    config_path: Path,
+    host: str = "localhost",
+    port: int = 8502,
+    max_workers: int = None,
+    quiet: bool = False,
+) -> ScreeningServer:
+    """Creates the server of the symbols and datasets of the config file,
+    and loads the daily universe before serving any request.
+
+    Args:
+        config_path (Path): path to the config file
+        host (str): address to listen on
+        port (int): port to listen on, 0 for any free port
+        max_workers (int): number of processes computing the scores. Defaults to the number of CPUs.
+        quiet (bool): do not log the requests
+
+    Returns:
+        ScreeningServer: server, to start with `serve_forever`
+    """
+    config = toml.load(config_path)
+    service = ScreeningService(
+        list(pd.read_csv(config["data_access"]["path_to_index_symbols"])["symbol"]),
+        list(pd.read_csv(config["data_access"]["path_to_stock_symbols"])["symbol"]),
+        Path(config["data_access"]["path_to_datasets"]),
+        max_workers=max_workers,
+    )
+    service.universe("1d", wait=True)
+    return ScreeningServer((host, port), service, quiet=quiet)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local HTTP screening API")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument(
+        "--workers", type=int, default=None, help="defaults to the number of CPUs"
+    )
+    parser.add_argument("--config", type=Path, default=Path("config.toml"))
+    parser.add_argument("--quiet", action="store_true", help="do not log the requests")
+    args = parser.parse_args()
+
+    server = create_server(args.config, args.host, args.port, args.workers, args.quiet)
+    print(f"Serving on http://{args.host}:{server.server_address[1]}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.close()
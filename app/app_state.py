@@ -1,12 +1,18 @@
 import sys
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 import pandas as pd
 import streamlit as st
 import toml
+from app.plotting import figure_weight
+from get_data.manifest import ThrottledManifest
 from get_data.update import update_data
-from models.asset import load_stocks_indices
+from models.cache import LRUCache
+from models.indicator import default_indicators
+from models.scan import DEFAULT_SCAN, ScanCache, ScanResult, load_scan, scan_config
+from models.timing import timed
+from models.universe import UniverseCache
 
 
 def read_config_file(path: Path) -> Tuple:
@@ -21,6 +27,7 @@ def read_config_file(path: Path) -> Tuple:
     config = toml.load(path)
     length_displayed_stocks = config["displaying"]["length_displayed_stocks"]
     length_displayed_tweets = config["displaying"]["length_displayed_tweets"]
+    max_points = config["displaying"]["max_points"]
 
     path_to_index_symbols = Path(config["data_access"]["path_to_index_symbols"])
     path_to_stock_symbols = Path(config["data_access"]["path_to_stock_symbols"])
@@ -28,6 +35,7 @@ def read_config_file(path: Path) -> Tuple:
     return (
         length_displayed_stocks,
         length_displayed_tweets,
+        max_points,
         path_to_index_symbols,
         path_to_stock_symbols,
         path_to_datasets,
@@ -39,7 +47,7 @@ def _initialize_variable_state(symbols: List[str], nb_indicators: int):
 
     Args:
         symbols (List[str]): list of symbols
-        nb_indicators (int): number of indicators used in the website.
+        nb_indicators (int): maximum number of conditions an asset can match.
     """
     if "current_index" not in st.session_state:
         st.session_state["current_index"] = 0
@@ -50,45 +58,116 @@ def _initialize_variable_state(symbols: List[str], nb_indicators: int):
     for symbol in symbols:
         if "tweet_index_" + symbol not in st.session_state:
             st.session_state["tweet_index_" + symbol] = 0
-    for i in range(nb_indicators):
+    for i in range(nb_indicators + 1):
         if "stock_index_" + str(i) not in st.session_state:
             st.session_state["stock_index_" + str(i)] = 0
 
 
+@st.experimental_singleton
+def _universe_cache() -> UniverseCache:
+    """Universes shared by every session of this process."""
+    return UniverseCache()
+
+
+@st.experimental_singleton
+def _manifest(path_to_datasets: Path) -> ThrottledManifest:
+    """Manifest of the datasets shared by every session of this process: every rerun
+    would list the files of the datasets otherwise."""
+    return ThrottledManifest(path_to_datasets)
+
+
+@st.experimental_singleton
+def _scan_cache() -> ScanCache:
+    """Scans shared by every session of this process."""
+    return ScanCache()
+
+
+@st.experimental_singleton
+def _figure_cache() -> LRUCache:
+    """Figures shared by every session of this process, bounded by their total number of points."""
+    return LRUCache(max_weight=2_000_000, weigh=figure_weight)
+
+
+@timed()
 def _load_asset_data(
     index_symbols: List[str],
     stock_symbols: List[str],
     path_to_datasets: Path,
+    interval: str = "1d",
 ):
-    """Loads the original stocks, without any indicators in it.
+    """Loads the original stocks at timeframe `interval`, without any indicators in it.
+    The assets are shared with the other sessions. When the datasets change, only the
+    changed assets are loaded again, in the background: until then, the previous ones are used.
 
     Args:
         index_symbols (List[str]): list of symbols to create Index instances with
         stock_symbols (List[str]): list of symbols to create Stock instances with
-        retrieve_mode (str): Retrieve mode. One of ["get", "fetch"].
-            * `fetch` will only retrieve data from online, and won't save them.
-            * `get` will first try to retrieve data from the disk before trying online
-        force_download (bool): useful when `retrieve_mode=get`.
-            The algorithm will always fetch data from online and save it.
-        path_to_ohlcv (Path): path to the ohlcv data if `retrieve_mode=get`
-        path_to_financials (Path): path to the financial data if `retrieve_mode=get`
+        path_to_datasets (Path): path to the datasets
+        interval (str): timeframe of the klines, eg `1d` or `1wk`.
     """
-    if (
-        "original_stocks" not in st.session_state
-        or "updated_at" not in st.session_state
-    ):
+    cache = _universe_cache()
+    manifest = _manifest(path_to_datasets).get()
+    if cache.is_loaded(index_symbols, stock_symbols, path_to_datasets, interval):
+        universe = cache.get(
+            index_symbols, stock_symbols, path_to_datasets, interval, manifest
+        )
+    else:
         with st.spinner(
             f"Loading historical and financial data of {len(index_symbols+stock_symbols)} assets..."
         ):
-            (
-                st.session_state["original_indices"],
-                st.session_state["original_stocks"],
-                st.session_state["updated_at"],
-            ) = load_stocks_indices(
-                index_symbols,
-                stock_symbols,
-                path_to_datasets=path_to_datasets,
+            universe = cache.get(
+                index_symbols, stock_symbols, path_to_datasets, interval, manifest
             )
+    # references to the shared assets, not copies
+    st.session_state["universe_" + interval] = universe
+    st.session_state["original_indices_" + interval] = universe.indices
+    st.session_state["original_stocks_" + interval] = universe.stocks
+    st.session_state["updated_at"] = universe.updated_at
+
+
+def _set_scan(scan: ScanResult, precomputed: bool = False):
+    """Displays `scan` in this session.
+
+    Args:
+        scan (ScanResult): scan to display
+        precomputed (bool): whether the scan was precomputed by the update job
+    """
+    st.session_state["scan_id"] = scan.scan_id
+    st.session_state["filter_stages"] = scan.filter_stages
+    st.session_state["index_scores"] = scan.index_scores
+    st.session_state["stock_scores"] = scan.stock_scores
+    st.session_state["nb_conditions"] = scan.nb_conditions
+    st.session_state["elapsed_time"] = scan.elapsed_time
+    st.session_state["precomputed_scan"] = precomputed
+    st.session_state["first_scan"] = False
+
+
+@timed()
+def _load_default_scan(path_to_datasets: Path) -> Optional[ScanResult]:
+    """Daily scan of the default indicators, precomputed by the update job.
+
+    Args:
+        path_to_datasets (Path): path to the datasets
+
+    Returns:
+        Optional[ScanResult]: the scan, or None if it was not computed on the loaded datasets
+    """
+    universe = st.session_state["universe_1d"]
+    config = scan_config(["1d"], [], default_indicators())
+    cache = _scan_cache()
+    scan = cache.get((universe.version,), config)
+    if scan is None:
+        scan = load_scan(
+            path_to_datasets,
+            DEFAULT_SCAN,
+            config,
+            universe.version,
+            universe.indices,
+            universe.stocks,
+        )
+        if scan is not None:
+            cache.put((universe.version,), config, scan)
+    return scan
 
 
 def _download_asset_data(
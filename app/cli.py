@@ -0,0 +1,274 @@
+"""Headless scans, without the streamlit app.
+
+Scores are written while they are computed, one row per asset, as JSON lines
+or Parquet, so that large screens can run in batch jobs.
+
+    python app/cli.py --indicators RSI:period=14 MACD --output scores.jsonl
+    python app/cli.py --kinds stock --interval 1wk --workers 8 --format parquet --output scores.parquet
+
+Indicators are given as `Name:param=value,param=value`, parameters left out
+taking their default value. Without `--indicators`, the default indicators are used.
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+from time import monotonic
+from typing import IO, Dict, Iterator, List
+
+sys.path.append(os.getcwd())
+
+import pandas as pd
+import toml
+from get_data.ohlcv import SCAN_INTERVALS
+from models.asset import AssetScore, Index, Stock, scan_in_chunks
+from models.indicator import default_indicators, indicators_from_config
+
+LOADING_FUNCTIONS = {
+    "index": Index.load_index,
+    "stock": Stock.load_stock,
+}
+"""Loading function of each kind of asset"""
+FORMATS = ["jsonl", "parquet"]
+
+
+def parse_indicator(text: str) -> dict:
+    """Parses the configuration of an indicator given on the command line.
+
+    Args:
+        text (str): eg `RSI:period=14,overbought=80` or `MACD`
+
+    Raises:
+        ValueError: if a parameter has no value
+
+    Returns:
+        dict: eg `{"name": "RSI", "period": "14", "overbought": "80"}`.
+            Values are kept as strings, indicators casting their parameters.
+    """
+    name, _, parameters = text.partition(":")
+    config = {"name": name}
+    for parameter in filter(None, parameters.split(",")):
+        key, separator, value = parameter.partition("=")
+        if separator == "":
+            raise ValueError(f"Parameter {parameter!r} of {name} has no value.")
+        config[key.strip()] = value.strip()
+    return config
+
+
+def score_to_row(kind: str, interval: str, score: AssetScore) -> dict:
+    return {
+        "kind": kind,
+        "symbol": score.symbol,
+        "interval": interval,
+        "global_score": float(score.global_score),
+        "detailed_score": {
+            name: float(value) for name, value in score.detailed_score.items()
+        },
+    }
+
+
+class JsonLinesWriter:
+    """Writes a row per line, flushed at once, so that the rows can be read while the scan runs."""
+
+    def __init__(self, file: IO) -> None:
+        self.file = file
+
+    def write(self, row: dict) -> None:
+        self.file.write(json.dumps(row) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+class ParquetWriter:
+    """Writes the rows in row groups of `row_group_size` rows.
+    The detailed score is stored as a JSON string, its keys depending on the indicators."""
+
+    def __init__(self, path: Path, row_group_size: int = 1024) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.schema = pa.schema(
+            [
+                ("kind", pa.string()),
+                ("symbol", pa.string()),
+                ("interval", pa.string()),
+                ("global_score", pa.float64()),
+                ("detailed_score", pa.string()),
+            ]
+        )
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.row_group_size = row_group_size
+        self.rows: List[dict] = []
+
+    def write(self, row: dict) -> None:
+        self.rows.append(dict(row, detailed_score=json.dumps(row["detailed_score"])))
+        if len(self.rows) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        import pyarrow as pa
+
+        if len(self.rows) > 0:
+            table = pa.Table.from_pylist(self.rows, schema=self.schema)
+            self.writer.write_table(table)
+            self.rows = []
+
+    def close(self) -> None:
+        self._flush()
+        self.writer.close()
+
+
+def scan(
+    symbols: Dict[str, List[str]],
+    path_to_datasets: Path,
+    indicators,
+    interval: str = "1d",
+    chunk_size: int = 64,
+    max_workers: int = None,
+    failed_symbols: List[str] = None,
+) -> Iterator[dict]:
+    """Streams the scores of every asset, as rows. Assets which cannot be scanned,
+    eg without dataset, are skipped with a warning on the standard error.
+
+    Args:
+        symbols (Dict[str, List[str]]): symbols to scan, by kind (`index` or `stock`)
+        path_to_datasets (Path): path of the datasets
+        indicators (List[Indicator]): List of indicators giving score
+        interval (str): timeframe of the klines, eg `1d` or `1wk`.
+        chunk_size (int): maximum number of assets loaded at the same time
+        max_workers (int): number of processes. Defaults to the number of CPUs.
+        failed_symbols (List[str]): list the skipped symbols are appended to, if given
+
+    Yields:
+        dict: kind, symbol, interval, global and detailed score of each asset, in order of completion
+    """
+
+    def on_error(symbol: str, error: Exception) -> None:
+        print(f"warning: {symbol} skipped: {error!r}", file=sys.stderr)
+        if failed_symbols is not None:
+            failed_symbols.append(symbol)
+
+    for kind, kind_symbols in symbols.items():
+        for score in scan_in_chunks(
+            kind_symbols,
+            LOADING_FUNCTIONS[kind],
+            path_to_datasets,
+            indicators,
+            chunk_size=chunk_size,
+            interval=interval,
+            max_workers=max_workers,
+            on_error=on_error,
+        ):
+            yield score_to_row(kind, interval, score)
+
+
+def parse_args(args: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Headless scan")
+    parser.add_argument(
+        "--indicators",
+        nargs="+",
+        default=None,
+        help="eg RSI:period=14,overbought=80 MACD. Defaults to the default indicators.",
+    )
+    parser.add_argument(
+        "--kinds",
+        nargs="+",
+        choices=list(LOADING_FUNCTIONS),
+        default=list(LOADING_FUNCTIONS),
+    )
+    parser.add_argument(
+        "--symbols",
+        nargs="+",
+        default=None,
+        help="defaults to the symbols of the config file",
+    )
+    parser.add_argument("--interval", choices=SCAN_INTERVALS, default="1d")
+    parser.add_argument(
+        "--workers", type=int, default=None, help="defaults to the number of CPUs"
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=64, help="assets loaded at the same time"
+    )
+    parser.add_argument(
+        "--format",
+        choices=FORMATS,
+        default=None,
+        help="defaults to the extension of --output, or jsonl",
+    )
+    parser.add_argument(
+        "--output", type=Path, default=None, help="defaults to the standard output"
+    )
+    parser.add_argument("--config", type=Path, default=Path("config.toml"))
+    return parser.parse_args(args)
+
+
+def main(args: List[str] = None) -> None:
+    args = parse_args(args)
+    config = toml.load(args.config)
+    path_to_datasets = Path(config["data_access"]["path_to_datasets"])
+
+    try:
+        if args.indicators is None:
+            indicators = default_indicators()
+        else:
+            indicators = indicators_from_config(
+                [parse_indicator(indicator) for indicator in args.indicators]
+            )
+    except ValueError as error:
+        sys.exit(f"error: {error}")
+
+    paths_to_symbols = {
+        "index": config["data_access"]["path_to_index_symbols"],
+        "stock": config["data_access"]["path_to_stock_symbols"],
+    }
+    symbols = {}
+    for kind in args.kinds:
+        kind_symbols = list(pd.read_csv(paths_to_symbols[kind])["symbol"])
+        if args.symbols is not None:
+            kind_symbols = [symbol for symbol in kind_symbols if symbol in args.symbols]
+        symbols[kind] = kind_symbols
+
+    format = args.format
+    if format is None:
+        format = "jsonl"
+        if args.output is not None and args.output.suffix == ".parquet":
+            format = "parquet"
+    if format == "parquet":
+        if args.output is None:
+            sys.exit("error: --output is required with --format parquet")
+        writer = ParquetWriter(args.output)
+    else:
+        writer = JsonLinesWriter(
+            sys.stdout if args.output is None else open(args.output, "w")
+        )
+
+    start = monotonic()
+    nb_rows = 0
+    failed_symbols = []
+    try:
+        for row in scan(
+            symbols,
+            path_to_datasets,
+            indicators,
+            interval=args.interval,
+            chunk_size=args.chunk_size,
+            max_workers=args.workers,
+            failed_symbols=failed_symbols,
+        ):
+            writer.write(row)
+            nb_rows += 1
+    finally:
+        writer.close()
+    print(
+        f"Scanned {nb_rows} assets in {monotonic() - start:.1f}s, "
+        + f"{len(failed_symbols)} skipped.",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
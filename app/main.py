@@ -6,42 +6,136 @@ from re import A
 sys.path.append(Path("/app/stock-screener"))
 sys.path.append(os.getcwd())
 
+from copy import copy
 from time import time
 
 import numpy as np
 import pandas as pd
 import streamlit as st
-from models.asset import compute_score
-from models.indicator import EMA, MACD, RSI, CipherB, SentimentScore, StochRSI
+from get_data.manifest import changed_symbols
+from get_data.ohlcv import RESAMPLING_RULES
+from models.asset import compute_results, confluence_score
+from models.expression import ExpressionError
+from models.filter import (
+    AverageVolume,
+    MarketCap,
+    Price,
+    Volume,
+    YearChange,
+    apply_filters,
+)
+from models.indicator import CustomCondition, default_indicators
+from models.scan import ScanResult, ScoreIndex, scan_config
+from models.timing import Timeline, span
 
 import app.plotting as plotting
 import app_state
 import widgets
 
 
+def _scan(intervals, on_filters, on_indicators, previous: ScanResult = None) -> ScanResult:
+    """Filters the loaded universe and computes the score of the survivors on every timeframe.
+    The results of the `previous` scan are reused for the assets whose data did not change since.
+    """
+    # cheap predicates first: indicators are only computed on the survivors
+    with span("apply_filters"):
+        survivors, filter_stages = apply_filters(
+            st.session_state["original_indices_1d"]
+            + st.session_state["original_stocks_1d"],
+            on_filters,
+        )
+    survivor_symbols = set([asset.symbol for asset in survivors])
+
+    manifests, results = {}, {}
+    start_time = time()
+    for interval in intervals:
+        universe = st.session_state["universe_" + interval]
+        manifests[interval] = universe.manifest
+        changed = None
+        if previous is not None and interval in previous.manifests:
+            changed = changed_symbols(previous.manifests[interval], universe.manifest)
+        for kind, assets in [("indices", universe.indices), ("stocks", universe.stocks)]:
+            kind_results = {}
+            to_compute = []
+            for asset in assets:
+                if asset.symbol not in survivor_symbols:
+                    continue
+                if changed is not None and asset.symbol not in changed:
+                    previous_result = previous.results[f"{kind}_{interval}"].get(
+                        asset.symbol
+                    )
+                    if previous_result is not None:
+                        kind_results[asset.symbol] = previous_result
+                        continue
+                to_compute.append(asset)
+            if len(to_compute) > 0:
+                with st.spinner(
+                    f"Computing indicators on {len(to_compute)} {kind} ({interval})..."
+                ):
+                    for result in compute_results(to_compute, on_indicators):
+                        kind_results[result.symbol] = result
+            results[f"{kind}_{interval}"] = kind_results
+
+    scored = {}
+    for kind in ["indices", "stocks"]:
+        # shallow copies: the confluence must not modify the results reused by the next scans
+        scored_per_interval = {
+            interval: [copy(result) for result in results[f"{kind}_{interval}"].values()]
+            for interval in intervals
+        }
+        if len(intervals) > 1:
+            with span("confluence_score"):
+                scored[kind] = confluence_score(scored_per_interval)
+        else:
+            scored[kind] = scored_per_interval[intervals[0]]
+    with span("build_score_index"):
+        index_scores = ScoreIndex.from_results(
+            scored["indices"], st.session_state["original_indices_" + intervals[0]]
+        )
+        stock_scores = ScoreIndex.from_results(
+            scored["stocks"], st.session_state["original_stocks_" + intervals[0]]
+        )
+    return ScanResult(
+        index_scores=index_scores,
+        stock_scores=stock_scores,
+        filter_stages=filter_stages,
+        nb_conditions=len(on_indicators) * len(intervals),
+        elapsed_time=time() - start_time,
+        manifests=manifests,
+        results=results,
+    )
+
+
 def run_app():
     st.set_page_config(layout="wide")
 
+    with Timeline("page") as timeline:
+        _run_page()
+    # written to the file of the SCREENER_TIMING_LOG environment variable, if set
+    timeline.log()
+    if st.sidebar.checkbox("Show timings", key="show_timings"):
+        widgets.timings_widget(timeline)
+
+
+def _run_page():
     (
         length_displayed_stocks,
         length_displayed_tweets,
+        max_points,
         path_to_index_symbols,
         path_to_stock_symbols,
         path_to_datasets,
     ) = app_state.read_config_file(Path("config.toml"))
 
-    rsi = RSI()
-    stochrsi = StochRSI()
-    macd = MACD()
-    ema = EMA()
-    cipher_b = CipherB()
-    sentiment_score = SentimentScore()
+    # the custom condition is last, as its conditions read the columns of the other indicators
+    indicators = default_indicators() + [CustomCondition()]
 
-    indicators = [rsi, stochrsi, ema, macd, cipher_b, sentiment_score]
+    filters = [MarketCap(), AverageVolume(), YearChange(), Price(), Volume()]
 
     index_symbols = list(pd.read_csv(path_to_index_symbols)["symbol"])
     stock_symbols = list(pd.read_csv(path_to_stock_symbols)["symbol"])
-    nb_indicators = len(indicators)
+    # each indicator can match once per timeframe
+    nb_indicators = len(indicators) * (len(RESAMPLING_RULES) + 1)
 
     app_state._initialize_variable_state(index_symbols + stock_symbols, nb_indicators)
     app_state._load_asset_data(
@@ -49,8 +143,30 @@ def run_app():
         stock_symbols,
         path_to_datasets,
     )
+    if st.session_state["first_scan"]:
+        # results of the default indicators, precomputed by the update job
+        default_scan = app_state._load_default_scan(path_to_datasets)
+        if default_scan is not None:
+            app_state._set_scan(default_scan, precomputed=True)
 
     with st.sidebar:
+        intervals = st.multiselect(
+            "Timeframes",
+            options=["1d"] + list(RESAMPLING_RULES),
+            default=["1d"],
+            help="Scanning several timeframes sums the scores of each timeframe.",
+        )
+        if len(intervals) == 0:
+            intervals = ["1d"]
+
+        st.markdown("### Filters")
+        for fil in filters:
+            fil.checkbox()
+            if fil.on:
+                fil.text_input()
+        on_filters = [fil for fil in filters if fil.on]
+
+        st.markdown("### Indicators")
         for ind in indicators:
             ind.checkbox()
             if ind.on:
@@ -63,41 +179,66 @@ def run_app():
             index_symbols + stock_symbols, nb_indicators
         )
 
-        with st.spinner(
-            f"Computing indicators on {len(index_symbols)+len(stock_symbols)} assets..."
-        ):
-            start_time = time()
-            st.session_state["indices"] = sorted(
-                compute_score(st.session_state["original_indices"], on_indicators),
-                key=lambda index: (np.abs(index.global_score), index.symbol),
-            )
-            st.session_state["stocks"] = sorted(
-                compute_score(st.session_state["original_stocks"], on_indicators),
-                key=lambda stock: (np.abs(stock.global_score), stock.symbol),
+        for interval in intervals:
+            app_state._load_asset_data(
+                index_symbols,
+                stock_symbols,
+                path_to_datasets,
+                interval,
             )
-            st.session_state["elapsed_time"] = time() - start_time
-            st.session_state["first_scan"] = False
+
+        # identical scans of the same datasets are shared between sessions
+        try:
+            with span("scan", intervals=intervals):
+                scan, _ = app_state._scan_cache().get_or_compute(
+                    tuple(
+                        st.session_state["universe_" + interval].version
+                        for interval in intervals
+                    ),
+                    scan_config(intervals, on_filters, on_indicators),
+                    lambda previous: _scan(intervals, on_filters, on_indicators, previous),
+                )
+        except ExpressionError as e:
+            # eg a custom condition using the column of a disabled indicator
+            st.error(f"Custom condition: {e}")
+        else:
+            app_state._set_scan(scan)
 
     if st.session_state["first_scan"]:
         with open(Path("templates/welcome.txt"), "r") as welcome_file:
             welcome_str = welcome_file.read()
             st.markdown(welcome_str)
+    elif len(st.session_state["stock_scores"]) == 0:
+        st.warning("No stock passed the filters.", icon="⚠️")
     else:
-        indices = st.session_state["indices"]
-        stocks = st.session_state["stocks"]
+        index_scores = st.session_state["index_scores"]
+        stock_scores = st.session_state["stock_scores"]
+        if st.session_state["precomputed_scan"]:
+            st.info(
+                "Showing the daily scan of the default indicators. "
+                + "Select indicators in the sidebar and scan to change it."
+            )
+        filter_stages = "".join(
+            f"\n* {name}: {pruned} assets pruned"
+            for name, pruned in st.session_state["filter_stages"]
+        )
         with open(Path("templates/global_analysis.txt"), "r") as global_analysis_file:
             global_analysis_str = global_analysis_file.read()
             st.markdown(
                 global_analysis_str.format(
-                    len_assets=len(indices) + len(stocks),
+                    len_assets=len(index_scores) + len(stock_scores),
+                    filter_stages=filter_stages or " none",
                     elapsed_time=1000 * st.session_state["elapsed_time"],
-                    non_neutral_pressures=len(
-                        [1 for s in stocks if len(s.detailed_score) > 0]
-                    ),
+                    non_neutral_pressures=stock_scores.non_neutral_pressures,
                 )
             )
 
-        st.plotly_chart(plotting.indicator_histogram(indices, stocks))
+        st.plotly_chart(
+            app_state._figure_cache().get_or_create(
+                ("histogram", st.session_state["scan_id"]),
+                lambda: plotting.indicator_histogram(index_scores, stock_scores),
+            )
+        )
 
         with open(
             Path("templates/specific_analysis.txt"), "r"
@@ -106,7 +247,7 @@ def run_app():
 
         indicators_to_draw_above = st.multiselect(
             "Indicators to draw above the ohlc chart",
-            options=stocks[0].klines.columns,
+            options=stock_scores.columns,
             default=["Volume"],
         )
         # A bug may occur when:
@@ -114,7 +255,7 @@ def run_app():
         # 2) he draws indicator A
         # 3) he unselects indicator A, whithout a new scan.
         # => the indicator flag column is not part of multiselect columns anymore
-        options_draw_beside = stocks[0].klines.columns
+        options_draw_beside = stock_scores.columns
         default_draw_beside = [
             ind.flag_column
             for ind in on_indicators
@@ -125,52 +266,51 @@ def run_app():
             options=options_draw_beside,
             default=default_draw_beside,
         )
+        downsample_charts = st.checkbox(
+            f"Downsample charts to {max_points} points",
+            value=True,
+            help="Long histories are drawn with merged candles and downsampled lines. "
+            + "Select a shorter date range in a chart to see every kline.",
+        )
+        chart_max_points = max_points if downsample_charts else None
 
         agreed_indicators = st.slider(
             label="Filter assets based matching conditions",
             min_value=0,
-            max_value=len(on_indicators),
+            max_value=max(st.session_state["nb_conditions"], stock_scores.max_score),
             step=1,
-            value=int(np.abs(stocks[-1].global_score)),
+            value=stock_scores.max_score,
         )
 
-        selected_indices = [
-            index
-            for index in indices
-            if np.abs(index.global_score) == agreed_indicators
-        ]
         st.write(
-            f"{len(selected_indices)} indices found matching {agreed_indicators} conditions."
+            f"{index_scores.count(agreed_indicators)} indices found matching {agreed_indicators} conditions."
         )
 
         widgets.expanders_widget(
-            selected_indices,
-            0,
-            5,
+            index_scores.page(agreed_indicators, 0, 5),
             length_displayed_tweets,
             indicators_to_draw_above,
             indicators_to_draw_beside,
+            chart_max_points,
         )
 
-        selected_stocks = [
-            stock for stock in stocks if np.abs(stock.global_score) == agreed_indicators
-        ]
         index_in_stock_list = st.session_state["stock_index_" + str(agreed_indicators)]
         st.write(
-            f"{len(selected_stocks)} stocks found matching {agreed_indicators} conditions."
+            f"{stock_scores.count(agreed_indicators)} stocks found matching {agreed_indicators} conditions."
         )
 
         widgets.expanders_widget(
-            selected_stocks,
-            index_in_stock_list,
-            length_displayed_stocks,
+            stock_scores.page(
+                agreed_indicators, index_in_stock_list, length_displayed_stocks
+            ),
             length_displayed_tweets,
             indicators_to_draw_above,
             indicators_to_draw_beside,
+            chart_max_points,
         )
 
-        if index_in_stock_list + length_displayed_stocks < len(
-            selected_stocks
+        if index_in_stock_list + length_displayed_stocks < stock_scores.count(
+            agreed_indicators
         ) and st.button("Load more stocks"):
             st.session_state[
                 "stock_index_" + str(agreed_indicators)
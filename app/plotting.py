@@ -1,86 +1,77 @@
 from dataclasses import fields
-from typing import List
+from datetime import date
+from typing import List, Tuple
 
 import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from models.asset import Index, Stock
+from models.scan import ScoreIndex
+from models.timing import timed
 from plotly.graph_objects import Figure
 from plotly.subplots import make_subplots
 
 
-def indicator_histogram(indices: List[Index], stocks: List[Stock]) -> Figure:
+@timed()
+def indicator_histogram(index_scores: ScoreIndex, stock_scores: ScoreIndex) -> Figure:
     """Creates a figure containing a summary of the scanned stocks
 
     Args:
-        stocks (List[Stock]): relevant stocks among the scanned stocks
+        index_scores (ScoreIndex): scores of the scanned indices
+        stock_scores (ScoreIndex): scores of the scanned stocks
 
     Returns:
         Figure: plotly figure
     """
     fig = make_subplots(rows=1, cols=2)
 
-    l = []
-    for index, (asset_type, assets) in enumerate(
-        {"index": indices, "stock": stocks}.items()
-    ):
-        for asset in assets:
-            for ind, score_ind in asset.detailed_score.items():
-                l.append(
-                    [asset.symbol, asset.global_score, asset_type, str(ind), score_ind]
-                )
-    df = pd.DataFrame(
-        l, columns=["symbols", "score", "asset_type", "indicator", "indicator_score"]
+    breakdowns = {
+        "index": index_scores.breakdown,
+        "stock": stock_scores.breakdown,
+    }
+    indicator_names = list(
+        dict.fromkeys(
+            name for breakdown in breakdowns.values() for name in breakdown.columns
+        )
     )
-
-    _index = df[df["score"] < 0].index
-    df.loc[_index, "indicator_score"] *= -1
+    scores = np.concatenate(
+        [breakdown.index.to_numpy() for breakdown in breakdowns.values()]
+    )
+    min_score = int(scores.min()) if len(scores) > 0 else 0
+    max_score = int(scores.max()) if len(scores) > 0 else 0
 
     color_map = {
-        indicator_name: px.colors.qualitative.Plotly[i]
-        for i, indicator_name in enumerate(df["indicator"].unique())
+        indicator_name: px.colors.qualitative.Plotly[i % len(px.colors.qualitative.Plotly)]
+        for i, indicator_name in enumerate(indicator_names)
     }
-    for indicator_name in df["indicator"].unique():
-        for index, (asset_type, assets) in enumerate(
-            {"index": indices, "stock": stocks}.items()
-        ):
-            df_with_indicator_name_asset_type = df[
-                (df["indicator"] == indicator_name) & (df["asset_type"] == asset_type)
-            ]
+    for index, (asset_type, breakdown) in enumerate(breakdowns.items()):
+        for indicator_name in breakdown.columns:
             fig.add_trace(
-                go.Histogram(
-                    histfunc="sum",
-                    y=df_with_indicator_name_asset_type["indicator_score"],
-                    x=df_with_indicator_name_asset_type["score"],
+                go.Bar(
+                    x=breakdown.index,
+                    y=breakdown[indicator_name],
                     legendgroup=indicator_name,
                     name=indicator_name,
                     hovertemplate=f"<b>{indicator_name}</b>:"
                     + "<br>%{y}"
                     + f" {asset_type} detected."
                     + "<extra></extra>",
-                    xbins=dict(  # bins used for histogram
-                        start=df["score"].min(), end=df["score"].max() + 1, size=1
-                    ),
                     marker_color=color_map[indicator_name],
-                    xaxis="x" + str(index + 1),
-                    showlegend=index > 0,
+                    showlegend=index > 0 or indicator_name not in breakdowns["stock"],
                 ),
                 row=1,
                 col=index + 1,
             )
 
-            fig.update_xaxes(
-                title_text=f"Number of {asset_type} detected",
-                tickmode="array",
-                tickvals=list(
-                    np.arange(df["score"].min() + 0.5, df["score"].max() + 1.5, 1)
-                ),
-                ticktext=list(range(df["score"].min(), df["score"].max() + 1, 1)),
-                range=[df["score"].min(), df["score"].max() + 1],
-                row=1,
-                col=index + 1,
-            )
+        fig.update_xaxes(
+            title_text=f"Number of {asset_type} detected",
+            tickmode="array",
+            tickvals=list(range(min_score, max_score + 1)),
+            range=[min_score - 0.5, max_score + 0.5],
+            row=1,
+            col=index + 1,
+        )
     fig.update_yaxes(title_text="Global score", row=1, col=1)
 
     fig.update_layout(
@@ -105,23 +96,117 @@ def indicator_histogram(indices: List[Index], stocks: List[Stock]) -> Figure:
     return fig
 
 
+def figure_weight(fig: Figure) -> int:
+    """Number of points of a figure, used to bound the size of the figure cache."""
+    return sum(len(trace.x) if trace.x is not None else 0 for trace in fig.data)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, nb_points: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets downsampling: keeps the points which preserve the shape of the line.
+
+    Args:
+        x (np.ndarray): increasing abscissas
+        y (np.ndarray): ordinates, without NaN
+        nb_points (int): number of points to keep, at least 3
+
+    Returns:
+        np.ndarray: positions of the kept points, always including the first and last ones
+    """
+    if nb_points >= len(x) or nb_points < 3:
+        return np.arange(len(x))
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    # the first and last points are kept, the others are split in nb_points - 2 buckets
+    edges = np.linspace(1, len(x) - 1, nb_points - 1).astype(np.int64)
+    kept = np.empty(nb_points, dtype=np.int64)
+    kept[0], kept[-1] = 0, len(x) - 1
+    for i in range(nb_points - 2):
+        start, end = edges[i], edges[i + 1]
+        # the third point of the triangle is the average of the next bucket
+        next_end = edges[i + 2] if i + 2 < len(edges) else len(x)
+        next_x = x[end:next_end].mean() if next_end > end else x[-1]
+        next_y = y[end:next_end].mean() if next_end > end else y[-1]
+        previous = kept[i]
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        kept[i + 1] = start + np.argmax(areas)
+    return kept
+
+
+def downsample_line(series: pd.Series, nb_points: int) -> pd.Series:
+    """Downsamples `series` to `nb_points` points with `lttb`. Missing values are dropped."""
+    series = series.dropna()
+    if len(series) <= nb_points:
+        return series
+    kept = lttb(series.index.asi8, series.to_numpy(dtype=np.float64), nb_points)
+    return series.iloc[kept]
+
+
+def aggregate_candles(klines: pd.DataFrame, nb_candles: int) -> pd.DataFrame:
+    """Merges consecutive klines, so that at most `nb_candles` candles are left.
+
+    Args:
+        klines (pd.DataFrame): klines with columns `Open`, `High`, `Low`, `Close` and `Volume`
+        nb_candles (int): maximum number of candles
+
+    Returns:
+        pd.DataFrame: merged klines, indexed by the open time of their first kline
+    """
+    if len(klines) <= nb_candles:
+        return klines[["Open", "High", "Low", "Close", "Volume"]]
+    bucket_size = int(np.ceil(len(klines) / nb_candles))
+    buckets = np.arange(len(klines)) // bucket_size
+    aggregated = klines.groupby(buckets).agg(
+        {"Open": "first", "High": "max", "Low": "min", "Close": "last", "Volume": "sum"}
+    )
+    aggregated.index = klines.index[::bucket_size]
+    return aggregated
+
+
+@timed()
 def mutliple_row_charts(
     stock: Stock,
     indicators_to_draw_above: List[str] = [],
     indicators_to_draw_beside: List[str] = [],
+    max_points: int = None,
+    date_range: Tuple[date, date] = None,
 ) -> Figure:
     """Creates a figure containing multiple rows of charts:
         * a first OHLC chart, and the `indicators_to_draw_above` on top.
         * a chart of each indicator in `indicators_to_draw_beside`
 
+    When there are more than `max_points` klines in `date_range`, candles are merged,
+    lines are downsampled with `lttb` and drawn with WebGL, so that the size of the
+    figure does not grow with the history.
+
     Args:
         stock (Stock): selected stock
         indicators_to_draw_above (List[str], optional): Indicators to draw below the OHLC chart. Defaults to [].
         indicators_to_draw_beside (List[str], optional): Indicators to draw on top of the OHLC chart. Defaults to [].
+        max_points (int, optional): maximum number of points per trace. Defaults to every kline.
+        date_range (Tuple[date, date], optional): first and last dates to draw. Defaults to every kline.
 
     Returns:
         Figure: plotly figure containing all the chart
     """
+    klines = stock.klines
+    if date_range is not None:
+        klines = klines[
+            (klines.index.date >= date_range[0]) & (klines.index.date <= date_range[1])
+        ]
+    downsampled = max_points is not None and len(klines) > max_points
+
+    def line(column: str) -> pd.Series:
+        if downsampled:
+            return downsample_line(klines[column], max_points)
+        return klines[column]
+
+    # WebGL traces for long lines. Plotly does not support rangebreaks on them.
+    scatter = go.Scattergl if downsampled else go.Scatter
+    candles = aggregate_candles(klines, max_points) if downsampled else klines
+
     row_heights = [0.7] + [0.2] * len(indicators_to_draw_beside)
     fig = make_subplots(
         rows=len(indicators_to_draw_beside) + 1,
@@ -135,8 +220,8 @@ def mutliple_row_charts(
     for indicator_name in indicators_to_draw_above:
         if indicator_name == "Volume":
             trace = go.Bar(
-                x=stock.klines.index,
-                y=stock.klines["Volume"],
+                x=candles.index,
+                y=candles["Volume"],
                 marker={
                     "color": "lightgrey",
                 },
@@ -145,9 +230,10 @@ def mutliple_row_charts(
             )
 
         else:
-            trace = go.Scatter(
-                x=stock.klines.index,
-                y=stock.klines[indicator_name],
+            values = line(indicator_name)
+            trace = scatter(
+                x=values.index,
+                y=values,
                 name=indicator_name,
             )
         fig.add_trace(
@@ -159,11 +245,11 @@ def mutliple_row_charts(
 
     fig.add_trace(
         go.Candlestick(
-            x=stock.klines.index,
-            open=stock.klines["Open"],
-            high=stock.klines["High"],
-            low=stock.klines["Low"],
-            close=stock.klines["Close"],
+            x=candles.index,
+            open=candles["Open"],
+            high=candles["High"],
+            low=candles["Low"],
+            close=candles["Close"],
             name="OHLC",
         ),
         row=1,
@@ -171,17 +257,20 @@ def mutliple_row_charts(
         secondary_y=False,
     )
     for index, indicator_name in enumerate(indicators_to_draw_beside):
+        values = line(indicator_name)
         fig.add_trace(
-            go.Scatter(
-                x=stock.klines.index,
-                y=stock.klines[indicator_name],
+            scatter(
+                x=values.index,
+                y=values,
                 name=indicator_name,
             ),
             row=index + 2,
             col=1,
         )
     fig.update_xaxes(
-        rangebreaks=[
+        rangebreaks=[]
+        if downsampled
+        else [
             dict(bounds=["sat", "mon"], pattern="day of week"),  # hide weekends
         ],
         title_text="Date",
@@ -194,7 +283,8 @@ def mutliple_row_charts(
         height=np.sum(row_heights) * 800,
         legend_title="Indicators",
         hovermode="x unified",
-        title_text="OHLC chart and Indicators",
+        title_text="OHLC chart and Indicators"
+        + (f" ({len(candles)} of {len(klines)} klines)" if downsampled else ""),
         font=dict(size=18),
     )
     return fig
@@ -1,12 +1,18 @@
+import io
 from typing import List
 
+import numpy as np
+import pandas as pd
 import streamlit as st
 from models.asset import Stock
+from models.timing import Timeline, span, timed
 from models.tweet import TweetsSearch
 
 import app.plotting as plotting
+import app_state
 
 
+@timed()
 def tweets_widget(
     tweet_search: TweetsSearch,
     index_in_tweet_search: int,
@@ -20,26 +26,22 @@ def tweets_widget(
         length_displayed_tweets (int): number of tweets to display per row
     """
     cols = st.columns(length_displayed_tweets)
-    idx_col = 0
-    idx_tweet = index_in_tweet_search
-    while idx_col < len(cols):
-        col = cols[idx_col]
+    # the embeds of the row, and a few spare ones for the tweets which cannot be fetched,
+    # are fetched concurrently
+    tweets = tweet_search.tweets(index_in_tweet_search, 2 * length_displayed_tweets)
+    tweets = [tweet for tweet in tweets if tweet is not None]
+    for col, tweet in zip(cols, tweets):
         with col:
-            if idx_tweet >= len(tweet_search):
-                break
-            try:
-                tweet_search[idx_tweet].component()
-                idx_col += 1
-            except Exception as e:
-                pass
-            idx_tweet += 1
+            tweet.component()
 
 
+@timed()
 def expander_widget(
     stock: Stock,
     length_displayed_tweets: int,
     indicators_to_draw_above: List,
     indicators_to_draw_beside: List,
+    max_points: int = None,
 ) -> None:
     """Widget which contains every information about a specific stock:
         * its name and industry
@@ -52,6 +54,7 @@ def expander_widget(
         length_displayed_tweets (int): number of tweet widgets displayed per stock
         indicators_to_draw_above (List): indicators to draw above the OHLC chart
         indicators_to_draw_beside (List): indicators to draw beside the OHLC chart
+        max_points (int): maximum number of points per chart trace. Defaults to every kline.
     """
     if isinstance(stock, Stock):
         financials = stock.financials
@@ -63,12 +66,40 @@ def expander_widget(
             for f_col in financial_col:
                 col.write(f_col)
 
-    fig = plotting.mutliple_row_charts(
-        stock, indicators_to_draw_above, indicators_to_draw_beside
+    first_date, last_date = stock.klines.index[0].date(), stock.klines.index[-1].date()
+    date_range = None
+    if first_date < last_date:
+        date_range = st.slider(
+            "Dates",
+            min_value=first_date,
+            max_value=last_date,
+            value=(first_date, last_date),
+            key="dates_" + stock.symbol,
+        )
+    # a scan id also identifies the datasets the scan was computed on
+    figure_key = (
+        "chart",
+        st.session_state["scan_id"],
+        stock.symbol,
+        tuple(indicators_to_draw_above),
+        tuple(indicators_to_draw_beside),
+        max_points,
+        date_range,
+    )
+    fig = app_state._figure_cache().get_or_create(
+        figure_key,
+        lambda: plotting.mutliple_row_charts(
+            stock,
+            indicators_to_draw_above,
+            indicators_to_draw_beside,
+            max_points,
+            date_range,
+        ),
     )
     st.plotly_chart(fig, use_container_width=True)
 
-    tweet_search = TweetsSearch(stock)
+    with span("search_tweets"):
+        tweet_search = TweetsSearch(stock)
 
     index_in_tweet_search = st.session_state["tweet_index_" + stock.symbol]
     tweets_widget(tweet_search, index_in_tweet_search, length_displayed_tweets)
@@ -79,38 +110,103 @@ def expander_widget(
         st.session_state["tweet_index_" + stock.symbol] += length_displayed_tweets
 
 
+RAW_DATA_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+"""Columns of the raw data shown by default"""
+
+
+@timed()
+def raw_data_widget(stock: Stock, page_length: int = 50) -> None:
+    """Widget showing the klines of a stock, one page of the selected columns at a time.
+    The full klines can be downloaded as CSV or Parquet.
+
+    Args:
+        stock (Stock): stock to display
+        page_length (int): number of klines per page, latest first
+    """
+    klines = stock.klines
+    columns = st.multiselect(
+        "Columns",
+        options=list(klines.columns),
+        default=[column for column in RAW_DATA_COLUMNS if column in klines.columns],
+        key="raw_columns_" + stock.symbol,
+    )
+    nb_pages = max(1, int(np.ceil(len(klines) / page_length)))
+    page = st.number_input(
+        f"Page (of {nb_pages}, latest klines first)",
+        min_value=1,
+        max_value=nb_pages,
+        value=1,
+        key="raw_page_" + stock.symbol,
+    )
+    end = len(klines) - (page - 1) * page_length
+    start = max(0, end - page_length)
+    # only the visible page is sent to the browser
+    st.dataframe(klines[columns].iloc[start:end].iloc[::-1])
+
+    if st.checkbox("Download the full klines", key="raw_download_" + stock.symbol):
+        col1, col2 = st.columns(2)
+        col1.download_button(
+            "CSV",
+            data=klines.to_csv().encode(),
+            file_name=f"{stock.symbol}_{stock.interval}.csv",
+            mime="text/csv",
+            key="raw_csv_" + stock.symbol,
+        )
+        parquet_file = io.BytesIO()
+        klines.to_parquet(parquet_file)
+        col2.download_button(
+            "Parquet",
+            data=parquet_file.getvalue(),
+            file_name=f"{stock.symbol}_{stock.interval}.parquet",
+            mime="application/octet-stream",
+            key="raw_parquet_" + stock.symbol,
+        )
+
+
 def expanders_widget(
     stocks: List[Stock],
-    index_in_stock_list: int,
-    length_displayed_stocks: int,
     length_displayed_tweets: int,
     indicators_to_draw_above: List,
     indicators_to_draw_beside: List,
+    max_points: int = None,
 ) -> None:
     """Mutiple expander widgets.
 
     Args:
         stocks (List[Stock]): list of stocks to display in expanders
-        index_in_stock_list (int): index of the first stock to display
-        length_displayed_stocks (int): number of expander widgets displayed in the page
         length_displayed_tweets (int): number of tweet widgets displayed per stock
         indicators_to_draw_above (List): indicators to draw above the OHLC chart
         indicators_to_draw_beside (List): indicators to draw beside the OHLC chart
+        max_points (int): maximum number of points per chart trace. Defaults to every kline.
     """
-    for index in range(
-        index_in_stock_list,
-        index_in_stock_list + length_displayed_stocks,
-    ):
-        if index >= len(stocks):
-            break
-        stock = stocks[index]
+    for stock in stocks:
         with st.expander(f"{stock.symbol} charts", expanded=False):
             expander_widget(
                 stock,
                 length_displayed_tweets,
                 indicators_to_draw_above,
                 indicators_to_draw_beside,
+                max_points,
             )
 
         with st.expander(f"{stock.symbol} raw data", expanded=False):
-            st.table(stock.klines)
+            raw_data_widget(stock)
+
+
+def timings_widget(timeline: Timeline) -> None:
+    """Debug panel showing where the page spent its time.
+
+    Args:
+        timeline (Timeline): spans recorded while rendering the page
+    """
+    with st.expander("Timings", expanded=True):
+        st.write(f"Page rendered in {1000 * timeline.duration:.0f} ms.")
+        summary = pd.DataFrame(timeline.summary())
+        if len(summary) == 0:
+            return
+        # the spans of the workers add up their CPU time, across every process
+        summary["where"] = np.where(summary.pop("worker"), "workers", "app")
+        st.dataframe(
+            summary[["name", "where", "count", "total_ms", "max_ms"]].round(1)
+        )
+
@@ -0,0 +1,146 @@
+"""Latency and throughput of the screening API (`app/api.py`) under concurrent requests.
+
+Without `--url`, a server is started on a synthetic universe. The first request
+of each configuration computes the scan (cold), the next ones are served from
+the cache (warm).
+
+    python benchmarks/api_load_test.py --symbols 500 --requests 200 --concurrency 8
+    python benchmarks/api_load_test.py --url http://localhost:8502 --requests 200
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import tempfile
+import threading
+import urllib.request
+from pathlib import Path
+from time import perf_counter
+from typing import List
+
+import numpy as np
+
+sys.path.append(os.getcwd())
+
+from benchmarks.synthetic import write_universe
+
+CONFIGS = [
+    {"indicators": [{"name": "RSI"}, {"name": "MACD"}]},
+    {"indicators": [{"name": "RSI", "period": 10}, {"name": "StochRSI"}]},
+    {"indicators": [{"name": "EMA"}, {"name": "CipherB"}], "kinds": ["stock"]},
+]
+"""Scan configurations requested in turn"""
+
+
+def post_scan(url: str, body: dict) -> dict:
+    request = urllib.request.Request(
+        url + "/scan",
+        data=json.dumps(body).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(request, timeout=600) as response:
+        return json.loads(response.read())
+
+
+def summarize(latencies: List[float]) -> dict:
+    latencies = np.array(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+    }
+
+
+def load_test(url: str, nb_requests: int, concurrency: int) -> dict:
+    """Sends `nb_requests` scan requests, `concurrency` at a time, cycling through `CONFIGS`.
+
+    Returns:
+        dict: latencies of the cold (computed) and warm (cached) requests, and throughput
+    """
+    cold, warm = [], []
+    lock = threading.Lock()
+
+    def send(i: int) -> None:
+        start = perf_counter()
+        response = post_scan(url, dict(CONFIGS[i % len(CONFIGS)], limit=50))
+        latency = perf_counter() - start
+        with lock:
+            (warm if response["cached"] else cold).append(latency)
+
+    start = perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, range(nb_requests)))
+    elapsed_time = perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "elapsed_s": elapsed_time,
+        "requests_per_s": nb_requests / elapsed_time,
+        "cold": summarize(cold) if len(cold) > 0 else None,
+        "warm": summarize(warm) if len(warm) > 0 else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--url", default=None, help="server to test. Defaults to a local one."
+    )
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--bars", type=int, default=500)
+    parser.add_argument(
+        "--workers", type=int, default=None, help="processes of the local server"
+    )
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--output", type=Path, help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    server = None
+    directory = None
+    url = args.url
+    if url is None:
+        from app.api import create_server
+
+        directory = tempfile.TemporaryDirectory()
+        path = Path(directory.name)
+        index_symbols, stock_symbols = write_universe(path, args.symbols, args.bars, 2)
+        with open(path / "indices.csv", "w") as outfile:
+            outfile.write("\n".join(["symbol"] + index_symbols) + "\n")
+        with open(path / "stocks.csv", "w") as outfile:
+            outfile.write("\n".join(["symbol"] + stock_symbols) + "\n")
+        with open(path / "config.toml", "w") as outfile:
+            outfile.write(
+                "[data_access]\n"
+                + f'path_to_index_symbols = "{path / "indices.csv"}"\n'
+                + f'path_to_stock_symbols = "{path / "stocks.csv"}"\n'
+                + f'path_to_datasets = "{path}/"\n'
+            )
+        start = perf_counter()
+        server = create_server(
+            path / "config.toml", port=0, max_workers=args.workers, quiet=True
+        )
+        print(f"Universe loaded in {perf_counter() - start:.1f}s", file=sys.stderr)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://localhost:{server.server_address[1]}"
+
+    results = []
+    try:
+        for concurrency in args.concurrency:
+            result = load_test(url, args.requests, concurrency)
+            print(json.dumps(result))
+            results.append(result)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            server.service.close()
+            directory.cleanup()
+
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=4)
@@ -0,0 +1,103 @@
+"""Peak memory and throughput of the full scan and of the chunked scan, on synthetic universes.
+
+Every (mode, universe size) runs in a fresh process, so that peak RSS are not shared.
+
+    python benchmarks/chunked_scan.py --sizes 500 8000 --bars 500
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+sys.path.append(os.getcwd())
+
+from benchmarks.synthetic import write_universe
+from models.asset import Stock, compute_score, load_stocks_indices, scan_in_chunks
+from models.indicator import EMA, MACD, RSI, CipherB, SentimentScore, StochRSI
+
+MODES = ["full", "chunked"]
+
+
+def _peak_rss_mb(who: int) -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def run_mode(mode: str, path_to_datasets: Path, nb_symbols: int, chunk_size: int) -> dict:
+    stock_symbols = [f"SYM{i:05d}" for i in range(nb_symbols)]
+    indicators = [RSI(), StochRSI(), EMA(), MACD(), CipherB(), SentimentScore()]
+
+    start = perf_counter()
+    if mode == "full":
+        _, stocks, _ = load_stocks_indices([], stock_symbols, path_to_datasets)
+        scores = compute_score(stocks, indicators)
+    else:
+        scores = list(
+            scan_in_chunks(
+                stock_symbols,
+                Stock.load_stock,
+                path_to_datasets,
+                indicators,
+                chunk_size=chunk_size,
+            )
+        )
+    elapsed_time = perf_counter() - start
+    return {
+        "mode": mode,
+        "symbols": nb_symbols,
+        "scored": len(scores),
+        "elapsed_s": elapsed_time,
+        "symbols_per_s": nb_symbols / elapsed_time,
+        "main_peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+        "worker_peak_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 8000])
+    parser.add_argument("--bars", type=int, default=500)
+    parser.add_argument("--chunk-size", type=int, default=64)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--output", type=Path, help="JSON file to write the results to")
+    # internal: run a single measure in this process
+    parser.add_argument("--single", nargs=3, metavar=("MODE", "PATH", "SIZE"))
+    args = parser.parse_args()
+
+    if args.single is not None:
+        mode, path, size = args.single
+        print(json.dumps(run_mode(mode, Path(path), int(size), args.chunk_size)))
+        sys.exit(0)
+
+    results = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            write_universe(Path(directory), size, args.bars)
+            for mode in args.modes:
+                output = subprocess.run(
+                    [
+                        sys.executable,
+                        __file__,
+                        "--chunk-size",
+                        str(args.chunk_size),
+                        "--single",
+                        mode,
+                        directory,
+                        str(size),
+                    ],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                ).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                print(json.dumps(result))
+                results.append(result)
+
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=4)
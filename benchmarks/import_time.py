@@ -0,0 +1,120 @@
+"""Import time of the modules imported by the spawned workers and by the update job.
+
+Each module is imported in a fresh interpreter with `-X importtime`. The script
+fails when a module pulls in a library the workers do not need (streamlit, the
+network libraries), or when its import takes longer than `--budget-ms`.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --modules models.asset --budget-ms 1500 --repeat 5
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+from statistics import median
+from typing import Dict, List, Tuple
+
+sys.path.append(os.getcwd())
+
+MODULES = [
+    "models.asset",
+    "models.indicator",
+    "models.scan",
+    "models.universe",
+    "get_data.update",
+    "get_data.scheduler",
+]
+"""Modules imported by every spawned worker, and by the update job and its scheduler"""
+FORBIDDEN_MODULES = ["streamlit", "yfinance", "nltk", "requests", "tweepy", "bs4"]
+"""Libraries these modules must only import when they are used"""
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_times(module: str) -> Dict[str, Tuple[int, int]]:
+    """Imports `module` in a fresh interpreter.
+
+    Returns:
+        Dict[str, Tuple[int, int]]: imported module -> (self, cumulative) import time, in microseconds
+    """
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        capture_output=True,
+        text=True,
+        cwd=os.getcwd(),
+    ).stderr
+    times = {}
+    for line in output.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match is not None:
+            self_us, cumulative_us, _, name = match.groups()
+            times[name] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def measure(module: str, repeat: int, top: int) -> dict:
+    runs = [import_times(module) for _ in range(repeat)]
+    cumulative_ms = [run[module][1] / 1000 for run in runs]
+    last_run = runs[-1]
+    forbidden = sorted(
+        set(name.split(".")[0] for name in last_run) & set(FORBIDDEN_MODULES)
+    )
+    # slowest third-party or local modules, by their own import time
+    slowest = sorted(last_run.items(), key=lambda item: item[1][0], reverse=True)[:top]
+    return {
+        "module": module,
+        "median_ms": median(cumulative_ms),
+        "min_ms": min(cumulative_ms),
+        "forbidden_imports": forbidden,
+        "slowest": [
+            {"module": name, "self_ms": self_us / 1000} for name, (self_us, _) in slowest
+        ],
+    }
+
+
+def check(results: List[dict], budget_ms: float) -> List[str]:
+    """Problems found in the measures: forbidden imports and imports over budget."""
+    problems = []
+    for result in results:
+        if len(result["forbidden_imports"]) > 0:
+            problems.append(
+                f"{result['module']} imports {', '.join(result['forbidden_imports'])}"
+            )
+        if budget_ms is not None and result["median_ms"] > budget_ms:
+            problems.append(
+                f"{result['module']} takes {result['median_ms']:.0f}ms to import "
+                + f"(budget: {budget_ms:.0f}ms)"
+            )
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5, help="slowest imports shown")
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=2000,
+        help="maximum median import time of each module",
+    )
+    parser.add_argument("--output", type=Path, help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    results = [measure(module, args.repeat, args.top) for module in args.modules]
+    for result in results:
+        print(json.dumps(result))
+
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=4)
+
+    problems = check(results, args.budget_ms)
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    sys.exit(1 if len(problems) > 0 else 0)
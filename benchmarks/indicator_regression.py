@@ -0,0 +1,338 @@
+"""Correctness and speed regression harness of the indicators.
+
+Every indicator is applied to fixed price series, stored in `benchmarks/golden/prices.csv`,
+and its output is compared with the golden output stored next to it:
+
+    * the flags must be equal, bar by bar (the values, for the indicators without flags)
+    * the indicator must add the same columns, eg no stray `lag` column
+    * each flag must give buy and sell pressure on at least one series
+
+Micro-benchmarks then time each indicator on longer series, and can be compared
+with a previous run.
+
+    python benchmarks/indicator_regression.py                    # check and benchmark
+    python benchmarks/indicator_regression.py --update           # after an intended change
+    python benchmarks/indicator_regression.py --output after.json --baseline before.json
+
+An optimized engine, eg a vectorized or tail-only one, is checked and timed in
+place of `apply_indicator` with `--engine module:function`, where `function(indicator, asset)`
+adds the columns of `indicator` to `asset.klines`. `--tail 5` only compares the last 5 bars.
+"""
+import argparse
+import importlib
+import json
+import os
+import sys
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+from typing import Callable, Dict, List, Tuple
+
+sys.path.append(os.getcwd())
+
+import numpy as np
+import pandas as pd
+from models.asset import Stock
+from models.indicator import (
+    EMA,
+    MACD,
+    RSI,
+    CipherB,
+    CustomCondition,
+    Indicator,
+    SentimentScore,
+    StochRSI,
+)
+
+GOLDEN_DIRECTORY = Path(__file__).parent / "golden"
+NB_FIXTURE_BARS = 300
+
+CASES: Dict[str, List[Indicator]] = {
+    "RSI": [RSI()],
+    "StochRSI": [StochRSI()],
+    "EMA": [EMA()],
+    "MACD": [MACD()],
+    "CipherB": [CipherB()],
+    "SentimentScore": [SentimentScore()],
+    "CustomCondition": [
+        RSI(),
+        MACD(),
+        CustomCondition(
+            buy_condition="cross_above(macd, macdsignal) & RSI < 50",
+            sell_condition="cross_below(macd, macdsignal) & RSI > 50",
+        ),
+    ],
+}
+"""Indicators of each case, in order: the last one is checked, the others compute its inputs"""
+
+
+def apply_indicator(indicator: Indicator, asset: Stock) -> pd.DataFrame:
+    """Reference engine."""
+    return indicator.apply_indicator(asset)
+
+
+def _klines(close: np.ndarray, seed: int) -> pd.DataFrame:
+    """Klines and sentiment score around a close price series."""
+    rng = np.random.default_rng(seed)
+    nb_bars = len(close)
+    index = pd.bdate_range(end="2022-12-30", periods=nb_bars, tz="UTC", name="Datetime")
+    index = index + pd.Timedelta(hours=5)
+    spread = np.abs(rng.normal(0, 0.01, nb_bars)) * close
+    open_ = close + rng.normal(0, 0.005, nb_bars) * close
+    return pd.DataFrame(
+        {
+            "Open": open_,
+            "High": np.maximum(close, open_) + spread,
+            "Low": np.minimum(close, open_) - spread,
+            "Close": close,
+            "Volume": rng.integers(100_000, 10_000_000, nb_bars).astype("float64"),
+            "score": np.round(rng.normal(0, 0.15, nb_bars), 3),
+        },
+        index=index,
+    )
+
+
+def fixture_series(nb_bars: int = NB_FIXTURE_BARS) -> Dict[str, pd.DataFrame]:
+    """Price series giving buy and sell pressure to every indicator: a random walk,
+    a trend reversal and a trending oscillation."""
+    bars = np.arange(nb_bars)
+    half = nb_bars // 2
+    random_walk = 100 * np.exp(
+        np.cumsum(np.random.default_rng(1).normal(0, 0.02, nb_bars))
+    )
+    trend_reversal = 100 * np.exp(
+        np.concatenate(
+            [np.linspace(0, 0.8, half), np.linspace(0.8, 0, nb_bars - half)]
+        )
+        + np.random.default_rng(2).normal(0, 0.01, nb_bars)
+    )
+    oscillation = 100 + 10 * np.sin(2 * np.pi * bars / 40) + np.linspace(0, 20, nb_bars)
+    return {
+        "random_walk": _klines(random_walk, 1),
+        "trend_reversal": _klines(trend_reversal, 2),
+        "oscillation": _klines(oscillation, 3),
+    }
+
+
+def read_prices() -> Dict[str, pd.DataFrame]:
+    prices = pd.read_csv(
+        GOLDEN_DIRECTORY / "prices.csv", index_col="Datetime", parse_dates=["Datetime"]
+    )
+    return {
+        name: series.drop(columns="series")
+        for name, series in prices.groupby("series", sort=False)
+    }
+
+
+def run_case(
+    case: str, klines: pd.DataFrame, engine: Callable = apply_indicator
+) -> Tuple[pd.DataFrame, List[str]]:
+    """Applies the indicators of `case` on a copy of `klines`.
+
+    Returns:
+        Tuple[pd.DataFrame, List[str]]: klines with the indicator columns, and the columns
+            added by the checked indicator
+    """
+    asset = Stock(symbol=case)
+    asset.klines = klines.copy()
+    *inputs, indicator = CASES[case]
+    for input_indicator in inputs:
+        apply_indicator(input_indicator, asset)
+    columns_before = list(asset.klines.columns)
+    engine(indicator, asset)
+    added_columns = [
+        column for column in asset.klines.columns if column not in columns_before
+    ]
+    return asset.klines, added_columns
+
+
+def golden_columns(case: str, added_columns: List[str]) -> List[str]:
+    """Columns compared with the golden output: the flag, or every added column."""
+    flag_column = CASES[case][-1].flag_column
+    return [flag_column] if flag_column is not None else added_columns
+
+
+def update_golden() -> None:
+    """Writes the fixture prices and the golden outputs of the reference engine."""
+    GOLDEN_DIRECTORY.mkdir(parents=True, exist_ok=True)
+    series = fixture_series()
+    pd.concat(
+        [klines.assign(series=name) for name, klines in series.items()]
+    ).to_csv(GOLDEN_DIRECTORY / "prices.csv", float_format="%.10g")
+    prices = read_prices()
+
+    columns = {}
+    for case in CASES:
+        outputs = []
+        for name, klines in prices.items():
+            klines, added_columns = run_case(case, klines)
+            output = klines[golden_columns(case, added_columns)]
+            outputs.append(output.assign(series=name))
+        columns[case] = added_columns
+        pd.concat(outputs).to_csv(GOLDEN_DIRECTORY / f"{case}.csv", float_format="%.10g")
+    with open(GOLDEN_DIRECTORY / "columns.json", "w") as columns_file:
+        json.dump(columns, columns_file, indent=4)
+
+
+def check(engine: Callable = apply_indicator, tail: int = None) -> List[str]:
+    """Compares the outputs of `engine` with the golden outputs.
+
+    Args:
+        engine (Callable): applies an indicator on an asset, eg `apply_indicator`
+        tail (int): only compare the last `tail` bars. Defaults to every bar.
+
+    Returns:
+        List[str]: differences found, empty if the outputs are equal
+    """
+    prices = read_prices()
+    with open(GOLDEN_DIRECTORY / "columns.json") as columns_file:
+        expected_columns = json.load(columns_file)
+    problems = []
+    for case in CASES:
+        golden = pd.read_csv(
+            GOLDEN_DIRECTORY / f"{case}.csv",
+            index_col="Datetime",
+            parse_dates=["Datetime"],
+        )
+        pressures = set()
+        for name, klines in prices.items():
+            klines, added_columns = run_case(case, klines, engine)
+            if added_columns != expected_columns[case]:
+                problems.append(
+                    f"{case} adds the columns {added_columns} on {name}, "
+                    + f"expected {expected_columns[case]}"
+                )
+            expected = golden[golden["series"] == name]
+            for column in golden_columns(case, expected_columns[case]):
+                if column not in klines.columns:
+                    problems.append(f"{case} does not compute {column} on {name}")
+                    continue
+                actual = klines[column].to_numpy(dtype="float64")
+                wanted = expected[column].to_numpy(dtype="float64")
+                if tail is not None:
+                    actual, wanted = actual[-tail:], wanted[-tail:]
+                if column == CASES[case][-1].flag_column:
+                    pressures |= set(np.sign(actual[actual != 0]))
+                    different = np.flatnonzero(actual != wanted)
+                else:
+                    different = np.flatnonzero(
+                        ~np.isclose(actual, wanted, rtol=1e-7, equal_nan=True)
+                    )
+                if len(different) > 0:
+                    problems.append(
+                        f"{case}: {len(different)} bars of {column} differ on {name}, "
+                        + f"first at bar {different[0]}"
+                    )
+        if CASES[case][-1].flag_column is not None and tail is None:
+            for pressure, direction in [(1, "buy"), (-1, "sell")]:
+                if pressure not in pressures:
+                    problems.append(f"{case} never gives {direction} pressure")
+    return problems
+
+
+def benchmark(
+    engine: Callable = apply_indicator,
+    sizes: List[int] = [250, 1000, 5000],
+    repeat: int = 20,
+) -> List[dict]:
+    """Median time of each indicator, on random walks of `sizes` bars.
+    The input indicators of a case are applied beforehand, and are not timed."""
+    results = []
+    for nb_bars in sizes:
+        klines = _klines(
+            100 * np.exp(np.cumsum(np.random.default_rng(0).normal(0, 0.02, nb_bars))), 0
+        )
+        for case, indicators in CASES.items():
+            *inputs, indicator = indicators
+            base = Stock(symbol=case)
+            base.klines = klines.copy()
+            for input_indicator in inputs:
+                apply_indicator(input_indicator, base)
+            durations = []
+            for _ in range(repeat):
+                asset = Stock(symbol=case)
+                asset.klines = base.klines.copy()
+                start = perf_counter()
+                engine(indicator, asset)
+                durations.append(perf_counter() - start)
+            results.append(
+                {
+                    "indicator": case,
+                    "bars": nb_bars,
+                    "median_ms": 1000 * median(durations),
+                    "min_ms": 1000 * min(durations),
+                }
+            )
+    return results
+
+
+def compare(results: List[dict], baseline: List[dict], max_slowdown: float) -> List[str]:
+    """Indicators slower than `max_slowdown` times their time in `baseline`."""
+    baseline_times = {
+        (result["indicator"], result["bars"]): result["median_ms"] for result in baseline
+    }
+    problems = []
+    for result in results:
+        previous = baseline_times.get((result["indicator"], result["bars"]))
+        if previous is not None and result["median_ms"] > max_slowdown * previous:
+            problems.append(
+                f"{result['indicator']} on {result['bars']} bars: "
+                + f"{previous:.2f}ms -> {result['median_ms']:.2f}ms"
+            )
+    return problems
+
+
+def load_engine(path: str) -> Callable:
+    module_name, _, function_name = path.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--update", action="store_true", help="write the golden outputs of the indicators"
+    )
+    parser.add_argument(
+        "--engine",
+        default=None,
+        help="module:function applying an indicator, instead of apply_indicator",
+    )
+    parser.add_argument(
+        "--tail", type=int, default=None, help="only compare the last bars"
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[250, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--skip-benchmark", action="store_true")
+    parser.add_argument("--output", type=Path, help="JSON file to write the timings to")
+    parser.add_argument("--baseline", type=Path, help="timings of a previous run")
+    parser.add_argument(
+        "--max-slowdown",
+        type=float,
+        default=1.5,
+        help="maximum ratio to the baseline timings",
+    )
+    args = parser.parse_args()
+
+    if args.update:
+        update_golden()
+        print(f"Golden outputs written in {GOLDEN_DIRECTORY}")
+        sys.exit(0)
+
+    engine = apply_indicator if args.engine is None else load_engine(args.engine)
+    problems = check(engine, args.tail)
+    print(f"{len(CASES)} indicators checked, {len(problems)} differences.")
+
+    if not args.skip_benchmark:
+        results = benchmark(engine, args.sizes, args.repeat)
+        for result in results:
+            print(json.dumps(result))
+        if args.output is not None:
+            with open(args.output, "w") as output_file:
+                json.dump(results, output_file, indent=4)
+        if args.baseline is not None:
+            with open(args.baseline) as baseline_file:
+                problems += compare(results, json.load(baseline_file), args.max_slowdown)
+
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    sys.exit(1 if len(problems) > 0 else 0)
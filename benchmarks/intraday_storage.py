@@ -0,0 +1,121 @@
+"""Benchmark of the intraday klines storage, on a synthetic universe.
+
+Writes `--months` months of `--interval` klines for `--symbols` symbols, appends one
+more session to every symbol, then reads the last sessions and the full history back.
+
+    python benchmarks/intraday_storage.py --symbols 500 --months 12 --interval 15m
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+sys.path.append(os.getcwd())
+
+import numpy as np
+import pandas as pd
+from get_data.ohlcv import save_klines, select_klines
+
+BARS_PER_SESSION = {"15m": 26, "1h": 7}
+"""Number of klines in a regular US session (9:30 - 16:00)"""
+
+
+def synthetic_intraday_klines(
+    nb_sessions: int, interval: str, seed: int, first_session: str = "2022-01-03"
+) -> pd.DataFrame:
+    """Random walk of intraday klines during the US regular sessions.
+
+    Args:
+        nb_sessions (int): number of sessions
+        interval (str): intraday timeframe, eg `15m`.
+        seed (int): seed of the random walk
+        first_session (str): date of the first session
+
+    Returns:
+        pd.DataFrame: klines
+    """
+    sessions = pd.bdate_range(first_session, periods=nb_sessions, tz="UTC")
+    offsets = pd.timedelta_range(
+        "14:30:00",
+        periods=BARS_PER_SESSION[interval],
+        freq={"15m": "15min", "1h": "1h"}[interval],
+    )
+    index = (sessions.values[:, None] + offsets.values[None, :]).ravel()
+    index = pd.DatetimeIndex(index, tz="UTC", name="Datetime")
+
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.002, len(index))))
+    spread = np.abs(rng.normal(0, 0.001, len(index))) * close
+    return pd.DataFrame(
+        {
+            "Close": close,
+            "High": close + spread,
+            "Low": close - spread,
+            "Open": np.roll(close, 1),
+            "Volume": rng.integers(1_000, 100_000, len(index)).astype("float64"),
+            "Weighted Volume": close,
+        },
+        index=index,
+    )
+
+
+def run(nb_symbols: int, nb_months: int, interval: str, directory: Path) -> dict:
+    nb_sessions = 21 * nb_months
+    symbols = [f"SYM{i:05d}" for i in range(nb_symbols)]
+    universe = {
+        symbol: synthetic_intraday_klines(nb_sessions + 1, interval, seed)
+        for seed, symbol in enumerate(symbols)
+    }
+    results = {
+        "symbols": nb_symbols,
+        "months": nb_months,
+        "interval": interval,
+        "rows": int(sum(len(klines) for klines in universe.values())),
+    }
+
+    start = perf_counter()
+    for symbol, klines in universe.items():
+        save_klines(klines.iloc[: -BARS_PER_SESSION[interval]], symbol, interval, directory)
+    results["initial_write_s"] = perf_counter() - start
+
+    # the nightly job re-sends overlapping klines: only the new session is appended
+    start = perf_counter()
+    for symbol, klines in universe.items():
+        save_klines(klines.iloc[-2 * BARS_PER_SESSION[interval] :], symbol, interval, directory)
+    results["append_one_session_s"] = perf_counter() - start
+
+    for nb_read_sessions in [1, 5]:
+        start = perf_counter()
+        for symbol in symbols:
+            select_klines(symbol, interval, directory, nb_sessions=nb_read_sessions)
+        results[f"read_last_{nb_read_sessions}_sessions_s"] = perf_counter() - start
+
+    start = perf_counter()
+    for symbol in symbols:
+        select_klines(symbol, interval, directory)
+    results["read_full_history_s"] = perf_counter() - start
+
+    results["disk_mb"] = (
+        sum(f.stat().st_size for f in Path(directory).glob("**/*.csv")) / 1e6
+    )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--interval", choices=list(BARS_PER_SESSION), default="15m")
+    parser.add_argument("--output", type=Path, help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = run(args.symbols, args.months, args.interval, Path(directory))
+
+    print(json.dumps(results, indent=4))
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=4)
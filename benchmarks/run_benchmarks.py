@@ -0,0 +1,246 @@
+"""Benchmark suite of the load, scan and render stages, on synthetic universes.
+
+For each (number of symbols, number of bars) of the scaling matrix, a universe is
+written by `benchmarks/synthetic.py`, then the suite times:
+
+    * load: `load_stocks_indices`
+    * scan: `compute_score` and `compute_results`, for each indicator combination
+    * render: `indicator_histogram` and `mutliple_row_charts`, at full resolution and downsampled
+
+Results are written as JSON, along with the commit they were measured on, and can
+be compared with the results of another commit:
+
+    python benchmarks/run_benchmarks.py --symbols 50 200 --bars 250 1000 --output before.json
+    python benchmarks/run_benchmarks.py --symbols 50 200 --bars 250 1000 --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+from typing import Callable, Dict, List, Tuple
+
+sys.path.append(os.getcwd())
+
+from app.plotting import indicator_histogram, mutliple_row_charts
+from benchmarks.synthetic import write_universe
+from models.asset import compute_results, compute_score, load_stocks_indices
+from models.indicator import EMA, MACD, RSI, CipherB, SentimentScore, StochRSI
+from models.scan import ScoreIndex
+
+COMBINATIONS = {
+    "RSI": [RSI],
+    "StochRSI": [StochRSI],
+    "EMA": [EMA],
+    "MACD": [MACD],
+    "CipherB": [CipherB],
+    "SentimentScore": [SentimentScore],
+    "default": [RSI, StochRSI, EMA, MACD, CipherB, SentimentScore],
+}
+"""Indicator combinations scanned, by name"""
+CHART_MAX_POINTS = 500
+"""Maximum number of points per trace of the downsampled charts, as in config.toml"""
+
+
+def repeat_timing(function: Callable, repeat: int) -> Tuple[List[float], object]:
+    """Times `repeat` calls of `function`.
+
+    Returns:
+        Tuple[List[float], object]: durations in seconds, and the result of the last call
+    """
+    durations = []
+    for _ in range(repeat):
+        start = perf_counter()
+        result = function()
+        durations.append(perf_counter() - start)
+    return durations, result
+
+
+def measure(
+    stage: str, durations: List[float], nb_symbols: int, nb_bars: int, **parameters
+) -> dict:
+    result = {
+        "stage": stage,
+        "symbols": nb_symbols,
+        "bars": nb_bars,
+        **parameters,
+        "median_s": median(durations),
+        "min_s": min(durations),
+        "repeat": len(durations),
+    }
+    print(json.dumps(result), file=sys.stderr)
+    return result
+
+
+def run_universe(
+    path_to_datasets: Path,
+    index_symbols: List[str],
+    stock_symbols: List[str],
+    nb_bars: int,
+    combinations: List[str],
+    repeat: int,
+) -> List[dict]:
+    """Times every stage on the universe written in `path_to_datasets`."""
+    nb_symbols = len(stock_symbols)
+    results = []
+
+    durations, (indices, stocks, _) = repeat_timing(
+        lambda: load_stocks_indices(index_symbols, stock_symbols, path_to_datasets),
+        repeat,
+    )
+    results.append(measure("load", durations, nb_symbols, nb_bars))
+
+    scan_results = None
+    for combination in combinations:
+        indicators = [indicator() for indicator in COMBINATIONS[combination]]
+        durations, _ = repeat_timing(lambda: compute_score(stocks, indicators), repeat)
+        results.append(
+            measure(
+                "compute_score", durations, nb_symbols, nb_bars, combination=combination
+            )
+        )
+        durations, scan_results = repeat_timing(
+            lambda: compute_results(stocks, indicators), repeat
+        )
+        results.append(
+            measure(
+                "compute_results", durations, nb_symbols, nb_bars, combination=combination
+            )
+        )
+
+    # the figures of the last combination, the most complete one by default
+    index_scores = ScoreIndex.from_results([], indices)
+    stock_scores = ScoreIndex.from_results(scan_results, stocks)
+    durations, _ = repeat_timing(
+        lambda: indicator_histogram(index_scores, stock_scores), repeat
+    )
+    results.append(measure("indicator_histogram", durations, nb_symbols, nb_bars))
+
+    stock = stock_scores.view(stock_symbols[0])
+    flag_columns = [
+        indicator().flag_column
+        for indicator in COMBINATIONS[combinations[-1]]
+        if indicator().flag_column in stock.klines.columns
+    ]
+    for max_points in [None, CHART_MAX_POINTS]:
+        durations, _ = repeat_timing(
+            lambda: mutliple_row_charts(stock, ["Volume"], flag_columns, max_points),
+            repeat,
+        )
+        results.append(
+            measure(
+                "mutliple_row_charts",
+                durations,
+                nb_symbols,
+                nb_bars,
+                max_points=max_points,
+            )
+        )
+    return results
+
+
+def git_commit() -> Dict[str, object]:
+    """Commit the benchmarks run on, and whether the working tree had local changes."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": len(status.strip()) > 0}
+
+
+def result_key(result: dict) -> Tuple:
+    return tuple(
+        (name, value)
+        for name, value in sorted(result.items())
+        if name not in ["median_s", "min_s", "repeat"]
+    )
+
+
+def compare(results: List[dict], baseline: dict) -> None:
+    """Prints the ratio of each median duration to the one of the same measure in `baseline`."""
+    baseline_results = {
+        result_key(result): result for result in baseline["results"]
+    }
+    print(f"Compared with {baseline.get('commit')}:")
+    for result in results:
+        previous = baseline_results.get(result_key(result))
+        if previous is None:
+            continue
+        parameters = ", ".join(f"{name}={value}" for name, value in result_key(result))
+        ratio = result["median_s"] / previous["median_s"]
+        print(
+            f"  {parameters}: {previous['median_s']:.3f}s -> {result['median_s']:.3f}s "
+            + f"(x{ratio:.2f})"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--symbols", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--bars", type=int, nargs="+", default=[250, 1000])
+    parser.add_argument("--indices", type=int, default=2)
+    parser.add_argument(
+        "--combinations",
+        nargs="+",
+        choices=list(COMBINATIONS),
+        default=list(COMBINATIONS),
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=Path, help="JSON file to write the results to")
+    parser.add_argument("--compare", type=Path, help="results of a previous run")
+    args = parser.parse_args()
+
+    results = []
+    for nb_symbols in args.symbols:
+        for nb_bars in args.bars:
+            with tempfile.TemporaryDirectory() as directory:
+                index_symbols, stock_symbols = write_universe(
+                    Path(directory), nb_symbols, nb_bars, args.indices
+                )
+                results += run_universe(
+                    Path(directory),
+                    index_symbols,
+                    stock_symbols,
+                    nb_bars,
+                    args.combinations,
+                    args.repeat,
+                )
+
+    report = {
+        **git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "parameters": {
+            "symbols": args.symbols,
+            "bars": args.bars,
+            "indices": args.indices,
+            "combinations": args.combinations,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            compare(results, json.load(baseline_file))
@@ -0,0 +1,145 @@
+"""Check of the sharded scans, with several workers on localhost.
+
+A synthetic universe is scanned through `ScanCoordinator`, along with symbols
+without dataset. Before the workers start, two faulty workers each take a
+shard: one dies at once, the other stalls past the shard timeout. Every other
+symbol must still be scored exactly once, and only the missing symbols
+reported as failed, whatever the shard they are in.
+
+    python benchmarks/sharding_check.py
+    python benchmarks/sharding_check.py --symbols 200 --shard-size 16 --workers 4
+"""
+import argparse
+import os
+import secrets
+import sys
+import tempfile
+import threading
+from collections import Counter
+from multiprocessing.connection import Client
+from pathlib import Path
+from typing import List, Tuple
+
+sys.path.append(os.getcwd())
+
+from benchmarks.synthetic import write_universe
+from models.indicator import RSI
+from models.sharding import ScanCoordinator, start_local_workers
+
+MISSING_SYMBOLS = ["MISSING", "NOPE"]
+"""Symbols scanned without dataset"""
+
+
+def faulty_worker(
+    address: Tuple[str, int],
+    authkey: bytes,
+    received: threading.Event,
+    release: threading.Event = None,
+) -> None:
+    """Worker taking a single shard without ever answering: it disconnects at once,
+    like a dead worker, or once `release` is set, like a stalled one."""
+    connection = Client(address, authkey=authkey)
+    connection.send(("ready", "faulty"))
+    connection.recv()
+    received.set()
+    if release is not None:
+        release.wait()
+    connection.close()
+
+
+def check(
+    nb_symbols: int,
+    shard_size: int,
+    nb_workers: int,
+    shard_timeout: float = 5,
+    timeout: float = 60,
+) -> List[str]:
+    """Scans a synthetic universe and the missing symbols on `nb_workers` local workers,
+    after a dead and a stalled worker took a shard each. A shard lost by the
+    coordinator leaves its symbols unscored once the scan times out after `timeout`.
+
+    Returns:
+        List[str]: problems found, empty if the scan is correct
+    """
+    problems = []
+    try:
+        ScanCoordinator(("localhost", 0), b"")
+        problems.append("the coordinator accepts an empty authkey")
+    except ValueError:
+        pass
+
+    authkey = secrets.token_bytes(16)
+    with tempfile.TemporaryDirectory() as directory:
+        index_symbols, stock_symbols = write_universe(
+            Path(directory), nb_symbols, 100, nb_indices=2
+        )
+        with ScanCoordinator(
+            ("localhost", 0),
+            authkey,
+            shard_size=shard_size,
+            shard_timeout=shard_timeout,
+        ) as coordinator:
+            dead, stalled = threading.Event(), threading.Event()
+            release = threading.Event()
+            faulty_workers = [
+                threading.Thread(
+                    target=faulty_worker, args=(coordinator.address, authkey, dead)
+                ),
+                threading.Thread(
+                    target=faulty_worker,
+                    args=(coordinator.address, authkey, stalled, release),
+                ),
+            ]
+            workers = []
+
+            def start_workers() -> None:
+                # once the faulty workers hold their shard, so that both faults happen
+                dead.wait(60)
+                stalled.wait(60)
+                workers.extend(
+                    start_local_workers(
+                        nb_workers, coordinator.address, authkey, Path(directory)
+                    )
+                )
+
+            starter = threading.Thread(target=start_workers)
+            for thread in faulty_workers + [starter]:
+                thread.start()
+            index_scores, stock_scores, failed_symbols = coordinator.scan(
+                index_symbols, stock_symbols + MISSING_SYMBOLS, [RSI()], timeout=timeout
+            )
+            release.set()
+            starter.join()
+            for thread in faulty_workers:
+                thread.join()
+        for worker in workers:
+            worker.join()
+
+    if not dead.is_set() or not stalled.is_set():
+        problems.append("the faulty workers did not receive a shard")
+
+    counts = Counter(score.symbol for score in index_scores + stock_scores)
+    for symbol in index_symbols + stock_symbols:
+        if counts[symbol] != 1:
+            problems.append(f"{symbol} scored {counts[symbol]} times")
+    if sorted(failed_symbols) != sorted(MISSING_SYMBOLS):
+        problems.append(f"failed symbols: {failed_symbols}, expected {MISSING_SYMBOLS}")
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--symbols", type=int, default=30)
+    parser.add_argument("--shard-size", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--shard-timeout", type=float, default=5)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    problems = check(
+        args.symbols, args.shard_size, args.workers, args.shard_timeout, args.timeout
+    )
+    print(f"Sharded scan checked on {args.workers} workers, {len(problems)} problems.")
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    sys.exit(1 if len(problems) > 0 else 0)
@@ -0,0 +1,121 @@
+"""Synthetic universe generator, writing datasets in the `datasets/daily` layout:
+
+    ohlcv/{symbol}_1d.csv, sentiment/{symbol}_1d.csv and financial/{symbol}.json
+
+    python benchmarks/synthetic.py --symbols 500 --bars 500 --output /tmp/synthetic
+"""
+import argparse
+import json
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def synthetic_klines(nb_bars: int, seed: int, last_day: str = "2022-12-30") -> pd.DataFrame:
+    """Random walk of daily klines, on business days.
+
+    Args:
+        nb_bars (int): number of klines
+        seed (int): seed of the random walk
+        last_day (str): date of the last kline
+
+    Returns:
+        pd.DataFrame: klines, with the columns fetched from Alpaca
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range(end=last_day, periods=nb_bars, tz="UTC", name="Datetime")
+    index = index + pd.Timedelta(hours=5)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, nb_bars)))
+    spread = np.abs(rng.normal(0, 0.01, nb_bars)) * close
+    open_ = close + rng.normal(0, 0.005, nb_bars) * close
+    return pd.DataFrame(
+        {
+            "Close": close,
+            "High": np.maximum(close, open_) + spread,
+            "Low": np.minimum(close, open_) - spread,
+            "Open": open_,
+            "Volume": rng.integers(100_000, 10_000_000, nb_bars).astype("float64"),
+            "Weighted Volume": (close + open_) / 2,
+        },
+        index=index,
+    )
+
+
+def synthetic_sentiment(klines: pd.DataFrame, seed: int) -> pd.DataFrame:
+    """Daily sentiment scores, on a random subset of the days of `klines`."""
+    rng = np.random.default_rng(seed)
+    days = klines.index.normalize()
+    days = days[rng.random(len(days)) < 0.3]
+    return pd.DataFrame(
+        {"score": rng.normal(0, 0.3, len(days))},
+        index=days.rename("Datetime"),
+    )
+
+
+def synthetic_financials(symbol: str, klines: pd.DataFrame, seed: int) -> dict:
+    """Financials, with the keys fetched from Yahoo Finance."""
+    rng = np.random.default_rng(seed)
+    close = klines["Close"]
+    return {
+        "longName": f"{symbol} Inc.",
+        "shortName": symbol,
+        "industry": "Synthetic",
+        "marketCap": int(10 ** rng.uniform(9, 12.5)),
+        "dayLow": float(klines["Low"].iloc[-1]),
+        "dayHigh": float(klines["High"].iloc[-1]),
+        "yearChange": float(close.iloc[-1] / close.iloc[-min(len(close), 252)] - 1),
+        "tenDayAverageVolume": int(klines["Volume"].iloc[-10:].mean()),
+        "twoHundredDayAverage": float(close.iloc[-200:].mean()),
+    }
+
+
+def write_universe(
+    path_to_datasets: Path,
+    nb_symbols: int,
+    nb_bars: int,
+    nb_indices: int = 0,
+    seed: int = 0,
+) -> Tuple[List[str], List[str]]:
+    """Writes a synthetic universe of `nb_indices` indices and `nb_symbols` stocks.
+
+    Args:
+        path_to_datasets (Path): directory to write the datasets in, eg `datasets/daily/`
+        nb_symbols (int): number of stocks
+        nb_bars (int): number of daily klines per asset
+        nb_indices (int, optional): number of indices. Defaults to 0.
+        seed (int, optional): seed of the generator. Defaults to 0.
+
+    Returns:
+        Tuple[List[str], List[str]]: symbols of the indices and of the stocks
+    """
+    path_to_datasets = Path(path_to_datasets)
+    for kind in ["ohlcv", "sentiment", "financial"]:
+        (path_to_datasets / kind).mkdir(parents=True, exist_ok=True)
+
+    index_symbols = [f"IDX{i:04d}" for i in range(nb_indices)]
+    stock_symbols = [f"SYM{i:05d}" for i in range(nb_symbols)]
+    for i, symbol in enumerate(index_symbols + stock_symbols):
+        klines = synthetic_klines(nb_bars, seed + i)
+        klines.to_csv(path_to_datasets / "ohlcv" / f"{symbol}_1d.csv")
+        if symbol in index_symbols:
+            continue
+        synthetic_sentiment(klines, seed + i).to_csv(
+            path_to_datasets / "sentiment" / f"{symbol}_1d.csv"
+        )
+        with open(path_to_datasets / "financial" / f"{symbol}.json", "w") as outfile:
+            json.dump(synthetic_financials(symbol, klines, seed + i), outfile, indent=4)
+    return index_symbols, stock_symbols
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--indices", type=int, default=4)
+    parser.add_argument("--bars", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, required=True)
+    args = parser.parse_args()
+
+    write_universe(args.output, args.symbols, args.bars, args.indices, args.seed)
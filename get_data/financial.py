@@ -1,11 +1,9 @@
 import json
 from datetime import datetime
 from pathlib import Path
-from pstats import Stats
 
 import pandas as pd
 import pytz
-import yfinance as yf
 
 FORMAT = "%d-%m-%Y"
 """Expected datetime format"""
@@ -20,6 +18,9 @@ def fetch_financials(symbol: str, **kwargs) -> dict:
     Returns:
         dict: dict containing selected financials.
     """
+    # imported here: the workers loading the datasets never download anything
+    import yfinance as yf
+
     stats = yf.Ticker(symbol.replace(".", "-")).fast_info
     # financial_keys = [
     #     ["price", "longName"],
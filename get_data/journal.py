@@ -0,0 +1,288 @@
+"""Journal of an update run, to resume it after a crash or a restart.
+
+Each (symbol, dataset kind) updated by the run is recorded as done, skipped or
+failed in `{path_to_datasets}/.update/journal.jsonl`, written line by line. The
+fetched files are written in a staging directory, `.update/staging/`, with the
+same layout as the datasets. A run started again on the same day resumes the
+journal: it only fetches the datasets which are not done yet, retrying the
+failures, then publishes the staged files of the datasets done, each one replaced
+atomically, and discards the others, eg a file left by a failing fetch. Running
+a complete run again fetches nothing: a new run needs a new run identifier.
+
+A dataset failing `max_attempts` times is skipped, so that a delisted symbol
+does not keep the run open. Once every dataset is done or skipped, the journal
+is archived in `.update/runs/`. The hidden directories are not part of the manifest.
+
+A run can be limited to a plan, eg the stale datasets, stored in the journal to
+resume the same plan. `update_lock` keeps two runs from updating the datasets at
+the same time.
+"""
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+UPDATE_DIRECTORY = ".update"
+"""Directory, relative to the datasets, of the journal and of the staged files"""
+JOURNAL_FILENAME = "journal.jsonl"
+STAGING_DIRECTORY = "staging"
+RUNS_DIRECTORY = "runs"
+LOCK_FILENAME = "lock"
+DONE, SKIPPED, FAILED = "done", "skipped", "failed"
+
+
+class UpdateJournal:
+    """Journal of the update run `run_id`, see `UpdateJournal.open`."""
+
+    def __init__(
+        self, path_to_datasets: Path, run_id: str, max_attempts: int = 3
+    ) -> None:
+        self.path_to_datasets = Path(path_to_datasets)
+        self.run_id = run_id
+        self.max_attempts = max_attempts
+        self.directory = self.path_to_datasets / UPDATE_DIRECTORY
+        self.filename = self.directory / JOURNAL_FILENAME
+        self.staging_directory = self.directory / STAGING_DIRECTORY
+        self.statuses: Dict[Tuple[str, str], str] = {}
+        """(symbol, dataset kind) -> last status"""
+        self.attempts: Dict[Tuple[str, str], int] = {}
+        """(symbol, dataset kind) -> number of failures"""
+        self.paths: Dict[Tuple[str, str], str] = {}
+        """(symbol, dataset kind) -> path of the dataset, relative to the datasets"""
+        self.plan: Optional[Dict[str, List[str]]] = None
+        """dataset kind -> symbols to update. None to update every dataset."""
+        self.resumed = False
+
+    @classmethod
+    def open(
+        cls,
+        path_to_datasets: Path,
+        run_id: str = None,
+        max_attempts: int = 3,
+        plan: Dict[str, List[str]] = None,
+    ) -> "UpdateJournal":
+        """Resumes the journal of `run_id`, or starts it. The journal of a previous run
+        is archived, and its staged files are discarded.
+
+        Args:
+            path_to_datasets (Path): path of the datasets to update
+            run_id (str): identifier of the run. Defaults to the current UTC date.
+            max_attempts (int): failures after which a dataset is skipped. Defaults to 3.
+            plan (Dict[str, List[str]]): dataset kind -> symbols to update, for a new run.
+                Defaults to None, every dataset is updated. A resumed run keeps its plan.
+
+        Returns:
+            UpdateJournal: journal
+        """
+        if run_id is None:
+            run_id = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        journal = cls(path_to_datasets, run_id, max_attempts)
+        archived_filename = journal.directory / RUNS_DIRECTORY / f"{run_id}.jsonl"
+        if not journal.filename.is_file() and archived_filename.is_file():
+            # the run is complete: running it again fetches nothing
+            os.replace(archived_filename, journal.filename)
+        if journal.filename.is_file():
+            entries = journal._read()
+            if len(entries) > 0 and entries[0].get("run") == run_id:
+                journal.plan = entries[0].get("plan")
+                journal._replay(entries[1:])
+                journal.resumed = True
+                return journal
+            journal._archive()
+        shutil.rmtree(journal.staging_directory, ignore_errors=True)
+        journal.plan = plan
+        header = {"run": run_id, "started_at": datetime.now(timezone.utc).isoformat()}
+        if plan is not None:
+            header["plan"] = plan
+        journal._append(header)
+        return journal
+
+    @staticmethod
+    def unfinished_run(path_to_datasets: Path) -> Optional[str]:
+        """Identifier of the run whose journal is not archived yet, if any."""
+        filename = Path(path_to_datasets) / UPDATE_DIRECTORY / JOURNAL_FILENAME
+        if not filename.is_file():
+            return None
+        with open(filename) as journal_file:
+            try:
+                return json.loads(journal_file.readline()).get("run")
+            except json.JSONDecodeError:
+                return None
+
+    def _read(self) -> List[dict]:
+        entries = []
+        with open(self.filename) as journal_file:
+            for line in journal_file:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # last line cut by a crash
+                    break
+        return entries
+
+    def _replay(self, entries: List[dict]) -> None:
+        for entry in entries:
+            if "symbol" in entry:
+                self._set(
+                    entry["symbol"], entry["kind"], entry["status"], entry.get("path")
+                )
+
+    def _set(self, symbol: str, kind: str, status: str, path: str = None) -> None:
+        self.statuses[(symbol, kind)] = status
+        if path is not None:
+            self.paths[(symbol, kind)] = path
+        if status == FAILED:
+            self.attempts[(symbol, kind)] = self.attempts.get((symbol, kind), 0) + 1
+
+    def _append(self, entry: dict) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.filename, "a") as journal_file:
+            journal_file.write(json.dumps(entry) + "\n")
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+    def _archive(self) -> None:
+        runs_directory = self.directory / RUNS_DIRECTORY
+        runs_directory.mkdir(parents=True, exist_ok=True)
+        entries = self._read()
+        run_id = entries[0].get("run", "unknown") if len(entries) > 0 else "unknown"
+        os.replace(self.filename, runs_directory / f"{run_id}.jsonl")
+
+    def is_pending(self, symbol: str, kind: str) -> bool:
+        """Whether the `kind` dataset of `symbol` still has to be fetched by the run."""
+        if self.plan is not None and symbol not in self.plan.get(kind, []):
+            return False
+        return self.statuses.get((symbol, kind)) not in [DONE, SKIPPED]
+
+    def record(
+        self, symbol: str, kind: str, status: str, error: str = None, path: str = None
+    ) -> str:
+        """Records the status of the `kind` dataset of `symbol`. A dataset failing for the
+        `max_attempts`-th time is recorded as skipped.
+
+        Args:
+            symbol (str): ticker, eg `AAPL`
+            kind (str): kind of dataset, eg `ohlcv`
+            status (str): DONE, SKIPPED or FAILED
+            error (str): error of a failure. Defaults to None.
+            path (str): path of the dataset relative to the datasets, published if the
+                dataset is done. Defaults to None.
+
+        Returns:
+            str: recorded status
+        """
+        self._set(symbol, kind, status, path)
+        entry = {
+            "symbol": symbol,
+            "kind": kind,
+            "status": status,
+            "at": datetime.now(timezone.utc).isoformat(),
+        }
+        if error is not None:
+            entry["error"] = error
+        if path is not None:
+            entry["path"] = path
+        self._append(entry)
+        if status == FAILED and self.attempts[(symbol, kind)] >= self.max_attempts:
+            return self.record(symbol, kind, SKIPPED, f"failed {self.max_attempts} times")
+        return status
+
+    def failures(self) -> List[Tuple[str, str]]:
+        """(symbol, dataset kind) whose last attempt failed, to retry."""
+        return [key for key, status in self.statuses.items() if status == FAILED]
+
+    def staging_path(self, relative_path: str) -> Path:
+        """Path of a dataset in the staging directory. The published dataset is copied
+        there first, if any, for the functions completing an existing file.
+
+        Args:
+            relative_path (str): path relative to the datasets, eg `financial/AAPL.json`
+
+        Returns:
+            Path: staged path
+        """
+        staged_path = self.staging_directory / relative_path
+        published_path = self.path_to_datasets / relative_path
+        if not staged_path.exists() and published_path.is_file():
+            staged_path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(published_path, staged_path)
+        return staged_path
+
+    def publish(self) -> List[str]:
+        """Moves the staged files of the datasets done to the datasets, and discards the
+        other staged files: a failed or skipped dataset may have left a partial file.
+        Each file is replaced atomically, and publishing again after a crash moves the
+        remaining files.
+
+        Returns:
+            List[str]: published paths, relative to the datasets
+        """
+        published = []
+        if not self.staging_directory.is_dir():
+            return published
+        done_paths = {
+            path for key, path in self.paths.items() if self.statuses.get(key) == DONE
+        }
+        nb_discarded = 0
+        for staged_path in sorted(self.staging_directory.glob("**/*")):
+            if not staged_path.is_file():
+                continue
+            relative_path = staged_path.relative_to(self.staging_directory).as_posix()
+            if relative_path not in done_paths:
+                staged_path.unlink()
+                nb_discarded += 1
+                continue
+            target = self.path_to_datasets / relative_path
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(staged_path, target)
+            published.append(relative_path)
+        self._append(
+            {
+                "published_at": datetime.now(timezone.utc).isoformat(),
+                "files": len(published),
+                "discarded": nb_discarded,
+            }
+        )
+        return published
+
+    def close(self) -> bool:
+        """Archives the journal if every dataset is done or skipped: the next run starts
+        from scratch. Otherwise the journal stays, and a rerun retries the failures.
+
+        Returns:
+            bool: whether the run is complete
+        """
+        if len(self.failures()) > 0:
+            return False
+        self._archive()
+        shutil.rmtree(self.staging_directory, ignore_errors=True)
+        return True
+
+
+@contextmanager
+def update_lock(path_to_datasets: Path) -> Iterator[bool]:
+    """Lock of the datasets, held while updating them.
+
+    Args:
+        path_to_datasets (Path): path of the datasets to update
+
+    Yields:
+        bool: whether the lock was acquired. False if another update is running.
+    """
+    import fcntl
+
+    directory = Path(path_to_datasets) / UPDATE_DIRECTORY
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / LOCK_FILENAME, "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,109 @@
+import hashlib
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from time import monotonic
+from typing import Dict, Set, Tuple
+
+from get_data.ohlcv import INTRADAY_DIRECTORY
+
+Manifest = Dict[str, Tuple[int, int]]
+"""Path of each file, relative to the datasets, -> (size, modification time in ns)"""
+
+
+def build_manifest(path_to_datasets: Path) -> Manifest:
+    """Lists the files of the datasets, with their size and modification time.
+    Hidden directories, which contain derived data (eg resampled klines), are ignored.
+
+    Args:
+        path_to_datasets (Path): path to the datasets, eg `datasets/daily/`
+
+    Returns:
+        Manifest: relative path -> (size, modification time in ns)
+    """
+    path_to_datasets = Path(path_to_datasets)
+    manifest = {}
+    for path in path_to_datasets.glob("**/*"):
+        relative_path = path.relative_to(path_to_datasets)
+        if any(part.startswith(".") for part in relative_path.parts):
+            continue
+        if not path.is_file():
+            continue
+        stat = path.stat()
+        manifest[relative_path.as_posix()] = (stat.st_size, stat.st_mtime_ns)
+    return manifest
+
+
+class ThrottledManifest:
+    """Manifest of the datasets, listed again at most every `ttl` seconds.
+    Thread-safe: shared by the sessions or the requests of a process, which would
+    otherwise list every file of the datasets each time."""
+
+    def __init__(self, path_to_datasets: Path, ttl: float = 5) -> None:
+        """
+        Args:
+            path_to_datasets (Path): path to the datasets
+            ttl (float): seconds between two listings of the datasets
+        """
+        self.path_to_datasets = Path(path_to_datasets)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._manifest: Manifest = None
+        self._built_at = None
+
+    def get(self) -> Manifest:
+        with self._lock:
+            if self._manifest is None or monotonic() - self._built_at >= self.ttl:
+                self._manifest = build_manifest(self.path_to_datasets)
+                self._built_at = monotonic()
+            return self._manifest
+
+
+def manifest_version(manifest: Manifest) -> str:
+    """Version of the datasets described by `manifest`:
+    changes whenever a file is added, removed or modified."""
+    digest = hashlib.sha1()
+    for relative_path in sorted(manifest):
+        size, mtime_ns = manifest[relative_path]
+        digest.update(f"{relative_path}:{size}:{mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def dataset_version(path_to_datasets: Path) -> str:
+    """Current version of the datasets at `path_to_datasets`, see `manifest_version`."""
+    return manifest_version(build_manifest(path_to_datasets))
+
+
+def manifest_updated_at(manifest: Manifest) -> datetime:
+    """Last modification time of the datasets, in the local timezone."""
+    last_mtime_ns = max((mtime_ns for _, mtime_ns in manifest.values()), default=0)
+    return datetime.fromtimestamp(last_mtime_ns / 1e9, tz=timezone.utc).astimezone()
+
+
+def symbol_of(relative_path: str) -> str:
+    """Symbol whose data are stored at `relative_path`, eg
+        * `ohlcv/AAPL_1d.csv` -> `AAPL`
+        * `ohlcv/intraday/15m/AAPL/2023-01.csv` -> `AAPL`
+        * `financial/AAPL.json` -> `AAPL`
+    """
+    parts = relative_path.split("/")
+    if len(parts) > 2 and parts[1] == INTRADAY_DIRECTORY:
+        return parts[3]
+    stem = Path(parts[-1]).stem
+    if parts[0] == "financial":
+        return stem
+    return stem.rsplit("_", 1)[0]
+
+
+def changed_symbols(old_manifest: Manifest, new_manifest: Manifest) -> Set[str]:
+    """Symbols having at least one file added, removed or modified between the two manifests.
+
+    Args:
+        old_manifest (Manifest): manifest of the previous version of the datasets
+        new_manifest (Manifest): manifest of the current version of the datasets
+
+    Returns:
+        Set[str]: changed symbols
+    """
+    changed_paths = set(old_manifest.items()) ^ set(new_manifest.items())
+    return set(symbol_of(relative_path) for relative_path, _ in changed_paths)
@@ -0,0 +1,257 @@
+"""Metrics of an update run: requests, downloaded bytes, retries, per-symbol latencies and rows.
+
+The HTTP sessions of the fetching functions report their responses through a
+`requests` hook, see `get_data.ohlcv.retrying_session`. At the end of the run,
+the metrics are written next to the datasets, in a hidden directory which is
+not part of the manifest:
+
+    * `.metrics/update.prom`, in the Prometheus text format (eg for the textfile collector)
+    * `.metrics/update_runs.jsonl`, one JSON record per run, to follow the runs over time
+"""
+import json
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, List, Tuple
+from urllib.parse import urlparse
+
+import numpy as np
+
+METRICS_DIRECTORY = ".metrics"
+"""Directory, relative to the datasets, where the metrics are written"""
+PROMETHEUS_FILENAME = "update.prom"
+RUNS_FILENAME = "update_runs.jsonl"
+QUANTILES = [0.5, 0.9, 0.99]
+PREFIX = "screener_update"
+
+
+def endpoint_of(url: str) -> str:
+    """Endpoint of a request, without the symbol and query, eg `data.alpaca.markets/v2/stocks`."""
+    parsed_url = urlparse(url)
+    path = [part for part in parsed_url.path.split("/") if part != ""]
+    return "/".join([parsed_url.netloc] + path[:2])
+
+
+def count_rows(filename: Path) -> int:
+    """Number of rows of a CSV file, 0 if it does not exist."""
+    if not Path(filename).is_file():
+        return 0
+    with open(filename, "rb") as csv_file:
+        return max(0, sum(1 for _ in csv_file) - 1)
+
+
+class UpdateMetrics:
+    """Metrics of one update run. Thread-safe."""
+
+    def __init__(self) -> None:
+        self.started_at = datetime.now(timezone.utc)
+        self.duration = None
+        self._start = perf_counter()
+        self._lock = threading.Lock()
+        self.requests: Dict[Tuple[str, int], int] = defaultdict(int)
+        """(endpoint, status code) -> number of responses"""
+        self.bytes: Dict[str, int] = defaultdict(int)
+        """endpoint -> bytes downloaded"""
+        self.retries: Dict[Tuple[str, int], int] = defaultdict(int)
+        """(endpoint, status code) -> number of retried responses, eg 429"""
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        """dataset kind -> seconds spent on each symbol"""
+        self.symbols: Dict[Tuple[str, str], int] = defaultdict(int)
+        """(dataset kind, status) -> number of symbols"""
+        self.failed: Dict[str, List[str]] = defaultdict(list)
+        """dataset kind -> symbols which could not be updated"""
+        self.rows: Dict[str, int] = defaultdict(int)
+        """dataset kind -> rows appended"""
+
+    def response_hook(self, response, *args, **kwargs) -> None:
+        """`requests` response hook, eg `session.hooks["response"].append(metrics.response_hook)`."""
+        endpoint = endpoint_of(response.url)
+        # retried responses never reach the hook: urllib3 keeps them in the retry history
+        retries = getattr(getattr(response, "raw", None), "retries", None)
+        history = getattr(retries, "history", ()) or ()
+        with self._lock:
+            self.requests[(endpoint, response.status_code)] += 1
+            self.bytes[endpoint] += len(response.content or b"")
+            for retried in history:
+                self.retries[(endpoint, retried.status or 0)] += 1
+
+    @contextmanager
+    def symbol(self, kind: str, symbol: str):
+        """Times the update of the `kind` dataset of `symbol`.
+        The symbol is counted as failed if the block raises, and the exception is raised again."""
+        start = perf_counter()
+        status = "failed"
+        try:
+            yield
+            status = "done"
+        finally:
+            with self._lock:
+                self.latencies[kind].append(perf_counter() - start)
+                self.symbols[(kind, status)] += 1
+                if status == "failed":
+                    self.failed[kind].append(symbol)
+
+    def skip(self, kind: str, symbol: str) -> None:
+        """Counts the `kind` dataset of `symbol` as skipped, eg already up to date."""
+        with self._lock:
+            self.symbols[(kind, "skipped")] += 1
+
+    def add_rows(self, kind: str, nb_rows: int) -> None:
+        with self._lock:
+            self.rows[kind] += max(0, nb_rows)
+
+    def finish(self) -> None:
+        self.duration = perf_counter() - self._start
+
+    def _latency_stats(self) -> Dict[str, dict]:
+        stats = {}
+        for kind, latencies in self.latencies.items():
+            latencies = np.array(latencies)
+            stats[kind] = {
+                "count": len(latencies),
+                "sum": float(latencies.sum()),
+                "max": float(latencies.max()),
+                **{
+                    f"p{int(100 * quantile)}": float(np.quantile(latencies, quantile))
+                    for quantile in QUANTILES
+                },
+            }
+        return stats
+
+    def to_record(self) -> dict:
+        """JSON record of the run."""
+        with self._lock:
+            return {
+                "started_at": self.started_at.isoformat(),
+                "duration_s": self.duration,
+                "requests": [
+                    {"endpoint": endpoint, "status": status, "count": count}
+                    for (endpoint, status), count in sorted(self.requests.items())
+                ],
+                "bytes": dict(self.bytes),
+                "retries": [
+                    {"endpoint": endpoint, "status": status, "count": count}
+                    for (endpoint, status), count in sorted(self.retries.items())
+                ],
+                "symbol_latency_s": self._latency_stats(),
+                "symbols": [
+                    {"kind": kind, "status": status, "count": count}
+                    for (kind, status), count in sorted(self.symbols.items())
+                ],
+                "rows_appended": dict(self.rows),
+                "failed_symbols": dict(self.failed),
+            }
+
+    def to_prometheus(self) -> str:
+        """Metrics in the Prometheus text exposition format."""
+
+        def metric(name: str, kind: str, help: str, samples: List[Tuple[dict, float]]):
+            lines = [f"# HELP {PREFIX}_{name} {help}", f"# TYPE {PREFIX}_{name} {kind}"]
+            for labels, value in samples:
+                label_str = ",".join(f'{key}="{value}"' for key, value in labels.items())
+                suffix = "{" + label_str + "}" if label_str else ""
+                lines.append(f"{PREFIX}_{name}{suffix} {value}")
+            return lines
+
+        record = self.to_record()
+        lines = []
+        lines += metric(
+            "requests_total",
+            "counter",
+            "HTTP responses received, by endpoint and status code.",
+            [
+                ({"endpoint": row["endpoint"], "status": row["status"]}, row["count"])
+                for row in record["requests"]
+            ],
+        )
+        lines += metric(
+            "downloaded_bytes_total",
+            "counter",
+            "Bytes downloaded, by endpoint.",
+            [
+                ({"endpoint": endpoint}, size)
+                for endpoint, size in record["bytes"].items()
+            ],
+        )
+        lines += metric(
+            "retries_total",
+            "counter",
+            "Responses retried, eg rate limited (429), by endpoint and status code.",
+            [
+                ({"endpoint": row["endpoint"], "status": row["status"]}, row["count"])
+                for row in record["retries"]
+            ],
+        )
+        summary_lines = metric(
+            "symbol_seconds",
+            "summary",
+            "Time spent updating a dataset of a symbol, by dataset kind.",
+            [
+                ({"kind": kind, "quantile": quantile}, stats[f"p{int(100 * quantile)}"])
+                for kind, stats in record["symbol_latency_s"].items()
+                for quantile in QUANTILES
+            ],
+        )
+        for kind, stats in record["symbol_latency_s"].items():
+            summary_lines.append(
+                f'{PREFIX}_symbol_seconds_sum{{kind="{kind}"}} {stats["sum"]}'
+            )
+            summary_lines.append(
+                f'{PREFIX}_symbol_seconds_count{{kind="{kind}"}} {stats["count"]}'
+            )
+        lines += summary_lines
+        lines += metric(
+            "symbols_total",
+            "counter",
+            "Datasets of symbols updated, by dataset kind and status.",
+            [
+                ({"kind": row["kind"], "status": row["status"]}, row["count"])
+                for row in record["symbols"]
+            ],
+        )
+        lines += metric(
+            "rows_appended_total",
+            "counter",
+            "Rows appended to the datasets, by dataset kind.",
+            [
+                ({"kind": kind}, nb_rows)
+                for kind, nb_rows in record["rows_appended"].items()
+            ],
+        )
+        lines += metric(
+            "duration_seconds",
+            "gauge",
+            "Wall time of the last run.",
+            [({}, record["duration_s"] or 0)],
+        )
+        lines += metric(
+            "last_run_timestamp_seconds",
+            "gauge",
+            "Start time of the last run.",
+            [({}, self.started_at.timestamp())],
+        )
+        return "\n".join(lines) + "\n"
+
+    def write(self, path_to_datasets: Path) -> Path:
+        """Writes the Prometheus file, replaced atomically, and appends the JSON record of the run.
+
+        Args:
+            path_to_datasets (Path): path of the updated datasets
+
+        Returns:
+            Path: directory of the metrics
+        """
+        directory = Path(path_to_datasets) / METRICS_DIRECTORY
+        directory.mkdir(parents=True, exist_ok=True)
+        filename = directory / PROMETHEUS_FILENAME
+        with open(filename.with_suffix(".tmp"), "w") as outfile:
+            outfile.write(self.to_prometheus())
+        os.replace(filename.with_suffix(".tmp"), filename)
+        with open(directory / RUNS_FILENAME, "a") as outfile:
+            outfile.write(json.dumps(self.to_record()) + "\n")
+        return directory
+
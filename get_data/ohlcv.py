@@ -1,11 +1,12 @@
+import json
 import os
+import tempfile
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from typing import IO, Callable
 
 import pandas as pd
 import pytz
-import requests
-from requests.adapters import HTTPAdapter, Retry
 
 FORMAT = "%d-%m-%Y"
 """Expected datetime format"""
@@ -15,14 +16,56 @@ INDICES_TRANSLATIONS = {
     "SP500": "SPY",
     "Nasdaq": "NDAQ",
 }
+INTERVALS = {
+    "1d": "1Day",
+    "1h": "1Hour",
+    "15m": "15Min",
+}
+"""Timeframes downloaded from Alpaca, with their Alpaca name"""
+INTRADAY_INTERVALS = ["1h", "15m"]
+"""Timeframes stored in monthly partitions, see `save_intraday_klines`"""
+INTRADAY_DIRECTORY = "intraday"
+"""Directory, relative to the klines directory, where intraday klines are stored"""
+RESAMPLING_RULES = {
+    "1wk": "W",
+    "1mo": "M",
+}
+"""Timeframes built by resampling the daily klines, with their pandas rule"""
+SCAN_INTERVALS = ["1d", *RESAMPLING_RULES, *INTRADAY_INTERVALS]
+"""Timeframes which can be scanned"""
+CACHE_DIRECTORY = ".cache"
+"""Directory, relative to the klines directory, where resampled klines are cached"""
+
+
+def retrying_session(metrics=None):
+    """HTTP session retrying the rate-limited requests, with an exponential backoff.
+
+    `requests` is only imported by the functions downloading data: the workers
+    loading the datasets do not pay for it.
 
+    Args:
+        metrics (UpdateMetrics): metrics of the update run, counting the responses. Defaults to None.
+
+    Returns:
+        requests.Session: session
+    """
+    import requests
+    from requests.adapters import HTTPAdapter, Retry
 
-def get_asset_class(symbol):
+    request_session = requests.Session()
+    retries = Retry(total=7, backoff_factor=2, status_forcelist=[429])
+    request_session.mount("https://", HTTPAdapter(max_retries=retries))
+    if metrics is not None:
+        request_session.hooks["response"].append(metrics.response_hook)
+    return request_session
+
+
+def get_asset_class(symbol, metrics=None):
     api = os.environ.get("ALPACA_API")
     api_secret = os.environ.get("ALPACA_API_SECRET")
     headers = {"Apca-Api-Key-Id": api, "Apca-Api-Secret-Key": api_secret}
     url = f"https://broker-api.alpaca.markets/v1/assets/{symbol}"
-    request = requests.get(url, headers=headers).json()
+    request = retrying_session(metrics).get(url, headers=headers).json()
     return request["class"], request["symbol"]
 
 
@@ -43,13 +86,15 @@ def fetch_klines(
         pd.DataFrame: dataframe containing the klines fetched online.
     """
     symbol = INDICES_TRANSLATIONS.get(symbol, symbol)
-    interval = {"1d": "1Day"}[interval]
+    is_intraday = interval in INTRADAY_INTERVALS
+    interval = INTERVALS[interval]
     api = os.environ.get("ALPACA_API")
     api_secret = os.environ.get("ALPACA_API_SECRET")
     headers = {"Apca-Api-Key-Id": api, "Apca-Api-Secret-Key": api_secret}
 
     querystring = {}
-    symbol_class, symbol = get_asset_class(symbol)
+    metrics = kwargs.get("metrics")
+    symbol_class, symbol = get_asset_class(symbol, metrics)
     if symbol_class in ["us_equity"]:
         url = f"https://data.alpaca.markets/v2/stocks/{symbol}/bars"
     if symbol_class in ["crypto"]:
@@ -59,6 +104,19 @@ def fetch_klines(
     # Alpaca prevents from retrieving the last 15min
     ending_date = datetime.now(timezone.utc) - timedelta(minutes=16)
     beginning_date = pytz.utc.localize(beginning_date)
+    if is_intraday:
+        return _fetch_paginated_klines(
+            url,
+            headers,
+            querystring,
+            symbol,
+            symbol_class,
+            beginning_date,
+            ending_date,
+            interval,
+            metrics,
+        )
+
     klines = []
     while ending_date.day > (beginning_date + timedelta(days=3)).day:
         querystring.update(
@@ -70,9 +128,7 @@ def fetch_klines(
             }
         )
 
-        request_session = requests.Session()
-        retries = Retry(total=7, backoff_factor=2, status_forcelist=[429])
-        request_session.mount("https://", HTTPAdapter(max_retries=retries))
+        request_session = retrying_session(metrics)
         request = request_session.get(url, headers=headers, params=querystring).json()
 
         if symbol_class in ["us_equity"]:
@@ -84,25 +140,7 @@ def fetch_klines(
             if len(request["bars"]) == 0:
                 break
 
-            _klines = pd.DataFrame.from_dict(bars).drop(
-                labels=[
-                    "n",
-                ],
-                axis=1,
-            )
-            _klines = _klines.rename(
-                columns={
-                    "c": "Close",
-                    "h": "High",
-                    "l": "Low",
-                    "o": "Open",
-                    "t": "Datetime",
-                    "v": "Volume",
-                    "vw": "Weighted Volume",
-                }
-            )
-            _klines = _klines.set_index("Datetime", drop=True)
-            _klines.index = pd.to_datetime(_klines.index).tz_convert(pytz.UTC)
+            _klines = _bars_to_klines(bars)
             klines.append(_klines)
 
             ending_date = _klines.index[0]
@@ -115,6 +153,83 @@ def fetch_klines(
     return klines
 
 
+def _bars_to_klines(bars: list) -> pd.DataFrame:
+    """Transforms bars returned by the Alpaca API into klines."""
+    klines = pd.DataFrame.from_dict(bars).drop(
+        labels=[
+            "n",
+        ],
+        axis=1,
+    )
+    klines = klines.rename(
+        columns={
+            "c": "Close",
+            "h": "High",
+            "l": "Low",
+            "o": "Open",
+            "t": "Datetime",
+            "v": "Volume",
+            "vw": "Weighted Volume",
+        }
+    )
+    klines = klines.set_index("Datetime", drop=True)
+    klines.index = pd.to_datetime(klines.index).tz_convert(pytz.UTC)
+    return klines
+
+
+def _fetch_paginated_klines(
+    url: str,
+    headers: dict,
+    querystring: dict,
+    symbol: str,
+    symbol_class: str,
+    beginning_date: datetime,
+    ending_date: datetime,
+    interval: str,
+    metrics=None,
+) -> pd.DataFrame:
+    """Retrieve every kline between `beginning_date` and `ending_date`,
+    following the pagination tokens of the Alpaca API.
+    Intraday timeframes easily exceed the 10 000 bars of a single page.
+
+    Returns:
+        pd.DataFrame: dataframe containing the klines fetched online, possibly empty.
+    """
+    request_session = retrying_session(metrics)
+    querystring.update(
+        {
+            "start": beginning_date.isoformat(),
+            "end": ending_date.isoformat(),
+            "timeframe": interval,
+            "limit": 10000,
+        }
+    )
+    klines = []
+    while True:
+        request = request_session.get(url, headers=headers, params=querystring).json()
+        if symbol_class in ["crypto"]:
+            bars = (request["bars"] or {}).get(symbol, [])
+        else:
+            bars = request["bars"] or []
+        if len(bars) == 0:
+            break
+        klines.append(_bars_to_klines(bars))
+
+        if request.get("next_page_token") is None:
+            break
+        querystring["page_token"] = request["next_page_token"]
+
+    if len(klines) == 0:
+        return pd.DataFrame(
+            columns=["Close", "High", "Low", "Open", "Volume", "Weighted Volume"],
+            index=pd.DatetimeIndex([], tz=pytz.UTC, name="Datetime"),
+            dtype="float64",
+        )
+    klines = pd.concat(klines)
+    klines = klines[~klines.index.duplicated(keep="last")]
+    return klines.astype("float64")
+
+
 def save_klines(
     data: pd.DataFrame,
     symbol: str,
@@ -136,6 +251,9 @@ def save_klines(
     Returns:
         str: filename containing the data
     """
+    if interval in INTRADAY_INTERVALS:
+        return save_intraday_klines(data, symbol, interval, directory)
+
     filename = Path(directory) / "_".join(
         [
             symbol,
@@ -174,6 +292,7 @@ def fetch_and_save_klines(
         symbol,
         beginning_date,
         interval,
+        **kwargs,
     )
     filename = save_klines(
         klines,
@@ -185,7 +304,12 @@ def fetch_and_save_klines(
 
 
 def select_klines(
-    symbol: str, interval: str, directory: Path, **kwargs
+    symbol: str,
+    interval: str,
+    directory: Path,
+    beginning_date: datetime = None,
+    ending_date: datetime = None,
+    **kwargs,
 ) -> pd.DataFrame:
 
     """
@@ -199,9 +323,18 @@ def select_klines(
         interval (str): interval of klines, eg `6h`.
         force_download (bool): whether to re-download the financials, even it they are already located in `directory`.
         directory (Path): directory to save the klines.
+        beginning_date (datetime): for intraday timeframes, only read klines from this date on.
+        ending_date (datetime): for intraday timeframes, only read klines up to this date.
     Returns:
         pd.DataFrame: dataframe containing klines
     """
+    if interval in INTRADAY_INTERVALS:
+        return select_intraday_klines(
+            symbol, interval, directory, beginning_date, ending_date, **kwargs
+        )
+    if interval in RESAMPLING_RULES:
+        return select_resampled_klines(symbol, interval, directory)
+
     p = Path(directory).glob("*.csv")
     files = [x for x in p if x.is_file()]
     filenames = [x.stem.split("_") for x in files]
@@ -213,11 +346,282 @@ def select_klines(
 
     if not perfect_file.empty:
         filename = files[perfect_file.index[0]]
-        klines = pd.read_csv(filename)
-        klines = klines.rename(columns={klines.columns[0]: "Datetime"})
-        klines.loc[:, "Datetime"] = pd.to_datetime(klines["Datetime"], utc=True)
-        klines = klines.set_index("Datetime", drop=True)
-        return klines
+        return _read_klines(filename)
+
+    else:
+        raise FileNotFoundError(f"There is no OHLCV data associated to {symbol}.")
+
+
+def _read_klines(filename: Path) -> pd.DataFrame:
+    klines = pd.read_csv(filename)
+    klines = klines.rename(columns={klines.columns[0]: "Datetime"})
+    klines.loc[:, "Datetime"] = pd.to_datetime(klines["Datetime"], utc=True)
+    klines = klines.set_index("Datetime", drop=True)
+    return klines
+
+
+def resample_klines(klines: pd.DataFrame, interval: str) -> pd.DataFrame:
+    """Resamples daily `klines` to the timeframe `interval`.
+    OHLC are aggregated as candles, volumes are summed, the weighted volume
+    is weighted by the volume, and any other column keeps its last value.
+
+    Args:
+        klines (pd.DataFrame): daily klines, indexed by datetime
+        interval (str): one of the keys of `RESAMPLING_RULES`, eg `1wk`.
+
+    Returns:
+        pd.DataFrame: resampled klines, indexed by the end of each period
+    """
+    aggregation = {column: "last" for column in klines.columns}
+    aggregation.update(
+        {
+            column: function
+            for column, function in {
+                "Open": "first",
+                "High": "max",
+                "Low": "min",
+                "Close": "last",
+                "Volume": "sum",
+            }.items()
+            if column in klines.columns
+        }
+    )
+    resampler = klines.resample(RESAMPLING_RULES[interval])
+    resampled = resampler.agg(aggregation)
+    if "Weighted Volume" in klines.columns and "Volume" in klines.columns:
+        resampled["Weighted Volume"] = (
+            (klines["Weighted Volume"] * klines["Volume"])
+            .resample(RESAMPLING_RULES[interval])
+            .sum()
+            / resampled["Volume"]
+        )
+    # periods without any bar, eg a week of holidays
+    resampled = resampled[resampler.size() > 0]
+    return resampled[klines.columns]
+
+
+def _source_version(filename: Path) -> list:
+    stat = Path(filename).stat()
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def select_resampled_klines(
+    symbol: str, interval: str, directory: Path, **kwargs
+) -> pd.DataFrame:
+    """
+    Selects klines of `symbol` at a timeframe built from the daily klines, eg `1wk` or `1mo`.
+    Resampled klines are cached in `directory/.cache`, along with the version of the daily
+    klines they were built from. When new daily bars arrive, only the last cached period
+    and the new ones are resampled again.
+    Args:
+        symbol (str): ticker eg `AAPL`
+        interval (str): one of the keys of `RESAMPLING_RULES`, eg `1wk`.
+        directory (Path): directory of the daily klines.
+    Returns:
+        pd.DataFrame: dataframe containing resampled klines
+    """
+    daily_filename = Path(directory) / f"{symbol}_1d.csv"
+    if not daily_filename.is_file():
+        raise FileNotFoundError(f"There is no OHLCV data associated to {symbol}.")
+    version = _source_version(daily_filename)
+
+    cache_directory = Path(directory) / CACHE_DIRECTORY
+    cache_filename = cache_directory / f"{symbol}_{interval}.csv"
+    manifest_filename = cache_directory / f"{symbol}_{interval}.json"
+    manifest = {}
+    if cache_filename.is_file() and manifest_filename.is_file():
+        with open(manifest_filename) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get("version") == version:
+            return _read_klines(cache_filename)
 
+    daily = select_klines(symbol, "1d", directory)
+    is_append_only = (
+        len(manifest) > 0
+        and manifest.get("first_bar") == daily.index[0].isoformat()
+        and manifest.get("nb_bars", 0) <= len(daily)
+    )
+    if is_append_only:
+        # the last cached period may have been incomplete:
+        # resample it again, along with the new daily bars.
+        cached = _read_klines(cache_filename)
+        kept = cached.iloc[:-1]
+        # labels are the last day of each period, whose bars all belong to it
+        if len(kept) > 0:
+            new_bars = daily[daily.index >= kept.index[-1] + pd.Timedelta(days=1)]
+        else:
+            new_bars = daily
+        resampled = pd.concat([kept, resample_klines(new_bars, interval)])
     else:
+        resampled = resample_klines(daily, interval)
+
+    cache_directory.mkdir(parents=True, exist_ok=True)
+    _write_atomically(cache_filename, resampled.to_csv)
+    _write_atomically(
+        manifest_filename,
+        lambda manifest_file: json.dump(
+            {
+                "version": version,
+                "first_bar": daily.index[0].isoformat(),
+                "nb_bars": len(daily),
+            },
+            manifest_file,
+        ),
+    )
+    return resampled
+
+
+def _write_atomically(filename: Path, write: Callable[[IO], None]) -> None:
+    """Writes `filename` with `write` in a temporary file, then renames it, so that
+    concurrent readers never see a partial file. The temporary file has a unique
+    name: concurrent writers of the same file do not write into each other's.
+
+    Args:
+        filename (Path): file to write
+        write (Callable[[IO], None]): writes the content to the given text file
+    """
+    with tempfile.NamedTemporaryFile(
+        "w", dir=Path(filename).parent, suffix=".tmp", delete=False, newline=""
+    ) as temporary_file:
+        try:
+            write(temporary_file)
+        except BaseException:
+            temporary_file.close()
+            os.remove(temporary_file.name)
+            raise
+    os.replace(temporary_file.name, filename)
+
+
+def _partition_directory(symbol: str, interval: str, directory: Path) -> Path:
+    return Path(directory) / INTRADAY_DIRECTORY / interval / symbol
+
+
+def _last_line(filename: Path) -> str:
+    """Reads the last line of `filename` without reading the whole file."""
+    with open(filename, "rb") as file:
+        file.seek(0, os.SEEK_END)
+        position = file.tell() - 1
+        # skip the trailing new line
+        while position > 0:
+            file.seek(position - 1)
+            if file.read(1) == b"\n":
+                break
+            position -= 1
+        file.seek(max(position, 0))
+        return file.readline().decode().strip()
+
+
+def last_intraday_datetime(symbol: str, interval: str, directory: Path) -> datetime:
+    """Datetime of the last stored intraday kline of `symbol`, useful to only fetch newer klines.
+
+    Args:
+        symbol (str): ticker eg `AAPL`
+        interval (str): intraday timeframe, eg `15m`.
+        directory (Path): directory of the klines.
+
+    Returns:
+        datetime: datetime (UTC) of the last stored kline, or `None` if nothing is stored.
+    """
+    partitions = sorted(_partition_directory(symbol, interval, directory).glob("*.csv"))
+    if len(partitions) == 0:
+        return None
+    last_line = _last_line(partitions[-1])
+    return pd.to_datetime(last_line.split(",")[0], utc=True).to_pydatetime()
+
+
+def save_intraday_klines(
+    data: pd.DataFrame,
+    symbol: str,
+    interval: str,
+    directory: Path,
+    **kwargs,
+) -> str:
+    """Append intraday klines to their monthly partitions
+    `directory/intraday/{interval}/{symbol}/{YYYY-MM}.csv`.
+    Klines older than the last stored kline are ignored: partitions are append-only.
+
+    Args:
+        data (pd.DataFrame): data/ klines to save
+        symbol (str): ticker to download eg `AAPL`
+        interval (str): intraday timeframe, eg `15m`.
+        directory (Path): directory to save the klines.
+
+    Returns:
+        str: directory containing the partitions
+    """
+    partition_directory = _partition_directory(symbol, interval, directory)
+    partition_directory.mkdir(parents=True, exist_ok=True)
+    last_datetime = last_intraday_datetime(symbol, interval, directory)
+    if last_datetime is not None:
+        data = data[data.index > last_datetime]
+    data = data.sort_index()
+
+    for month, month_klines in data.groupby(data.index.strftime("%Y-%m")):
+        filename = partition_directory / f"{month}.csv"
+        if filename.is_file():
+            with open(filename) as partition:
+                columns = partition.readline().strip().split(",")[1:]
+            month_klines[columns].to_csv(filename, mode="a", header=False)
+        else:
+            month_klines.to_csv(filename)
+    return str(partition_directory)
+
+
+def select_intraday_klines(
+    symbol: str,
+    interval: str,
+    directory: Path,
+    beginning_date: datetime = None,
+    ending_date: datetime = None,
+    nb_sessions: int = None,
+    **kwargs,
+) -> pd.DataFrame:
+    """
+    Selects intraday klines of `symbol`, only reading the monthly partitions
+    overlapping [`beginning_date`, `ending_date`].
+    Args:
+        symbol (str): ticker eg `AAPL`
+        interval (str): intraday timeframe, eg `15m`.
+        directory (Path): directory of the klines.
+        beginning_date (datetime): first datetime to read. Defaults to the first stored kline.
+        ending_date (datetime): last datetime to read. Defaults to the last stored kline.
+        nb_sessions (int): if given, only the klines of the last `nb_sessions` days
+            up to `ending_date` are read.
+    Returns:
+        pd.DataFrame: dataframe containing klines
+    """
+    partitions = sorted(_partition_directory(symbol, interval, directory).glob("*.csv"))
+    if len(partitions) == 0:
         raise FileNotFoundError(f"There is no OHLCV data associated to {symbol}.")
+
+    beginning_date = pd.to_datetime(beginning_date, utc=True)
+    ending_date = pd.to_datetime(ending_date, utc=True)
+    if ending_date is not None:
+        partitions = [
+            p for p in partitions if p.stem <= ending_date.strftime("%Y-%m")
+        ]
+    if beginning_date is not None:
+        partitions = [
+            p for p in partitions if p.stem >= beginning_date.strftime("%Y-%m")
+        ]
+
+    klines = []
+    nb_read_sessions = 0
+    # latest partitions first, so that `nb_sessions` stops reading as soon as possible
+    for partition in reversed(partitions):
+        month_klines = _read_klines(partition)
+        if ending_date is not None:
+            month_klines = month_klines[month_klines.index <= ending_date]
+        if beginning_date is not None:
+            month_klines = month_klines[month_klines.index >= beginning_date]
+        klines.insert(0, month_klines)
+        if nb_sessions is not None:
+            nb_read_sessions += len(set(month_klines.index.date))
+            if nb_read_sessions >= nb_sessions:
+                break
+
+    klines = pd.concat(klines)
+    if nb_sessions is not None:
+        sessions = sorted(set(klines.index.date))[-nb_sessions:]
+        klines = klines[klines.index.date >= sessions[0]] if len(sessions) > 0 else klines
+    return klines
@@ -0,0 +1,166 @@
+"""Runs the update of the stale datasets only, each kind of dataset at its own cadence.
+
+The crontab calls this script often, eg every 30 minutes of the weekdays. Each call:
+
+    * resumes the unfinished run, if any, see `get_data/journal.py`
+    * otherwise, plans the datasets which are stale at this time of the trading calendar
+    * exits at once when nothing is stale: on week-ends, holidays, or when up to date
+
+A dataset is stale when its file was written before the last time it was due:
+the close of the last session, plus `close_delay` for the data providers to serve
+the last bar, and for the kinds with an intraday cadence, every `every` of the session.
+
+    python get_data/scheduler.py --dry-run
+"""
+import argparse
+import os
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+sys.path.append(os.getcwd())
+
+import pandas as pd
+import toml
+
+from get_data.journal import UpdateJournal, update_lock
+from get_data.trading_calendar import TradingCalendar
+from get_data.update import DATASET_PATHS, UPDATED_DATASETS, run_update
+
+
+@dataclass
+class Cadence:
+    """When a kind of dataset is due: after the close of each session, and if `every`
+    is set, every `every` from the open of the session."""
+
+    every: Optional[timedelta] = None
+
+
+CADENCES = {
+    "ohlcv": Cadence(),
+    "sentiment": Cadence(),
+    "financial": Cadence(every=timedelta(hours=1)),
+}
+"""Cadence of each kind of dataset"""
+CLOSE_DELAY = timedelta(minutes=20)
+"""Delay after the close before the last bar is served: Alpaca holds 15 minutes"""
+
+
+def due_time(
+    cadence: Cadence,
+    now: datetime,
+    calendar: TradingCalendar,
+    close_delay: timedelta = CLOSE_DELAY,
+) -> datetime:
+    """Last time before `now` at which a dataset of `cadence` was due.
+
+    Args:
+        cadence (Cadence): cadence of the dataset
+        now (datetime): timezone-aware current time
+        calendar (TradingCalendar): trading calendar
+        close_delay (timedelta): delay after the close. Defaults to CLOSE_DELAY.
+
+    Returns:
+        datetime: due time, in UTC
+    """
+    due = calendar.last_close(now - close_delay) + close_delay
+    if cadence.every is not None and calendar.is_open(now):
+        session_open = calendar.session_open(calendar.session_of(now))
+        nb_periods = (now - session_open) // cadence.every
+        due = max(due, session_open + nb_periods * cadence.every)
+    return due
+
+
+def stale_datasets(
+    symbols: Dict[str, List[str]],
+    path_to_datasets: Path,
+    now: datetime,
+    calendar: TradingCalendar,
+    cadences: Dict[str, Cadence] = CADENCES,
+    close_delay: timedelta = CLOSE_DELAY,
+) -> Dict[str, List[str]]:
+    """Datasets updated by `update_data` whose file is missing or older than its due time.
+
+    Args:
+        symbols (Dict[str, List[str]]): type of asset, eg `stock`, -> symbols
+        path_to_datasets (Path): path of the datasets
+        now (datetime): timezone-aware current time
+        calendar (TradingCalendar): trading calendar
+        cadences (Dict[str, Cadence]): cadence of each kind of dataset.
+            Defaults to CADENCES.
+        close_delay (timedelta): delay after the close. Defaults to CLOSE_DELAY.
+
+    Returns:
+        Dict[str, List[str]]: kind of dataset -> stale symbols, without the kinds
+            up to date
+    """
+    plan = {}
+    for asset_type, kinds in UPDATED_DATASETS.items():
+        for kind in kinds:
+            due = due_time(cadences[kind], now, calendar, close_delay).timestamp()
+            for symbol in symbols[asset_type]:
+                path = Path(path_to_datasets) / DATASET_PATHS[kind].format(symbol=symbol)
+                if not path.is_file() or path.stat().st_mtime < due:
+                    plan.setdefault(kind, []).append(symbol)
+    return plan
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--dry-run", action="store_true", help="print the stale datasets and exit"
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=3,
+        help="failures of a dataset after which the run skips it",
+    )
+    args = parser.parse_args()
+
+    config = toml.load(Path("config.toml"))
+    path_to_index_symbols = Path(config["data_access"]["path_to_index_symbols"])
+    path_to_stock_symbols = Path(config["data_access"]["path_to_stock_symbols"])
+    path_to_datasets = Path(config["data_access"]["path_to_datasets"])
+    now = datetime.now(timezone.utc)
+    calendar = TradingCalendar()
+
+    with update_lock(path_to_datasets) as acquired:
+        if not acquired:
+            print("Another update is running")
+            sys.exit(0)
+
+        run_id = UpdateJournal.unfinished_run(path_to_datasets)
+        sync = False
+        if run_id is None:
+            symbols = {
+                "index": list(pd.read_csv(path_to_index_symbols)["symbol"]),
+                "stock": list(pd.read_csv(path_to_stock_symbols)["symbol"]),
+            }
+            plan = stale_datasets(symbols, path_to_datasets, now, calendar)
+            print(
+                f"{now.isoformat()}: "
+                + (
+                    ", ".join(f"{len(plan[kind])} stale {kind}" for kind in plan)
+                    or "nothing is stale"
+                )
+            )
+            if args.dry_run or len(plan) == 0:
+                sys.exit(0)
+            run_id = now.strftime("%Y-%m-%dT%H%M")
+            # the symbols follow the S&P500 once per session, with the klines
+            sync = "ohlcv" in plan
+        else:
+            plan = None
+            print(f"{now.isoformat()}: resuming run {run_id}")
+            if args.dry_run:
+                sys.exit(0)
+
+        journal = UpdateJournal.open(path_to_datasets, run_id, args.max_attempts, plan)
+        complete = run_update(
+            path_to_index_symbols, path_to_stock_symbols, path_to_datasets, journal, sync
+        )
+    # like get_data/update.py: an incomplete run is reported to the monitoring
+    sys.exit(0 if complete else 1)
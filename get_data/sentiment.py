@@ -5,10 +5,7 @@ from pathlib import Path
 
 import pandas as pd
 import pytz
-import requests
-import yfinance as yf
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
-from requests.adapters import HTTPAdapter, Retry
+from get_data.ohlcv import retrying_session
 
 FORMAT = "%Y-%m-%d"
 """Expected datetime format"""
@@ -48,9 +45,7 @@ def fetch_sentiment(
             "limit": 50,
         }
 
-        request_session = requests.Session()
-        retries = Retry(total=7, backoff_factor=2, status_forcelist=[429])
-        request_session.mount("https://", HTTPAdapter(max_retries=retries))
+        request_session = retrying_session(kwargs.get("metrics"))
         request = request_session.get(url, headers=headers, params=querystring).json()
 
         if len(request["news"]) == 0:
@@ -79,6 +74,9 @@ def fetch_sentiment(
 
         ending_date = _sentiment.index[-1]
 
+    # nltk takes longer to import than the rest of the data layer
+    from nltk.sentiment.vader import SentimentIntensityAnalyzer
+
     vader = SentimentIntensityAnalyzer()
     sentiment = pd.concat(news)
     sentiment["score"] = sentiment["headline"].apply(
@@ -149,6 +147,7 @@ def fetch_and_save_sentiment(
         symbol,
         beginning_date,
         interval,
+        **kwargs,
     )
     filename = save_sentiment(
         sentiment,
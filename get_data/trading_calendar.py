@@ -0,0 +1,124 @@
+"""Trading calendar of the NYSE: sessions, holidays and early closes.
+
+    calendar = TradingCalendar()
+    calendar.is_session(date(2023, 7, 4))             # False, Independence Day
+    calendar.session_close(date(2023, 11, 24))        # 18:00 UTC, early close
+    calendar.last_close(datetime.now(timezone.utc))   # close of the last session
+"""
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Set
+
+import pytz
+from pandas.tseries.holiday import (
+    AbstractHolidayCalendar,
+    GoodFriday,
+    Holiday,
+    USLaborDay,
+    USMartinLutherKingJr,
+    USMemorialDay,
+    USPresidentsDay,
+    USThanksgivingDay,
+    nearest_workday,
+    sunday_to_monday,
+)
+
+MARKET_TIMEZONE = pytz.timezone("US/Eastern")
+OPEN_TIME = time(9, 30)
+CLOSE_TIME = time(16, 0)
+EARLY_CLOSE_TIME = time(13, 0)
+
+
+class NYSEHolidayCalendar(AbstractHolidayCalendar):
+    """Full-day holidays of the NYSE. Unlike the federal holidays, a New Year's Day
+    falling on a Saturday is not observed on the Friday before."""
+
+    rules = [
+        Holiday("New Year's Day", month=1, day=1, observance=sunday_to_monday),
+        USMartinLutherKingJr,
+        USPresidentsDay,
+        GoodFriday,
+        USMemorialDay,
+        Holiday(
+            "Juneteenth",
+            month=6,
+            day=19,
+            start_date="2022-06-19",
+            observance=nearest_workday,
+        ),
+        Holiday("Independence Day", month=7, day=4, observance=nearest_workday),
+        USLaborDay,
+        USThanksgivingDay,
+        Holiday("Christmas", month=12, day=25, observance=nearest_workday),
+    ]
+
+
+class TradingCalendar:
+    """Sessions of the NYSE. Datetimes are timezone-aware, and returned in UTC."""
+
+    def __init__(self) -> None:
+        self._holidays: Dict[int, Set[date]] = {}
+        self._early_closes: Dict[int, Set[date]] = {}
+
+    def holidays(self, year: int) -> Set[date]:
+        if year not in self._holidays:
+            self._holidays[year] = {
+                holiday.date()
+                for holiday in NYSEHolidayCalendar().holidays(
+                    f"{year}-01-01", f"{year}-12-31"
+                )
+            }
+        return self._holidays[year]
+
+    def early_closes(self, year: int) -> Set[date]:
+        """Sessions closing at 13:00: the day after Thanksgiving, and the days before
+        Independence Day and Christmas when they are sessions."""
+        if year not in self._early_closes:
+            thanksgiving = USThanksgivingDay.dates(f"{year}-01-01", f"{year}-12-31")[0]
+            early_closes = {(thanksgiving + timedelta(days=1)).date()}
+            for day in [date(year, 7, 3), date(year, 12, 24)]:
+                # from Monday to Thursday, the next day being the holiday
+                if day.weekday() < 4:
+                    early_closes.add(day)
+            self._early_closes[year] = early_closes
+        return self._early_closes[year]
+
+    def is_session(self, day: date) -> bool:
+        return day.weekday() < 5 and day not in self.holidays(day.year)
+
+    def session_open(self, day: date) -> datetime:
+        return MARKET_TIMEZONE.localize(datetime.combine(day, OPEN_TIME)).astimezone(
+            pytz.utc
+        )
+
+    def session_close(self, day: date) -> datetime:
+        close_time = CLOSE_TIME
+        if day in self.early_closes(day.year):
+            close_time = EARLY_CLOSE_TIME
+        return MARKET_TIMEZONE.localize(datetime.combine(day, close_time)).astimezone(
+            pytz.utc
+        )
+
+    def session_of(self, moment: datetime) -> date:
+        """Date of `moment` on the market, which may not be a session."""
+        return moment.astimezone(MARKET_TIMEZONE).date()
+
+    def previous_session(self, day: date) -> date:
+        """Last session strictly before `day`."""
+        day -= timedelta(days=1)
+        while not self.is_session(day):
+            day -= timedelta(days=1)
+        return day
+
+    def is_open(self, moment: datetime) -> bool:
+        day = self.session_of(moment)
+        return (
+            self.is_session(day)
+            and self.session_open(day) <= moment < self.session_close(day)
+        )
+
+    def last_close(self, moment: datetime) -> datetime:
+        """Close of the last session closed at `moment`."""
+        day = self.session_of(moment)
+        if self.is_session(day) and self.session_close(day) <= moment:
+            return self.session_close(day)
+        return self.session_close(self.previous_session(day))
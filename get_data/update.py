@@ -1,19 +1,36 @@
+import argparse
+import sys
 from datetime import datetime
 from pathlib import Path
-from typing import List, Tuple
+from time import time
+from typing import Callable, List, Tuple
 
-import bs4 as bs
-import nltk
 import pandas as pd
 import pytz
-import requests
 import traceback
 import toml
 from tqdm import tqdm
 
 from get_data.financial import fetch_and_save_financials
+from get_data.journal import DONE, FAILED, UpdateJournal, update_lock
+from get_data.manifest import build_manifest
+from get_data.metrics import UpdateMetrics, count_rows
 from get_data.ohlcv import fetch_and_save_klines
 from get_data.sentiment import fetch_and_save_sentiment
+from models.asset import compute_results, load_stocks_indices
+from models.indicator import default_indicators
+from models.scan import DEFAULT_SCAN, save_scan, scan_config
+
+DATASET_PATHS = {
+    "financial": "financial/{symbol}.json",
+    "sentiment": "sentiment/{symbol}_1d.csv",
+    "ohlcv": "ohlcv/{symbol}_1d.csv",
+}
+"""Path of each kind of dataset of a symbol, relative to the datasets"""
+UPDATED_DATASETS = {"index": ["ohlcv"], "stock": ["financial"]}
+"""Kinds of datasets updated by `update_data`, for the indices and the stocks"""
+SCANNED_DATASETS = ["ohlcv", "sentiment"]
+"""Kinds of datasets read by the default scan"""
 
 
 def sync_symbols(path_to_stock_symbols: Path):
@@ -22,6 +39,9 @@ def sync_symbols(path_to_stock_symbols: Path):
     Args:
         path_to_stock_symbols (Path): Path to the DataFrame of symbols
     """
+    import bs4 as bs
+    import requests
+
     original_symbols = pd.read_csv(path_to_stock_symbols)
     force_watch_symbols = original_symbols[original_symbols["force_watch"]]
 
@@ -46,10 +66,65 @@ def sync_symbols(path_to_stock_symbols: Path):
     new_symbols.to_csv(path_to_stock_symbols, index=False)
 
 
+def _update_dataset(
+    fetch_and_save: Callable,
+    symbol: str,
+    kind: str,
+    relative_path: str,
+    path_to_datasets: Path,
+    metrics: UpdateMetrics,
+    journal: UpdateJournal = None,
+    **kwargs,
+) -> bool:
+    """Fetches and saves the `kind` dataset of `symbol`, in the staging directory of the
+    journal if any, unless the journal already has it done or skipped.
+
+    Args:
+        fetch_and_save (Callable): eg `fetch_and_save_klines`
+        symbol (str): ticker to update, eg `AAPL`
+        kind (str): kind of dataset, eg `ohlcv`
+        relative_path (str): path of the dataset, relative to the datasets
+        path_to_datasets (Path): path of the datasets to update
+        metrics (UpdateMetrics): metrics of the run
+        journal (UpdateJournal): journal of the run. Defaults to None, the dataset is
+            written in place.
+
+    Returns:
+        bool: False if the dataset could not be fetched
+    """
+    if journal is not None and not journal.is_pending(symbol, kind):
+        metrics.skip(kind, symbol)
+        return True
+    filename = path_to_datasets / relative_path
+    if journal is not None:
+        filename = journal.staging_path(relative_path)
+    nb_rows = count_rows(path_to_datasets / relative_path)
+    try:
+        with metrics.symbol(kind, symbol):
+            fetch_and_save(
+                symbol=symbol, directory=filename.parent, metrics=metrics, **kwargs
+            )
+    except Exception as e:
+        print(f"Problem fetching {symbol} {kind}")
+        print(traceback.format_exc())
+        if journal is not None:
+            journal.record(symbol, kind, FAILED, f"{type(e).__name__}: {e}")
+        return False
+    if journal is not None:
+        journal.record(symbol, kind, DONE, path=relative_path)
+    if filename.suffix == ".csv":
+        metrics.add_rows(kind, count_rows(filename) - nb_rows)
+    else:
+        metrics.add_rows(kind, 1)
+    return True
+
+
 def update_data(
     index_symbols: pd.DataFrame,
     stock_symbols: pd.DataFrame,
     path_to_datasets: Path,
+    metrics: UpdateMetrics = None,
+    journal: UpdateJournal = None,
 ) -> Tuple[List[str], List[str], List[str]]:
     """Update the `path_to_datasets` folder by fetching the financials, sentiment score and klines of the assets
 
@@ -57,6 +132,10 @@ def update_data(
         index_symbols (pd.DataFrame): list of indices to update
         stock_symbols (pd.DataFrame): list of stocks to update
         path_to_datasets (Path): path of the datasets to update
+        metrics (UpdateMetrics): metrics of the run, filled while updating. Defaults to None.
+        journal (UpdateJournal): journal of the run: the datasets it has done are not
+            fetched again, and the fetched ones are staged until `UpdateJournal.publish`.
+            Defaults to None, the datasets are written in place.
 
     Returns:
         Tuple[List[str], List[str], List[str]]: tuple made of
@@ -64,8 +143,13 @@ def update_data(
             * list of symbols having problems when fetching their sentiments
             * list of symbols having problems when fetching their financials
     """
+    # imported here, like the other network libraries, so that importing this module stays cheap
+    import nltk
+
     nltk.downloader.download("vader_lexicon")
 
+    if metrics is None:
+        metrics = UpdateMetrics()
     problematic_ohlcv = []
     problematic_sentiment = []
     problematic_financials = []
@@ -75,53 +159,57 @@ def update_data(
     for _, row in stock_symbols.iterrows():
         symbol = row["symbol"]
         from_date = row["from_date"]
-        try:
-            financials = fetch_and_save_financials(
-                symbol=symbol,
-                directory=path_to_datasets / "financial",
-            )
-        except Exception as e:
-            print(f"Problem fetching {symbol} financials")
-            print(traceback.format_exc())
+        if not _update_dataset(
+            fetch_and_save_financials,
+            symbol,
+            "financial",
+            DATASET_PATHS["financial"].format(symbol=symbol),
+            path_to_datasets,
+            metrics,
+            journal,
+        ):
             problematic_financials.append(symbol)
         pbar.update(1)
-        # try:
-        #     sentiments = fetch_and_save_sentiment(
-        #         symbol=symbol,
-        #         beginning_date=datetime(2021, 1, 1),
-        #         interval="1d",
-        #         directory=path_to_datasets / "sentiment",
-        #     )
-        # except Exception as e:
-        #     print(f"Problem fetching {symbol} sentiment")
-        #     print(traceback.format_exc())
+        # if not _update_dataset(
+        #     fetch_and_save_sentiment,
+        #     symbol,
+        #     "sentiment",
+        #     DATASET_PATHS["sentiment"].format(symbol=symbol),
+        #     path_to_datasets,
+        #     metrics,
+        #     journal,
+        #     beginning_date=datetime(2021, 1, 1),
+        #     interval="1d",
+        # ):
         #     problematic_sentiment.append(symbol)
         pbar.update(1)
-        # try:
-        #     klines = fetch_and_save_klines(
-        #         symbol=symbol,
-        #         beginning_date=from_date,
-        #         interval="1d",
-        #         directory=path_to_datasets / "ohlcv",
-        #     )
-        # except Exception as e:
-        #     print(f"Problem fetching {symbol} klines")
-        #     print(traceback.format_exc())
+        # if not _update_dataset(
+        #     fetch_and_save_klines,
+        #     symbol,
+        #     "ohlcv",
+        #     DATASET_PATHS["ohlcv"].format(symbol=symbol),
+        #     path_to_datasets,
+        #     metrics,
+        #     journal,
+        #     beginning_date=from_date,
+        #     interval="1d",
+        # ):
         #     problematic_ohlcv.append(symbol)
         pbar.update(1)
     for _, row in index_symbols.iterrows():
         symbol = row["symbol"]
         from_date = row["from_date"]
-        try:
-            klines = fetch_and_save_klines(
-                symbol=symbol,
-                beginning_date=datetime(2021, 1, 1),
-                interval="1d",
-                directory=path_to_datasets / "ohlcv",
-            )
-        except Exception as e:
-            print(f"Problem fetching {symbol} klines")
-            print(traceback.format_exc())
+        if not _update_dataset(
+            fetch_and_save_klines,
+            symbol,
+            "ohlcv",
+            DATASET_PATHS["ohlcv"].format(symbol=symbol),
+            path_to_datasets,
+            metrics,
+            journal,
+            beginning_date=datetime(2021, 1, 1),
+            interval="1d",
+        ):
             problematic_ohlcv.append(symbol)
         pbar.update(1)
 
@@ -129,7 +217,129 @@ def update_data(
     return problematic_ohlcv, problematic_sentiment, problematic_financials
 
 
+def publish_default_scan(
+    index_symbols: List[str],
+    stock_symbols: List[str],
+    path_to_datasets: Path,
+) -> Path:
+    """Scans the updated datasets with the default indicators, and stores the scores and
+    indicator columns next to the datasets, so that the app can display them at once.
+
+    Args:
+        index_symbols (List[str]): symbols of the indices to scan
+        stock_symbols (List[str]): symbols of the stocks to scan
+        path_to_datasets (Path): path of the updated datasets
+
+    Returns:
+        Path: path of the stored scan
+    """
+    # built before loading: files changed while scanning make the scan outdated
+    manifest = build_manifest(path_to_datasets)
+    indicators = default_indicators()
+    indices, stocks, _ = load_stocks_indices(index_symbols, stock_symbols, path_to_datasets)
+    start_time = time()
+    index_results = compute_results(indices, indicators)
+    stock_results = compute_results(stocks, indicators)
+    return save_scan(
+        path_to_datasets,
+        DEFAULT_SCAN,
+        scan_config(["1d"], [], indicators),
+        manifest,
+        index_results,
+        stock_results,
+        nb_conditions=len(indicators),
+        elapsed_time=time() - start_time,
+    )
+
+
+def read_symbols(path_to_symbols: Path) -> pd.DataFrame:
+    symbols = pd.read_csv(path_to_symbols)
+    symbols["from_date"] = pd.to_datetime(symbols["from_date"])
+    return symbols
+
+
+def run_update(
+    path_to_index_symbols: Path,
+    path_to_stock_symbols: Path,
+    path_to_datasets: Path,
+    journal: UpdateJournal,
+    sync: bool = True,
+) -> bool:
+    """Runs the update recorded in `journal`: updates the datasets still pending,
+    publishes them, scans them with the default indicators if klines or sentiments
+    were published, and writes the metrics.
+
+    Args:
+        path_to_index_symbols (Path): path to the DataFrame of indices
+        path_to_stock_symbols (Path): path to the DataFrame of stocks
+        path_to_datasets (Path): path of the datasets to update
+        journal (UpdateJournal): journal of the run
+        sync (bool): sync the stock symbols with the S&P500 first, unless the run is
+            resumed. Defaults to True.
+
+    Returns:
+        bool: whether the run is complete, False if failures remain to retry
+    """
+    if journal.resumed:
+        nb_failures = len(journal.failures())
+        print(
+            f"Resuming run {journal.run_id}: "
+            + f"{len(journal.statuses) - nb_failures} datasets done or skipped, "
+            + f"{nb_failures} failures to retry"
+        )
+    elif sync:
+        # sync active symbols, once per run
+        sync_symbols(path_to_stock_symbols)
+
+    index_symbols = read_symbols(path_to_index_symbols)
+    stock_symbols = read_symbols(path_to_stock_symbols)
+    # update assets
+    metrics = UpdateMetrics()
+    problematic_ohlcv, problematic_sentiment, problematic_financials = update_data(
+        index_symbols,
+        stock_symbols,
+        path_to_datasets,
+        metrics,
+        journal,
+    )
+    published = journal.publish()
+    print(f"{len(published)} datasets published")
+    # precompute the scan of the default indicators on the updated datasets, unless
+    # the run only published datasets it does not read, eg the hourly financials
+    if any(path.split("/")[0] in SCANNED_DATASETS for path in published):
+        publish_default_scan(
+            list(index_symbols["symbol"]),
+            list(stock_symbols["symbol"]),
+            path_to_datasets,
+        )
+    complete = journal.close()
+    metrics.finish()
+    print(f"Update metrics written in {metrics.write(path_to_datasets)}")
+    if not complete:
+        print(
+            f"{len(journal.failures())} datasets failed: "
+            + "run the update again to retry them",
+            file=sys.stderr,
+        )
+    return complete
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Updates the datasets")
+    parser.add_argument(
+        "--run-id",
+        default=None,
+        help="run to start or resume. Defaults to the unfinished run if any, "
+        + "otherwise to the current UTC date.",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=3,
+        help="failures of a dataset after which the run skips it",
+    )
+    args = parser.parse_args()
+
     current_datetime_utc = datetime.utcnow().replace(tzinfo=pytz.utc)
     current_datetime_nyc = current_datetime_utc.astimezone(pytz.timezone("US/Eastern"))
 
@@ -141,16 +351,16 @@ if __name__ == "__main__":
     path_to_stock_symbols = Path(config["data_access"]["path_to_stock_symbols"])
     path_to_datasets = Path(config["data_access"]["path_to_datasets"])
 
-    # sync active symbols
-    sync_symbols(path_to_stock_symbols)
-
-    index_symbols = pd.read_csv(path_to_index_symbols)
-    index_symbols["from_date"] = pd.to_datetime(index_symbols["from_date"])
-    stock_symbols = pd.read_csv(path_to_stock_symbols)
-    stock_symbols["from_date"] = pd.to_datetime(stock_symbols["from_date"])
-    # update assets
-    problematic_ohlcv, problematic_sentiment, problematic_financials = update_data(
-        index_symbols,
-        stock_symbols,
-        path_to_datasets,
-    )
+    with update_lock(path_to_datasets) as acquired:
+        if not acquired:
+            print("Another update is running", file=sys.stderr)
+            sys.exit(1)
+        # like the scheduler, an interrupted run is resumed rather than discarded
+        run_id = args.run_id
+        if run_id is None:
+            run_id = UpdateJournal.unfinished_run(path_to_datasets)
+        journal = UpdateJournal.open(path_to_datasets, run_id, args.max_attempts)
+        complete = run_update(
+            path_to_index_symbols, path_to_stock_symbols, path_to_datasets, journal
+        )
+    sys.exit(0 if complete else 1)
@@ -1,17 +1,18 @@
 import concurrent.futures
 import multiprocessing as mp
+from contextlib import nullcontext
 from copy import deepcopy
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Callable, Dict, List, Optional, Tuple
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
-import streamlit as st
 from get_data.financial import select_financials
-from get_data.ohlcv import select_klines
+from get_data.ohlcv import RESAMPLING_RULES, resample_klines, select_klines
 from get_data.sentiment import select_sentiment
+from models.timing import collect, run_traced, span, timed
 
 
 def format_int_or_na(value, format="\${:,}") -> str:
@@ -21,6 +22,24 @@ def format_int_or_na(value, format="\${:,}") -> str:
         return format.format(value).replace(",", " ")
 
 
+@dataclass
+class AssetScore:
+    """Score of an asset, without its klines.
+    Used when scanning universes too large to keep every klines in memory."""
+
+    symbol: str
+    global_score: float = 0
+    detailed_score: Dict[str, int] = field(default_factory=lambda: ({}))
+
+
+@dataclass
+class AssetResult(AssetScore):
+    """Score of an asset, and the columns its indicators added to the klines.
+    The base klines are not part of it: they are shared by every scan of the universe."""
+
+    outputs: Dict[str, np.ndarray] = field(default_factory=lambda: ({}))
+
+
 @dataclass
 class Index:
     symbol: str
@@ -29,7 +48,8 @@ class Index:
     interval: str = "1d"
 
     def add_indicator(self, indicator):
-        indicator.apply_indicator(self)
+        with span("apply_indicator." + type(indicator).__name__):
+            indicator.apply_indicator(self)
 
         if indicator.flag_column is not None:
             if np.abs(self.klines[indicator.flag_column].iloc[-1]) > 0:
@@ -43,14 +63,16 @@ class Index:
         cls,
         symbol: str,
         path_to_datasets: Path,
+        interval: str = "1d",
         **kwargs,
     ):
-        current_cls = cls(symbol=symbol)
-        current_cls.klines = select_klines(
-            symbol=current_cls.symbol,
-            interval=current_cls.interval,
-            directory=path_to_datasets / "ohlcv",
-        )
+        current_cls = cls(symbol=symbol, interval=interval)
+        with span("select_klines"):
+            current_cls.klines = select_klines(
+                symbol=current_cls.symbol,
+                interval=current_cls.interval,
+                directory=path_to_datasets / "ohlcv",
+            )
         return current_cls
 
 
@@ -85,35 +107,45 @@ class Stock(Index):
         cls,
         symbol: str,
         path_to_datasets: Path,
+        interval: str = "1d",
         **kwargs,
     ):
-        current_cls = cls(symbol=symbol)
-        current_cls.klines = select_klines(
-            symbol=current_cls.symbol,
-            interval=current_cls.interval,
-            directory=path_to_datasets / "ohlcv",
-        )
+        current_cls = cls(symbol=symbol, interval=interval)
+        with span("select_klines"):
+            current_cls.klines = select_klines(
+                symbol=current_cls.symbol,
+                interval=current_cls.interval,
+                directory=path_to_datasets / "ohlcv",
+            )
         current_cls.klines["score"] = 0
-        sentiments = select_sentiment(
-            symbol=current_cls.symbol,
-            interval=current_cls.interval,
-            directory=path_to_datasets / "sentiment",
-        )
-        current_cls.klines = (
-            pd.concat([current_cls.klines, sentiments])
-            .sort_index(inplace=False)
-            .fillna(method="ffill")
-            .fillna(method="bfill")
-        )
-        current_cls.klines = current_cls.klines.groupby(
-            [current_cls.klines.index.date]
-        ).max()
-        current_cls.klines.index = pd.to_datetime(current_cls.klines.index, utc=True)
-
-        current_cls.financials = select_financials(
-            symbol=current_cls.symbol,
-            directory=path_to_datasets / "financial",
-        )
+        # sentiments are only stored daily
+        with span("select_sentiment"):
+            sentiments = select_sentiment(
+                symbol=current_cls.symbol,
+                interval="1d",
+                directory=path_to_datasets / "sentiment",
+            )
+            if current_cls.interval in RESAMPLING_RULES:
+                sentiments = resample_klines(sentiments, current_cls.interval)
+        with span("merge_sentiment"):
+            current_cls.klines = (
+                pd.concat([current_cls.klines, sentiments])
+                .sort_index(inplace=False)
+                .fillna(method="ffill")
+                .fillna(method="bfill")
+            )
+            current_cls.klines = current_cls.klines.groupby(
+                [current_cls.klines.index.date]
+            ).max()
+            current_cls.klines.index = pd.to_datetime(
+                current_cls.klines.index, utc=True
+            )
+
+        with span("select_financials"):
+            current_cls.financials = select_financials(
+                symbol=current_cls.symbol,
+                directory=path_to_datasets / "financial",
+            )
         return current_cls
 
 
@@ -121,6 +153,7 @@ def load_asset(
     symbols: List[str],
     loading_function: Callable,
     path_to_datasets: Path,
+    interval: str = "1d",
 ) -> Tuple[List[Stock], datetime]:
     """Create `Stock` instances. Uses multiprocessing.
 
@@ -133,33 +166,39 @@ def load_asset(
             The algorithm will always fetch data from online and save it.
         path_to_ohlcv (Path): path to the ohlcv data if `retrieve_mode=get`
         path_to_financials (Path): path to the financial data if `retrieve_mode=get`
+        interval (str): timeframe of the klines, eg `1d` or `1wk`.
 
     Returns:
         Tuple[List[Stock], datetime]: List of Stock instances and the time the data were lastly updated.
     """
 
     stocks = []
-    with concurrent.futures.ProcessPoolExecutor(
-        mp_context=mp.get_context("spawn")
-    ) as executor:
-        future_proc = [
-            executor.submit(
-                loading_function,
-                symbol=symbol,
-                path_to_datasets=path_to_datasets,
-            )
-            for symbol in symbols
-        ]
-        for future in concurrent.futures.as_completed(future_proc):
-            result = future.result()
-            stocks.append(result)
+    with span("load_asset", nb_symbols=len(symbols), interval=interval):
+        with concurrent.futures.ProcessPoolExecutor(
+            mp_context=mp.get_context("spawn")
+        ) as executor:
+            future_proc = [
+                executor.submit(
+                    run_traced,
+                    loading_function,
+                    symbol=symbol,
+                    path_to_datasets=path_to_datasets,
+                    interval=interval,
+                )
+                for symbol in symbols
+            ]
+            for future in concurrent.futures.as_completed(future_proc):
+                result = collect(future.result())
+                stocks.append(result)
     return stocks
 
 
+@timed()
 def load_stocks_indices(
     index_symbols: List[str],
     stock_symbols: List[str],
     path_to_datasets: Path,
+    interval: str = "1d",
 ) -> Tuple[List[Stock], datetime]:
     """Create `Stock` instances. Uses multiprocessing.
 
@@ -173,6 +212,7 @@ def load_stocks_indices(
             The algorithm will always fetch data from online and save it.
         path_to_ohlcv (Path): path to the ohlcv data if `retrieve_mode=get`
         path_to_financials (Path): path to the financial data if `retrieve_mode=get`
+        interval (str): timeframe of the klines, eg `1d` or `1wk`.
 
     Returns:
         Tuple[List[Stock], datetime]: List of Stock instances and the time the data were lastly updated.
@@ -181,17 +221,24 @@ def load_stocks_indices(
         index_symbols,
         Index.load_index,
         path_to_datasets,
+        interval,
     )
     stocks = load_asset(
         stock_symbols,
         Stock.load_stock,
         path_to_datasets,
+        interval,
     )
     updated_at = modified_dates_ohlcv = pd.to_datetime(
         [
             1000 * x.lstat().st_mtime
             for x in path_to_datasets.glob("**/*")
+            # hidden directories contain derived data, eg resampled klines
             if x.is_file()
+            and not any(
+                part.startswith(".")
+                for part in x.relative_to(path_to_datasets).parts
+            )
         ],
         utc=True,
         unit="ms",
@@ -229,18 +276,266 @@ def compute_score(stocks: List[Stock], indicators) -> List[Stock]:
         List[Stock]: list of updated stocks (no copy)
     """
     updated_stocks = []
-    with concurrent.futures.ProcessPoolExecutor(
-        mp_context=mp.get_context("spawn")
-    ) as executor:
+    with span("compute_score", nb_symbols=len(stocks)):
+        with concurrent.futures.ProcessPoolExecutor(
+            mp_context=mp.get_context("spawn")
+        ) as executor:
+            future_proc = [
+                executor.submit(
+                    run_traced,
+                    initialize_indicators,
+                    stock=stock,
+                    indicators=indicators,
+                )
+                for stock in stocks
+            ]
+            for future in concurrent.futures.as_completed(future_proc):
+                result = collect(future.result())
+                updated_stocks.append(result)
+    return updated_stocks
+
+
+def score_and_outputs(stock: Stock, indicators) -> AssetResult:
+    """Computes the score of a stock, and only returns its score and the columns added by the indicators.
+
+    Args:
+        stock (Stock): Stock to compute the score of
+        indicators (List[Indicator]): List of indicators giving score
+
+    Returns:
+        AssetResult: score and indicator columns of the stock. Float columns are stored in float32.
+    """
+    base_columns = set(stock.klines.columns)
+    stock = initialize_indicators(stock, indicators)
+    outputs = {}
+    for column in stock.klines.columns:
+        if column in base_columns:
+            continue
+        values = stock.klines[column].to_numpy()
+        if values.dtype == np.float64:
+            values = values.astype(np.float32)
+        outputs[column] = values
+    return AssetResult(
+        symbol=stock.symbol,
+        global_score=stock.global_score,
+        detailed_score=stock.detailed_score,
+        outputs=outputs,
+    )
+
+
+def score_asset(stock: Stock, indicators) -> AssetScore:
+    """Computes the score of a stock, and only returns its score.
+
+    Args:
+        stock (Stock): Stock to compute the score of
+        indicators (List[Indicator]): List of indicators giving score
+
+    Returns:
+        AssetScore: score of the stock
+    """
+    stock = initialize_indicators(stock, indicators)
+    return AssetScore(
+        symbol=stock.symbol,
+        global_score=stock.global_score,
+        detailed_score=stock.detailed_score,
+    )
+
+
+def compute_scores(
+    stocks: List[Stock],
+    indicators,
+    executor: concurrent.futures.Executor = None,
+) -> List[AssetScore]:
+    """Computes the score of each stock in list, only sending the scores back. Uses multiprocessing.
+
+    Args:
+        stocks (List[Stock]): List of stocks to compute score
+        indicators (List[Indicator]): List of indicators giving score
+        executor (concurrent.futures.Executor): executor to reuse, eg between scans.
+            Defaults to a new process pool.
+
+    Returns:
+        List[AssetScore]: score of each stock, in order of completion. `stocks` are left untouched.
+    """
+    if executor is None:
+        executor_context = concurrent.futures.ProcessPoolExecutor(
+            mp_context=mp.get_context("spawn")
+        )
+    else:
+        executor_context = nullcontext(executor)
+    with executor_context as executor:
         future_proc = [
-            executor.submit(
-                initialize_indicators,
-                stock=stock,
-                indicators=indicators,
-            )
+            executor.submit(score_asset, stock=stock, indicators=indicators)
             for stock in stocks
         ]
-        for future in concurrent.futures.as_completed(future_proc):
-            result = future.result()
-            updated_stocks.append(result)
-    return updated_stocks
+        return [
+            future.result()
+            for future in concurrent.futures.as_completed(future_proc)
+        ]
+
+
+def compute_results(stocks: List[Stock], indicators) -> List[AssetResult]:
+    """Computes the score of each stock in list, without sending the klines back. Uses multiprocessing.
+
+    Args:
+        stocks (List[Stock]): List of stocks to compute score
+        indicators (List[Indicator]): List of indicators giving score
+
+    Returns:
+        List[AssetResult]: score and indicator columns of each stock. `stocks` are left untouched.
+    """
+    results = []
+    with span("compute_results", nb_symbols=len(stocks)):
+        with concurrent.futures.ProcessPoolExecutor(
+            mp_context=mp.get_context("spawn")
+        ) as executor:
+            future_proc = [
+                executor.submit(
+                    run_traced,
+                    score_and_outputs,
+                    stock=stock,
+                    indicators=indicators,
+                )
+                for stock in stocks
+            ]
+            for future in concurrent.futures.as_completed(future_proc):
+                results.append(collect(future.result()))
+    return results
+
+
+def confluence_score(scored_assets: Dict[str, List[Index]]) -> List[Index]:
+    """Combines the scores of the same assets computed on several timeframes.
+    The global score of an asset is the sum of its global scores on each timeframe,
+    and its detailed score is given per indicator and timeframe.
+
+    Args:
+        scored_assets (Dict[str, List[Index]]): timeframe -> assets whose score has been computed.
+            The first timeframe is the one whose klines are kept.
+
+    Returns:
+        List[Index]: assets of the first timeframe, with their combined scores (no copy)
+    """
+    intervals = list(scored_assets.keys())
+    assets_per_interval = {
+        interval: {asset.symbol: asset for asset in assets}
+        for interval, assets in scored_assets.items()
+    }
+    combined_assets = []
+    for asset in scored_assets[intervals[0]]:
+        global_score = 0
+        detailed_score = {}
+        for interval in intervals:
+            same_asset = assets_per_interval[interval].get(asset.symbol, None)
+            if same_asset is None:
+                continue
+            global_score += same_asset.global_score
+            for indicator, score in same_asset.detailed_score.items():
+                detailed_score[f"{indicator} ({interval})"] = score
+        asset.global_score = global_score
+        asset.detailed_score = detailed_score
+        combined_assets.append(asset)
+    return combined_assets
+
+
+def load_and_score(
+    symbol: str,
+    loading_function: Callable,
+    path_to_datasets: Path,
+    indicators,
+    interval: str = "1d",
+) -> AssetScore:
+    """Loads an asset, computes its score and only returns the score.
+
+    Args:
+        symbol (str): symbol of the asset
+        loading_function (Callable): eg `Stock.load_stock`
+        path_to_datasets (Path): path of the datasets
+        indicators (List[Indicator]): List of indicators giving score
+        interval (str): timeframe of the klines, eg `1d` or `1wk`.
+
+    Returns:
+        AssetScore: score of the asset
+    """
+    asset = loading_function(
+        symbol=symbol,
+        path_to_datasets=path_to_datasets,
+        interval=interval,
+    )
+    return score_asset(asset, indicators)
+
+
+def scan_in_chunks(
+    symbols: List[str],
+    loading_function: Callable,
+    path_to_datasets: Path,
+    indicators,
+    chunk_size: int = 64,
+    interval: str = "1d",
+    max_workers: int = None,
+    executor: concurrent.futures.Executor = None,
+    on_error: Callable[[str, Exception], None] = None,
+) -> Iterator[AssetScore]:
+    """Streams the scores of `symbols`, loading assets from the disk in the workers.
+    At most `chunk_size` assets are in flight at once and only their scores are
+    sent back, so memory stays flat whatever the size of the universe.
+    Uses multiprocessing.
+
+    Args:
+        symbols (List[str]): symbols to scan
+        loading_function (Callable): eg `Stock.load_stock`
+        path_to_datasets (Path): path of the datasets
+        indicators (List[Indicator]): List of indicators giving score
+        chunk_size (int): maximum number of assets loaded at the same time
+        interval (str): timeframe of the klines, eg `1d` or `1wk`.
+        max_workers (int): number of processes. Defaults to the number of CPUs.
+        executor (concurrent.futures.Executor): executor to reuse, eg between scans.
+            Defaults to a new process pool of `max_workers` processes.
+        on_error (Callable[[str, Exception], None]): called with the symbol and the
+            exception when an asset cannot be loaded or scored, eg a missing file;
+            the scan goes on with the other symbols. Defaults to None, the exception
+            is raised.
+
+    Yields:
+        AssetScore: score of each asset, in order of completion
+    """
+    symbols = iter(symbols)
+    if executor is None:
+        executor_context = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=mp.get_context("spawn"),
+        )
+    else:
+        executor_context = nullcontext(executor)
+    with executor_context as executor:
+
+        def submit(symbol: str) -> concurrent.futures.Future:
+            return executor.submit(
+                load_and_score,
+                symbol=symbol,
+                loading_function=loading_function,
+                path_to_datasets=path_to_datasets,
+                indicators=indicators,
+                interval=interval,
+            )
+
+        # future -> symbol, to report the failing symbols
+        in_flight = {
+            submit(symbol): symbol for _, symbol in zip(range(chunk_size), symbols)
+        }
+        while len(in_flight) > 0:
+            done, _ = concurrent.futures.wait(
+                in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                symbol = in_flight.pop(future)
+                next_symbol = next(symbols, None)
+                if next_symbol is not None:
+                    in_flight[submit(next_symbol)] = next_symbol
+                try:
+                    score = future.result()
+                except Exception as e:
+                    if on_error is None:
+                        raise
+                    on_error(symbol, e)
+                    continue
+                yield score
@@ -0,0 +1,108 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Callable, Hashable
+
+
+class LRUCache:
+    """Thread-safe cache dropping the least recently used values once it is full.
+
+    The size of the cache is the sum of the weights of its values: by default
+    each value weighs 1, and `max_weight` is the number of values kept.
+    """
+
+    def __init__(self, max_weight: int, weigh: Callable[[Any], int] = None) -> None:
+        """
+        Args:
+            max_weight (int): maximum total weight of the values
+            weigh (Callable[[Any], int], optional): weight of a value. Defaults to 1 per value.
+        """
+        self.max_weight = max_weight
+        self.weigh = weigh if weigh is not None else (lambda value: 1)
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._values: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._weights = {}
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._values
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._values:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._values.move_to_end(key)
+            return self._values[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Caches `value` at `key`. A value heavier than `max_weight` is not cached."""
+        weight = self.weigh(value)
+        with self._lock:
+            if key in self._values:
+                self.weight -= self._weights.pop(key)
+                del self._values[key]
+            if weight > self.max_weight:
+                return
+            self._values[key] = value
+            self._weights[key] = weight
+            self.weight += weight
+            while self.weight > self.max_weight:
+                oldest_key, _ = self._values.popitem(last=False)
+                self.weight -= self._weights.pop(oldest_key)
+
+    def get_or_create(self, key: Hashable, create: Callable[[], Any]) -> Any:
+        """Returns the value cached at `key`, or creates and caches it with `create`.
+        Two concurrent misses on the same key may both create the value."""
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = create()
+            self.put(key, value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+            self._weights.clear()
+            self.weight = 0
+
+
+class TTLCache(LRUCache):
+    """`LRUCache` whose values expire `ttl` seconds after being cached."""
+
+    def __init__(self, ttl: float, max_size: int) -> None:
+        """
+        Args:
+            ttl (float): lifetime of a value, in seconds
+            max_size (int): maximum number of values
+        """
+        super().__init__(max_weight=max_size)
+        self.ttl = ttl
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        sentinel = object()
+        entry = super().get(key, sentinel)
+        if entry is sentinel:
+            return default
+        expires_at, value = entry
+        if monotonic() >= expires_at:
+            with self._lock:
+                # counted as a hit by LRUCache.get
+                self.hits -= 1
+                self.misses += 1
+                if self._values.get(key) is entry:
+                    del self._values[key]
+                    self.weight -= self._weights.pop(key)
+            return default
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        super().put(key, (monotonic() + self.ttl, value))
@@ -0,0 +1,421 @@
+import math
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+
+class ExpressionError(ValueError):
+    """Raised when a condition expression cannot be parsed, compiled or evaluated."""
+
+
+TOKEN_REGEX = re.compile(
+    r"\s*(?:(?P<number>\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)"
+    r"|(?P<name>[A-Za-z_][A-Za-z0-9_]*)"
+    r"|(?P<op><=|>=|==|!=|[<>&|~()+\-*/,]))"
+)
+"""Tokens of the expression language: numbers, names and operators"""
+
+KEYWORDS = {"and": "&", "or": "|", "not": "~"}
+"""Word aliases of the logical operators"""
+
+COMPARISONS = {
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+}
+ARITHMETICS = {
+    "+": np.add,
+    "-": np.subtract,
+    "*": np.multiply,
+    "/": np.divide,
+}
+LOGICALS = {
+    "&": np.logical_and,
+    "|": np.logical_or,
+}
+
+FUNCTIONS = {
+    # name: (argument types, return type)
+    "cross_above": (("num", "num"), "bool"),
+    "cross_below": (("num", "num"), "bool"),
+    "shift": (("num", "int"), "num"),
+    "abs": (("num",), "num"),
+    "min": (("num", "num"), "num"),
+    "max": (("num", "num"), "num"),
+}
+"""Functions callable from an expression, with their signature"""
+
+
+def _tokenize(source: str) -> List[Tuple[str, str]]:
+    """Splits `source` into a list of `(kind, value)` tokens.
+
+    Args:
+        source (str): expression to tokenize
+
+    Raises:
+        ExpressionError: if a character does not belong to the language
+
+    Returns:
+        List[Tuple[str, str]]: list of tokens, ending with an `("end", "")` token.
+    """
+    tokens = []
+    position = 0
+    source = source.rstrip()
+    while position < len(source):
+        match = TOKEN_REGEX.match(source, position)
+        if match is None or match.end() == position:
+            raise ExpressionError(
+                f"Unexpected character {source[position:].strip()[:1]!r} "
+                f"at position {position}."
+            )
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "name" and value.lower() in KEYWORDS:
+            kind, value = "op", KEYWORDS[value.lower()]
+        tokens.append((kind, value))
+        position = match.end()
+    tokens.append(("end", ""))
+    return tokens
+
+
+class _Parser:
+    """Recursive descent parser building a tree of nested tuples.
+
+    Nodes are tuples `(kind, value, *children)` where kind is one of
+    `num`, `col`, `neg`, `not`, `arith`, `cmp`, `logic` and `call`.
+    Comparisons bind tighter than `&` and `|`, so `RSI < 30 & Close > 10`
+    reads as `(RSI < 30) & (Close > 10)`.
+    """
+
+    def __init__(self, source: str) -> None:
+        self.tokens = _tokenize(source)
+        self.position = 0
+
+    def peek(self) -> Tuple[str, str]:
+        return self.tokens[self.position]
+
+    def advance(self) -> Tuple[str, str]:
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def expect(self, value: str) -> None:
+        kind, current = self.advance()
+        if current != value:
+            raise ExpressionError(
+                f"Expected {value!r} but found {current or 'end of expression'!r}."
+            )
+
+    def parse(self) -> tuple:
+        node = self.parse_or()
+        kind, value = self.peek()
+        if kind != "end":
+            raise ExpressionError(f"Unexpected token {value!r}.")
+        return node
+
+    def parse_or(self) -> tuple:
+        node = self.parse_and()
+        while self.peek() == ("op", "|"):
+            self.advance()
+            node = ("logic", "|", node, self.parse_and())
+        return node
+
+    def parse_and(self) -> tuple:
+        node = self.parse_not()
+        while self.peek() == ("op", "&"):
+            self.advance()
+            node = ("logic", "&", node, self.parse_not())
+        return node
+
+    def parse_not(self) -> tuple:
+        if self.peek() == ("op", "~"):
+            self.advance()
+            return ("not", None, self.parse_not())
+        return self.parse_comparison()
+
+    def parse_comparison(self) -> tuple:
+        node = self.parse_sum()
+        kind, value = self.peek()
+        if kind == "op" and value in COMPARISONS:
+            self.advance()
+            node = ("cmp", value, node, self.parse_sum())
+            kind, value = self.peek()
+            if kind == "op" and value in COMPARISONS:
+                raise ExpressionError(
+                    "Chained comparisons are not supported, combine them with `&`."
+                )
+        return node
+
+    def parse_sum(self) -> tuple:
+        node = self.parse_term()
+        while self.peek() in (("op", "+"), ("op", "-")):
+            _, value = self.advance()
+            node = ("arith", value, node, self.parse_term())
+        return node
+
+    def parse_term(self) -> tuple:
+        node = self.parse_unary()
+        while self.peek() in (("op", "*"), ("op", "/")):
+            _, value = self.advance()
+            node = ("arith", value, node, self.parse_unary())
+        return node
+
+    def parse_unary(self) -> tuple:
+        if self.peek() == ("op", "-"):
+            self.advance()
+            operand = self.parse_unary()
+            if operand[0] == "num":
+                return ("num", -operand[1])
+            return ("neg", None, operand)
+        return self.parse_primary()
+
+    def parse_primary(self) -> tuple:
+        kind, value = self.advance()
+        if kind == "number":
+            return ("num", float(value))
+        if kind == "name":
+            if self.peek() == ("op", "("):
+                self.advance()
+                args = []
+                if self.peek() != ("op", ")"):
+                    args.append(self.parse_or())
+                    while self.peek() == ("op", ","):
+                        self.advance()
+                        args.append(self.parse_or())
+                self.expect(")")
+                return ("call", value, *args)
+            return ("col", value)
+        if (kind, value) == ("op", "("):
+            node = self.parse_or()
+            self.expect(")")
+            return node
+        raise ExpressionError(
+            f"Unexpected token {value or 'end of expression'!r}."
+        )
+
+
+@dataclass
+class Program:
+    """Compiled form of one or several expressions.
+
+    Every distinct sub-expression is computed once and stored in a slot, so
+    sub-expressions shared between the expressions (or repeated in one of them)
+    are evaluated a single time.
+
+    Attributes:
+        sources (Tuple[str]): expressions the program was compiled from
+        instructions (List[tuple]): `(opcode, value, argument slots)` in evaluation order
+        outputs (Tuple[int]): slot holding the result of each expression
+        columns (Tuple[str]): columns the program reads
+    """
+
+    sources: Tuple[str, ...]
+    instructions: List[tuple] = field(default_factory=list)
+    outputs: Tuple[int, ...] = ()
+    columns: Tuple[str, ...] = ()
+
+    def evaluate(self, data: Dict[str, np.ndarray]) -> List[np.ndarray]:
+        """Evaluates the program on `data`.
+
+        Arrays of `data` are the columns of one asset, time on the last axis:
+        the scan evaluates the conditions asset by asset, in its workers.
+
+        Args:
+            data (Dict[str, np.ndarray]): mapping column name -> values
+
+        Raises:
+            ExpressionError: if a column used by the program is missing
+
+        Returns:
+            List[np.ndarray]: boolean arrays, one per compiled expression
+        """
+        missing = [column for column in self.columns if column not in data]
+        if len(missing) > 0:
+            raise ExpressionError(
+                f"Unknown column(s) {', '.join(missing)}. "
+                "Enable the indicator computing them before this condition."
+            )
+        slots = []
+        for opcode, value, args in self.instructions:
+            values = [slots[arg] for arg in args]
+            slots.append(_execute(opcode, value, values, data))
+        return [np.asarray(slots[output], dtype=bool) for output in self.outputs]
+
+
+def _shift(values: np.ndarray, periods: int) -> np.ndarray:
+    """Shifts `values` by `periods` bars along the time (last) axis, padding with NaN."""
+    values = np.asarray(values, dtype="float64")
+    if periods == 0 or values.ndim == 0:
+        return values
+    shifted = np.full_like(values, np.nan)
+    if periods >= values.shape[-1]:
+        return shifted
+    shifted[..., periods:] = values[..., :-periods]
+    return shifted
+
+
+def _execute(opcode: str, value, values: List[np.ndarray], data: Dict) -> np.ndarray:
+    if opcode == "num":
+        return value
+    if opcode == "col":
+        return np.asarray(data[value], dtype="float64")
+    if opcode == "neg":
+        return np.negative(values[0])
+    if opcode == "not":
+        return np.logical_not(values[0])
+    if opcode == "arith":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return ARITHMETICS[value](values[0], values[1])
+    if opcode == "cmp":
+        with np.errstate(invalid="ignore"):
+            return COMPARISONS[value](values[0], values[1])
+    if opcode == "logic":
+        return LOGICALS[value](values[0], values[1])
+    if opcode == "shift":
+        return _shift(values[0], value)
+    if opcode == "abs":
+        return np.abs(values[0])
+    if opcode == "min":
+        return np.fmin(values[0], values[1])
+    if opcode == "max":
+        return np.fmax(values[0], values[1])
+    raise ExpressionError(f"Unknown opcode {opcode}.")
+
+
+class _Compiler:
+    """Lowers parsed trees into a `Program`, sharing identical sub-expressions."""
+
+    def __init__(self) -> None:
+        self.instructions = []
+        self.slots = {}
+        self.types = []
+        self.columns = []
+
+    def emit(self, opcode: str, value, args: Tuple[int, ...], type_: str) -> int:
+        key = (opcode, value, args)
+        if key not in self.slots:
+            self.instructions.append(key)
+            self.types.append(type_)
+            self.slots[key] = len(self.instructions) - 1
+        return self.slots[key]
+
+    def check(self, slot: int, expected: str, context: str) -> None:
+        if self.types[slot] != expected:
+            raise ExpressionError(
+                f"{context} expects a {'condition' if expected == 'bool' else 'number'}."
+            )
+
+    def compile(self, node: tuple) -> int:
+        kind = node[0]
+        if kind == "num":
+            return self.emit("num", node[1], (), "num")
+        if kind == "col":
+            if node[1] not in self.columns:
+                self.columns.append(node[1])
+            return self.emit("col", node[1], (), "num")
+        if kind == "call":
+            return self.compile_call(node[1], node[2:])
+
+        args = tuple(self.compile(child) for child in node[2:])
+        if kind == "neg":
+            self.check(args[0], "num", "`-`")
+            return self.emit("neg", None, args, "num")
+        if kind == "not":
+            self.check(args[0], "bool", "`~`")
+            return self.emit("not", None, args, "bool")
+        if kind == "arith":
+            for arg in args:
+                self.check(arg, "num", f"`{node[1]}`")
+            return self.emit("arith", node[1], args, "num")
+        if kind == "cmp":
+            for arg in args:
+                self.check(arg, "num", f"`{node[1]}`")
+            return self.emit("cmp", node[1], args, "bool")
+        if kind == "logic":
+            for arg in args:
+                self.check(arg, "bool", f"`{node[1]}`")
+            # `a & b` and `b & a` are the same sub-expression
+            return self.emit("logic", node[1], tuple(sorted(args)), "bool")
+        raise ExpressionError(f"Unknown node {kind}.")
+
+    def compile_call(self, name: str, children: Sequence[tuple]) -> int:
+        if name not in FUNCTIONS:
+            raise ExpressionError(
+                f"Unknown function {name!r}. "
+                f"Available functions: {', '.join(sorted(FUNCTIONS))}."
+            )
+        arg_types, _ = FUNCTIONS[name]
+        if len(children) != len(arg_types):
+            raise ExpressionError(
+                f"{name} expects {len(arg_types)} argument(s), got {len(children)}."
+            )
+
+        if name == "shift":
+            periods = children[1]
+            if (
+                periods[0] != "num"
+                or not math.isfinite(periods[1])
+                or periods[1] < 0
+                or periods[1] != int(periods[1])
+            ):
+                raise ExpressionError("shift expects a positive integer period.")
+            values = self.compile(children[0])
+            self.check(values, "num", name)
+            return self.emit("shift", int(periods[1]), (values,), "num")
+
+        args = tuple(self.compile(child) for child in children)
+        for arg in args:
+            self.check(arg, "num", name)
+        if name in ["cross_above", "cross_below"]:
+            # same convention as the indicators: the previous bar is on one side,
+            # the current bar is on the other side or touching.
+            a, b = args
+            previous_a = self.emit("shift", 1, (a,), "num")
+            previous_b = self.emit("shift", 1, (b,), "num")
+            if name == "cross_above":
+                before = self.emit("cmp", "<", (previous_a, previous_b), "bool")
+                after = self.emit("cmp", ">=", (a, b), "bool")
+            else:
+                before = self.emit("cmp", ">", (previous_a, previous_b), "bool")
+                after = self.emit("cmp", "<=", (a, b), "bool")
+            return self.emit("logic", "&", tuple(sorted((before, after))), "bool")
+        return self.emit(name, None, args, "num")
+
+
+@lru_cache(maxsize=256)
+def compile_expressions(*sources: str) -> Program:
+    """Parses and compiles `sources` into a single `Program`.
+    Results are cached: compiling the same expressions twice is free.
+
+    Args:
+        sources (str): expressions to compile, eg `RSI < 30 & cross_above(macd, macdsignal)`
+
+    Raises:
+        ExpressionError: if an expression is invalid
+
+    Returns:
+        Program: program evaluating every expression, in order
+    """
+    compiler = _Compiler()
+    outputs = []
+    for source in sources:
+        tree = _Parser(source).parse()
+        output = compiler.compile(tree)
+        if compiler.types[output] != "bool":
+            raise ExpressionError(
+                f"{source!r} is not a condition, compare it with something, eg `RSI < 30`."
+            )
+        outputs.append(output)
+    return Program(
+        sources=tuple(sources),
+        instructions=compiler.instructions,
+        outputs=tuple(outputs),
+        columns=tuple(compiler.columns),
+    )
+
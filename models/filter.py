@@ -0,0 +1,165 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import List, Tuple, Union
+
+import numpy as np
+
+from models.asset import Index, Stock
+from models.indicator import beautiful_str
+
+
+@dataclass
+class Filter(ABC):
+    """Cheap predicate evaluated before any indicator is computed.
+    Assets which don't pass the filter are not scanned.
+
+    Filters are applied by increasing `_cost`, so that the cheapest
+    predicates prune the universe before the more expensive ones run.
+    """
+
+    _cost: int = 0
+
+    def __str__(self) -> str:
+        return type(self).__name__
+
+    def checkbox(
+        self,
+    ):
+        import streamlit as st
+
+        self.on = st.checkbox(type(self).__name__, key="filter_" + str(self))
+
+    def text_input(self):
+        import streamlit as st
+
+        for param in type(self).__dataclass_fields__.keys():
+            if param[0] != "_":
+                setattr(
+                    self,
+                    param,
+                    st.text_input(
+                        label=beautiful_str(param),
+                        value=getattr(self, param),
+                        key="filter_" + str(self) + str(param),
+                    ),
+                )
+
+    def applies_to(self, asset: Union[Index, Stock]) -> bool:
+        return True
+
+    @abstractmethod
+    def keep(self, asset: Union[Index, Stock]) -> bool:
+        """Whether `asset` passes the filter."""
+
+
+def _between(value, min_value, max_value) -> bool:
+    """Whether `value` is in [`min_value`, `max_value`]. Missing values are never kept."""
+    if value is None or np.isnan(float(value)):
+        return False
+    return float(min_value) <= float(value) <= float(max_value)
+
+
+@dataclass
+class FinancialFilter(Filter):
+    """Filter on the financials of a stock. Indices, which have no financials, are kept."""
+
+    _financial_key: str = None
+
+    def applies_to(self, asset: Union[Index, Stock]) -> bool:
+        return isinstance(asset, Stock)
+
+    def financial(self, asset: Stock):
+        return asset.financials.get(self._financial_key, None)
+
+
+@dataclass
+class MarketCap(FinancialFilter):
+    min_market_cap: float = 100_000_000_000
+    max_market_cap: float = np.inf
+
+    _financial_key: str = "marketCap"
+
+    def keep(self, asset: Stock) -> bool:
+        return _between(
+            self.financial(asset), self.min_market_cap, self.max_market_cap
+        )
+
+
+@dataclass
+class AverageVolume(FinancialFilter):
+    min_average_volume: float = 1_000_000
+    max_average_volume: float = np.inf
+
+    _financial_key: str = "tenDayAverageVolume"
+
+    def keep(self, asset: Stock) -> bool:
+        return _between(
+            self.financial(asset), self.min_average_volume, self.max_average_volume
+        )
+
+
+@dataclass
+class YearChange(FinancialFilter):
+    min_year_change: float = 0
+    max_year_change: float = np.inf
+
+    _financial_key: str = "yearChange"
+
+    def keep(self, asset: Stock) -> bool:
+        return _between(
+            self.financial(asset), self.min_year_change, self.max_year_change
+        )
+
+
+@dataclass
+class Price(Filter):
+    min_close: float = 0
+    max_close: float = np.inf
+
+    _cost: int = 1
+
+    def keep(self, asset: Union[Index, Stock]) -> bool:
+        if len(asset.klines) == 0:
+            return False
+        return _between(asset.klines["Close"].iloc[-1], self.min_close, self.max_close)
+
+
+@dataclass
+class Volume(Filter):
+    min_volume: float = 0
+    max_volume: float = np.inf
+
+    _cost: int = 1
+
+    def keep(self, asset: Union[Index, Stock]) -> bool:
+        if len(asset.klines) == 0:
+            return False
+        return _between(
+            asset.klines["Volume"].iloc[-1], self.min_volume, self.max_volume
+        )
+
+
+def apply_filters(
+    assets: List[Union[Index, Stock]], filters: List[Filter]
+) -> Tuple[List[Union[Index, Stock]], List[Tuple[str, int]]]:
+    """Keeps the assets passing every filter, cheapest filters first.
+
+    Args:
+        assets (List[Union[Index, Stock]]): assets to filter
+        filters (List[Filter]): filters to apply
+
+    Returns:
+        Tuple[List[Union[Index, Stock]], List[Tuple[str, int]]]: tuple made of
+            * the assets passing every filter, in their original order
+            * the name of each filter stage, along with the number of assets it pruned
+    """
+    stages = []
+    for current_filter in sorted(filters, key=lambda f: f._cost):
+        survivors = [
+            asset
+            for asset in assets
+            if not current_filter.applies_to(asset) or current_filter.keep(asset)
+        ]
+        stages.append((str(current_filter), len(assets) - len(survivors)))
+        assets = survivors
+    return assets, stages
@@ -1,12 +1,12 @@
 from dataclasses import dataclass
-from typing import Union
+from typing import List, Union
 
 import numpy as np
 import pandas as pd
-import streamlit as st
 from ta import momentum, trend
 
 from models.asset import Index, Stock
+from models.expression import ExpressionError, compile_expressions
 
 
 def beautiful_str(s: str) -> str:
@@ -35,9 +35,14 @@ class Indicator:
     def checkbox(
         self,
     ):
+        # only the app draws widgets: the workers computing indicators never import streamlit
+        import streamlit as st
+
         self.on = st.checkbox(type(self).__name__)
 
     def text_input(self):
+        import streamlit as st
+
         for param in type(self).__dataclass_fields__.keys():
             if param != "flag_column" and param[0] != "_":
                 setattr(
@@ -88,9 +93,10 @@ class StochRSI(Indicator):
             smooth1=int(self.k),
             smooth2=int(self.d),
         )
+        # ta gives the stochastic RSI between 0 and 1, the levels are between 0 and 100
         asset.klines["fastk"], asset.klines["fastd"] = (
-            stoch_rsi_ind.stochrsi_k(),
-            stoch_rsi_ind.stochrsi_d(),
+            100 * stoch_rsi_ind.stochrsi_k(),
+            100 * stoch_rsi_ind.stochrsi_d(),
         )
         asset.klines["StochRSIflag"] = 0
         ##Stoch conditions to test for
@@ -186,7 +192,9 @@ class MACD(Indicator):
             & (asset.klines["macd"].shift(1) > asset.klines["macdsignal"].shift(1))
             & (asset.klines["macd"] <= asset.klines["macdsignal"])
         )
-        asset.klines["lag"] = np.where(MacdSellCondition, -1, asset.klines["MACDflag"])
+        asset.klines["MACDflag"] = np.where(
+            MacdSellCondition, -1, asset.klines["MACDflag"]
+        )
 
         return asset.klines
 
@@ -266,3 +274,91 @@ class SentimentScore(Indicator):
         )
 
         return asset.klines
+
+
+@dataclass
+class CustomCondition(Indicator):
+    """Buy and sell conditions written in the expression language of `models.expression`,
+    eg `RSI < 30 & cross_above(macd, macdsignal) & Close > EMA_medium`.
+    Columns used by the conditions must be computed by indicators applied before this one.
+    """
+
+    buy_condition: str = ""
+    sell_condition: str = ""
+
+    flag_column: str = "CustomFlag"
+
+    def text_input(self):
+        import streamlit as st
+
+        super().text_input()
+        try:
+            self.compile()
+        except ExpressionError as e:
+            st.error(str(e))
+
+    def compile(self):
+        return compile_expressions(
+            str(self.buy_condition).strip() or "0 > 1",
+            str(self.sell_condition).strip() or "0 > 1",
+        )
+
+    def apply_indicator(self, asset: Union[Index, Stock]) -> pd.DataFrame:
+        program = self.compile()
+        buy, sell = program.evaluate(
+            {column: asset.klines[column].values for column in program.columns}
+        )
+        asset.klines[self.flag_column] = 0
+        asset.klines[self.flag_column] = np.where(buy, 1, asset.klines[self.flag_column])
+        asset.klines[self.flag_column] = np.where(
+            sell, -1, asset.klines[self.flag_column]
+        )
+        return asset.klines
+
+
+def default_indicators() -> List[Indicator]:
+    """Indicators of the app with their default parameters, in the order they are applied."""
+    return [RSI(), StochRSI(), EMA(), MACD(), CipherB(), SentimentScore()]
+
+
+INDICATORS = {
+    indicator.__name__: indicator
+    for indicator in [RSI, StochRSI, EMA, MACD, CipherB, SentimentScore, CustomCondition]
+}
+"""Indicator classes, by name"""
+
+
+def indicators_from_config(configs: List[dict]) -> List[Indicator]:
+    """Creates indicators from their configuration, eg `[{"name": "RSI", "period": 14}]`.
+    Missing parameters take their default value.
+
+    Args:
+        configs (List[dict]): name and parameters of each indicator, in the order they are applied
+
+    Raises:
+        ValueError: if an indicator or one of its parameters does not exist
+
+    Returns:
+        List[Indicator]: indicators
+    """
+    indicators = []
+    for config in configs:
+        parameters = dict(config)
+        name = parameters.pop("name", None)
+        if name not in INDICATORS:
+            raise ValueError(
+                f"Unknown indicator {name!r}, expected one of {', '.join(INDICATORS)}."
+            )
+        fields = [
+            field
+            for field in INDICATORS[name].__dataclass_fields__
+            if field != "flag_column" and field[0] != "_"
+        ]
+        unknown_parameters = [param for param in parameters if param not in fields]
+        if len(unknown_parameters) > 0:
+            raise ValueError(
+                f"Unknown parameters {', '.join(unknown_parameters)} for {name}, "
+                + f"expected some of {', '.join(fields)}."
+            )
+        indicators.append(INDICATORS[name](**parameters))
+    return indicators
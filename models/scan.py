@@ -0,0 +1,408 @@
+import json
+import os
+import pickle
+import threading
+import uuid
+from collections import OrderedDict
+from copy import copy
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Hashable, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from get_data.manifest import Manifest, manifest_version
+from models.asset import AssetResult, Index, Stock
+
+
+SCANS_DIRECTORY = ".scans"
+"""Directory, relative to the datasets, where precomputed scans are stored"""
+DEFAULT_SCAN = "default"
+"""Name of the scan of the default indicators, precomputed by the update job"""
+
+
+def config_key(objects: List) -> Tuple:
+    """Hashable description of dataclasses, eg indicators or filters, with their parameters.
+    Parameters are compared as strings, as the app reads them from text inputs.
+
+    Args:
+        objects (List): dataclass instances
+
+    Returns:
+        Tuple: name and parameters of each object
+    """
+    return tuple(
+        (
+            type(obj).__name__,
+            tuple((name, str(getattr(obj, name))) for name in obj.__dataclass_fields__),
+        )
+        for obj in objects
+    )
+
+
+def scan_config(intervals: List[str], filters: List, indicators: List) -> Tuple:
+    """Hashable configuration of a scan, identifying identical scans.
+
+    Args:
+        intervals (List[str]): scanned timeframes
+        filters (List[Filter]): applied filters
+        indicators (List[Indicator]): applied indicators
+
+    Returns:
+        Tuple: configuration of the scan
+    """
+    return (tuple(intervals), config_key(filters), config_key(indicators))
+
+
+@dataclass
+class ScoreIndex:
+    """Result of a scan, bucketed by absolute global score.
+    Built once per scan, so that filtering on the number of agreeing
+    indicators or paging through the results only touches one bucket.
+
+    Only the scores and the columns added by the indicators are stored: the
+    klines of an asset are rebuilt from the shared, unscanned asset when it is
+    displayed, see `view`.
+
+    Attributes:
+        buckets (Dict[int, np.ndarray]): absolute global score -> sorted array of symbols
+        results (Dict[str, AssetResult]): symbol -> score and indicator columns
+        base_assets (Dict[str, Union[Index, Stock]]): symbol -> unscanned asset, shared between scans
+        scores (pd.DataFrame): score matrix, indexed by symbol, with the score of each indicator in columns
+        non_neutral_pressures (int): number of assets with at least one non neutral indicator
+        breakdown (pd.DataFrame): indicator scores summed per global score,
+            indexed by global score, with one column per indicator
+        columns (List[str]): columns of the scanned klines
+    """
+
+    buckets: Dict[int, np.ndarray] = field(default_factory=dict)
+    results: Dict[str, AssetResult] = field(default_factory=dict)
+    base_assets: Dict[str, Union[Index, Stock]] = field(default_factory=dict)
+    scores: pd.DataFrame = None
+    non_neutral_pressures: int = 0
+    breakdown: pd.DataFrame = None
+    columns: List[str] = field(default_factory=list)
+
+    @classmethod
+    def from_results(
+        cls,
+        results: List[AssetResult],
+        base_assets: List[Union[Index, Stock]],
+    ):
+        """Builds the index of scanned assets.
+
+        Args:
+            results (List[AssetResult]): scores and indicator columns of the assets
+            base_assets (List[Union[Index, Stock]]): unscanned assets the results were computed on
+
+        Returns:
+            ScoreIndex: index of the assets
+        """
+        symbols = np.array([result.symbol for result in results], dtype=object)
+        global_scores = np.array(
+            [int(result.global_score) for result in results], dtype=np.int64
+        )
+        # score matrix: one row per asset, one column per indicator
+        scores = pd.DataFrame(
+            [result.detailed_score for result in results],
+            index=pd.Index(symbols, dtype=object),
+        ).fillna(0)
+        non_neutral_pressures = int((scores != 0).any(axis=1).sum())
+        # a negative global score means a sell pressure: sell pressures
+        # of the indicators participate positively to it.
+        signs = np.where(global_scores < 0, -1, 1)
+        breakdown = scores.mul(signs, axis=0).groupby(global_scores).sum()
+        breakdown.index.name = "score"
+
+        buckets = {
+            int(score): np.sort(bucket_symbols.to_numpy(dtype=object))
+            for score, bucket_symbols in pd.Series(symbols, dtype=object).groupby(
+                np.abs(global_scores)
+            )
+        }
+        base_assets = {asset.symbol: asset for asset in base_assets}
+        columns = []
+        if len(results) > 0:
+            columns = list(base_assets[results[0].symbol].klines.columns) + list(
+                results[0].outputs.keys()
+            )
+        return cls(
+            buckets=buckets,
+            results={result.symbol: result for result in results},
+            base_assets={result.symbol: base_assets[result.symbol] for result in results},
+            scores=scores,
+            non_neutral_pressures=non_neutral_pressures,
+            breakdown=breakdown,
+            columns=columns,
+        )
+
+    def __len__(self) -> int:
+        return len(self.results)
+
+    @property
+    def max_score(self) -> int:
+        return max(self.buckets.keys(), default=0)
+
+    def count(self, score: int) -> int:
+        """Number of assets whose absolute global score is `score`."""
+        return len(self.buckets.get(score, ()))
+
+    def view(self, symbol: str) -> Union[Index, Stock]:
+        """Scanned asset `symbol`, with its score and the indicator columns in its klines.
+        The shared asset is not modified: only its klines are copied.
+
+        Args:
+            symbol (str): symbol of the asset
+
+        Returns:
+            Union[Index, Stock]: shallow copy of the shared asset
+        """
+        result = self.results[symbol]
+        asset = copy(self.base_assets[symbol])
+        asset.global_score = result.global_score
+        asset.detailed_score = result.detailed_score
+        asset.klines = asset.klines.assign(**result.outputs)
+        return asset
+
+    def page(self, score: int, start: int, length: int) -> List[Union[Index, Stock]]:
+        """Assets whose absolute global score is `score`, sorted by symbol.
+
+        Args:
+            score (int): absolute global score
+            start (int): index of the first asset of the page in the bucket
+            length (int): maximum number of assets in the page
+
+        Returns:
+            List[Union[Index, Stock]]: assets of the page
+        """
+        symbols = self.buckets.get(score, np.array([], dtype=object))
+        return [self.view(symbol) for symbol in symbols[start : start + length]]
+
+
+@dataclass
+class ScanResult:
+    """Everything a session needs to display a scan. Shared by the sessions running the same scan.
+
+    Attributes:
+        index_scores (ScoreIndex): scanned indices
+        stock_scores (ScoreIndex): scanned stocks
+        filter_stages (List[Tuple[str, int]]): name of each filter and number of assets it pruned
+        nb_conditions (int): maximum number of conditions an asset could match
+        elapsed_time (float): time spent computing the scores, in seconds
+        manifests (Dict[str, Manifest]): timeframe -> manifest of the datasets scanned
+        results (Dict[str, Dict[str, AssetResult]]): `{kind}_{timeframe}` -> symbol -> result
+            on this timeframe alone, eg `stocks_1wk`. Reused by the next scan of the datasets.
+        scan_id (str): unique identifier of the scan
+    """
+
+    index_scores: ScoreIndex
+    stock_scores: ScoreIndex
+    filter_stages: List[Tuple[str, int]] = field(default_factory=list)
+    nb_conditions: int = 0
+    elapsed_time: float = 0
+    manifests: Dict[str, Manifest] = field(default_factory=dict)
+    results: Dict[str, Dict[str, AssetResult]] = field(default_factory=dict)
+    scan_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+
+
+class ScanCache:
+    """Process-wide cache of the latest scans, keyed by dataset versions and scan configuration.
+    Sessions running an identical scan get the same `ScanResult`, computed once.
+    """
+
+    def __init__(self, max_size: int = 16) -> None:
+        """
+        Args:
+            max_size (int): number of scans kept. The least recently used ones are dropped.
+        """
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._scans: "OrderedDict[Tuple[Hashable, Hashable], ScanResult]" = OrderedDict()
+        self._computing_locks: Dict[Hashable, Tuple[threading.Lock, int]] = {}
+        """config -> (lock, number of calls holding or waiting for it), dropped once unused"""
+
+    def __len__(self) -> int:
+        return len(self._scans)
+
+    def _get(self, key: Tuple[Hashable, Hashable]) -> ScanResult:
+        with self._lock:
+            scan = self._scans.get(key)
+            if scan is not None:
+                self._scans.move_to_end(key)
+            return scan
+
+    def get(self, versions: Hashable, config: Hashable) -> Optional[ScanResult]:
+        """Scan of `config` on the datasets of `versions`, if cached."""
+        return self._get((versions, config))
+
+    def put(self, versions: Hashable, config: Hashable, scan: ScanResult) -> None:
+        """Caches the `scan` of `config` on the datasets of `versions`, eg a precomputed scan."""
+        with self._lock:
+            self._scans[(versions, config)] = scan
+            while len(self._scans) > self.max_size:
+                self._scans.popitem(last=False)
+
+    def _latest(self, config: Hashable) -> Optional[ScanResult]:
+        with self._lock:
+            for (_, scan_config), scan in reversed(self._scans.items()):
+                if scan_config == config:
+                    return scan
+        return None
+
+    def get_or_compute(
+        self,
+        versions: Hashable,
+        config: Hashable,
+        compute: Callable[[Optional[ScanResult]], ScanResult],
+    ) -> Tuple[ScanResult, bool]:
+        """Returns the scan of `config` on the datasets of `versions`, or computes it with `compute`.
+        Concurrent sessions asking for the same scan wait for the first one to compute it,
+        and get it as cached.
+
+        Args:
+            versions (Hashable): versions of the scanned datasets
+            config (Hashable): scan configuration, eg the timeframes, filters and indicators
+            compute (Callable[[Optional[ScanResult]], ScanResult]): computes the scan,
+                given the latest scan of `config` on previous datasets, if any
+
+        Returns:
+            Tuple[ScanResult, bool]: scan, shared with the other sessions, and whether
+                this call computed it
+        """
+        key = (versions, config)
+        scan = self._get(key)
+        if scan is not None:
+            return scan, False
+        with self._lock:
+            computing_lock, nb_calls = self._computing_locks.get(
+                config, (threading.Lock(), 0)
+            )
+            self._computing_locks[config] = (computing_lock, nb_calls + 1)
+        try:
+            with computing_lock:
+                scan = self._get(key)
+                if scan is not None:
+                    return scan, False
+                scan = compute(self._latest(config))
+                with self._lock:
+                    self._scans[key] = scan
+                    while len(self._scans) > self.max_size:
+                        self._scans.popitem(last=False)
+                return scan, True
+        finally:
+            with self._lock:
+                computing_lock, nb_calls = self._computing_locks[config]
+                if nb_calls == 1:
+                    del self._computing_locks[config]
+                else:
+                    self._computing_locks[config] = (computing_lock, nb_calls - 1)
+
+
+def save_scan(
+    path_to_datasets: Path,
+    name: str,
+    config: Hashable,
+    manifest: Manifest,
+    index_results: List[AssetResult],
+    stock_results: List[AssetResult],
+    nb_conditions: int = 0,
+    elapsed_time: float = 0,
+) -> Path:
+    """Stores the daily results of a scan next to the datasets they were computed on,
+    in `{path_to_datasets}/.scans/{name}.pkl`. Hidden, the scan is not part of the manifest.
+
+    Args:
+        path_to_datasets (Path): path to the datasets
+        name (str): name of the scan, eg `default`
+        config (Hashable): configuration of the scan, see `config_key`
+        manifest (Manifest): manifest of the datasets, built before loading them
+        index_results (List[AssetResult]): results of the indices
+        stock_results (List[AssetResult]): results of the stocks
+        nb_conditions (int): maximum number of conditions an asset could match
+        elapsed_time (float): time spent computing the scores, in seconds
+
+    Returns:
+        Path: path of the stored scan
+    """
+    directory = Path(path_to_datasets) / SCANS_DIRECTORY
+    directory.mkdir(parents=True, exist_ok=True)
+    header = {"version": manifest_version(manifest), "config": repr(config)}
+    filename = directory / f"{name}.pkl"
+    # written atomically: the app may read it at any time
+    with open(filename.with_suffix(".tmp"), "wb") as outfile:
+        pickle.dump(
+            (header, manifest, index_results, stock_results, nb_conditions, elapsed_time),
+            outfile,
+        )
+    os.replace(filename.with_suffix(".tmp"), filename)
+    with open(filename.with_suffix(".json.tmp"), "w") as outfile:
+        json.dump(header, outfile)
+    os.replace(filename.with_suffix(".json.tmp"), filename.with_suffix(".json"))
+    return filename
+
+
+def load_scan(
+    path_to_datasets: Path,
+    name: str,
+    config: Hashable,
+    version: str,
+    indices: List[Index],
+    stocks: List[Stock],
+) -> Optional[ScanResult]:
+    """Loads the daily scan stored by `save_scan`, if it was computed with `config`
+    on the datasets of `version`.
+
+    Args:
+        path_to_datasets (Path): path to the datasets
+        name (str): name of the scan, eg `default`
+        config (Hashable): expected configuration of the scan
+        version (str): expected version of the datasets
+        indices (List[Index]): loaded indices, whose klines the scan is displayed on
+        stocks (List[Stock]): loaded stocks, whose klines the scan is displayed on
+
+    Returns:
+        Optional[ScanResult]: the scan, or None if there is no such scan
+    """
+    filename = Path(path_to_datasets) / SCANS_DIRECTORY / f"{name}.pkl"
+    expected_header = {"version": version, "config": repr(config)}
+    # the small header is checked before loading the results
+    try:
+        with open(filename.with_suffix(".json"), "r") as infile:
+            if json.load(infile) != expected_header:
+                return None
+        with open(filename, "rb") as infile:
+            (
+                header,
+                manifest,
+                index_results,
+                stock_results,
+                nb_conditions,
+                elapsed_time,
+            ) = pickle.load(infile)
+    except (OSError, ValueError, pickle.UnpicklingError, EOFError):
+        return None
+    if header != expected_header:
+        return None
+
+    scores = {}
+    results = {}
+    for kind, assets, kind_results in [
+        ("indices", indices, index_results),
+        ("stocks", stocks, stock_results),
+    ]:
+        symbols = set(asset.symbol for asset in assets)
+        kind_results = [result for result in kind_results if result.symbol in symbols]
+        results[f"{kind}_1d"] = {result.symbol: result for result in kind_results}
+        # shallow copies, as in a live scan
+        scores[kind] = ScoreIndex.from_results(
+            [copy(result) for result in kind_results], assets
+        )
+    return ScanResult(
+        index_scores=scores["indices"],
+        stock_scores=scores["stocks"],
+        nb_conditions=nb_conditions,
+        elapsed_time=elapsed_time,
+        manifests={"1d": manifest},
+        results=results,
+    )
@@ -0,0 +1,406 @@
+"""Scan sharding between a coordinator and workers, possibly on several machines.
+
+The coordinator splits the symbols into shards and sends them to the connected
+workers. Each worker scans its shards with `scan_in_chunks` on its own cores,
+and sends the scores back.
+Workers only need access to the same datasets, eg through a shared volume.
+
+    # on each machine
+    python -m models.sharding worker --address coordinator-host:6000 --authkey secret
+    # or, to try it on localhost with 4 workers
+    python -m models.sharding local --workers 4
+"""
+import argparse
+import concurrent.futures
+import multiprocessing as mp
+import os
+import queue
+import socket
+import threading
+import traceback
+from collections import deque
+from dataclasses import dataclass
+from multiprocessing.connection import Client, Connection, Listener, wait
+from pathlib import Path
+from time import monotonic, sleep
+from typing import Dict, List, Set, Tuple
+
+from models.asset import AssetScore, Index, Stock, scan_in_chunks
+
+LOADING_FUNCTIONS = {
+    "index": Index.load_index,
+    "stock": Stock.load_stock,
+}
+"""Loading function of each kind of asset, as sent to the workers"""
+
+
+@dataclass
+class Shard:
+    """Symbols scanned by a single worker at once."""
+
+    shard_id: int
+    asset_kind: str
+    symbols: List[str]
+    attempts: int = 0
+    deadline: float = None
+
+
+class ScanCoordinator:
+    """Splits scans into shards and dispatches them to the connected workers.
+
+    Workers can connect or die at any time. A shard whose worker died or
+    answered with an error is sent to another worker. A shard whose worker is
+    slower than `shard_timeout` is also sent to another worker: the first
+    result wins, and the late one is ignored. Symbols which cannot be scanned,
+    eg without dataset, are reported by the workers, without failing their shard.
+    """
+
+    def __init__(
+        self,
+        address: Tuple[str, int] = ("localhost", 0),
+        authkey: bytes = None,
+        shard_size: int = 50,
+        shard_timeout: float = 300,
+        max_attempts: int = 3,
+    ) -> None:
+        """
+        Args:
+            address (Tuple[str, int]): address to listen to. Port 0 picks a free port.
+            authkey (bytes): secret shared with the workers, required: the workers
+                exchange pickles, which must not come from anyone reaching the port
+            shard_size (int): number of symbols per shard
+            shard_timeout (float): seconds after which a shard is sent to another worker
+            max_attempts (int): number of times a shard is sent before giving up on it
+
+        Raises:
+            ValueError: if `authkey` is empty
+        """
+        if not authkey:
+            raise ValueError("An authkey is required to accept workers")
+        self.listener = Listener(address, authkey=authkey)
+        self.shard_size = shard_size
+        self.shard_timeout = shard_timeout
+        self.max_attempts = max_attempts
+
+        self._new_workers = queue.Queue()
+        self._idle_workers = deque()
+        self._closed = False
+        self._accept_thread = threading.Thread(target=self._accept, daemon=True)
+        self._accept_thread.start()
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self.listener.address
+
+    def _accept(self) -> None:
+        while not self._closed:
+            try:
+                connection = self.listener.accept()
+            except (OSError, EOFError, mp.AuthenticationError):
+                continue
+            if connection.poll(10):
+                try:
+                    if connection.recv()[0] == "ready":
+                        self._new_workers.put(connection)
+                        continue
+                except (OSError, EOFError):
+                    pass
+            connection.close()
+
+    def _split(
+        self, symbols: List[str], asset_kind: str, first_id: int
+    ) -> List[Shard]:
+        return [
+            Shard(first_id + i, asset_kind, symbols[start : start + self.shard_size])
+            for i, start in enumerate(range(0, len(symbols), self.shard_size))
+        ]
+
+    def scan(
+        self,
+        index_symbols: List[str],
+        stock_symbols: List[str],
+        indicators,
+        interval: str = "1d",
+        timeout: float = None,
+    ) -> Tuple[List[AssetScore], List[AssetScore], List[str]]:
+        """Scans every symbol on the connected workers.
+
+        Args:
+            index_symbols (List[str]): symbols of the indices to scan
+            stock_symbols (List[str]): symbols of the stocks to scan
+            indicators (List[Indicator]): List of indicators giving score
+            interval (str): timeframe of the klines, eg `1d` or `1wk`.
+            timeout (float): seconds after which the scan is abandoned.
+                Defaults to no timeout.
+
+        Returns:
+            Tuple[List[AssetScore], List[AssetScore], List[str]]: tuple made of
+                * the scores of the indices
+                * the scores of the stocks
+                * the symbols which could not be scanned
+        """
+        shards = self._split(index_symbols, "index", 0)
+        shards += self._split(stock_symbols, "stock", len(shards))
+        pending = deque(shards)
+        # shard id -> scores. A shard is either in `results` or in `failed` once done.
+        results: Dict[int, List[AssetScore]] = {}
+        failed: Dict[int, Shard] = {}
+        failed_symbols: Set[str] = set()
+        busy: Dict[Connection, Shard] = {}
+        scan_deadline = None if timeout is None else monotonic() + timeout
+
+        def give_up_or_retry(shard: Shard) -> None:
+            if shard.shard_id in results or shard.shard_id in failed or shard in pending:
+                return
+            if shard.attempts >= self.max_attempts:
+                failed[shard.shard_id] = shard
+            else:
+                pending.append(shard)
+
+        while len(results) + len(failed) < len(shards):
+            if scan_deadline is not None and monotonic() > scan_deadline:
+                for shard in shards:
+                    if shard.shard_id not in results:
+                        failed[shard.shard_id] = shard
+                break
+            while not self._new_workers.empty():
+                self._idle_workers.append(self._new_workers.get())
+
+            # dispatch
+            while len(pending) > 0 and len(self._idle_workers) > 0:
+                shard = pending.popleft()
+                if shard.shard_id in results or shard.shard_id in failed:
+                    continue
+                worker = self._idle_workers.popleft()
+                message = (
+                    "scan",
+                    shard.shard_id,
+                    shard.symbols,
+                    shard.asset_kind,
+                    indicators,
+                    interval,
+                )
+                try:
+                    worker.send(message)
+                except (OSError, EOFError):
+                    worker.close()
+                    pending.appendleft(shard)
+                    continue
+                shard.attempts += 1
+                shard.deadline = monotonic() + self.shard_timeout
+                busy[worker] = shard
+
+            # collect
+            if len(busy) == 0:
+                # wait for workers to connect
+                sleep(0.05)
+                continue
+            deadlines = [s.deadline for s in busy.values()]
+            wait_time = min([1] + [max(0, d - monotonic()) for d in deadlines])
+            for worker in wait(list(busy.keys()), timeout=wait_time):
+                shard = busy.pop(worker)
+                try:
+                    message = worker.recv()
+                except (OSError, EOFError):
+                    # dead worker
+                    worker.close()
+                    give_up_or_retry(shard)
+                    continue
+                self._idle_workers.append(worker)
+                if message[0] == "result":
+                    _, shard_id, scores, shard_failed_symbols = message
+                    if shard_id not in results:
+                        # a late result of a shard given up on is still welcome
+                        failed.pop(shard_id, None)
+                        results[shard_id] = scores
+                        failed_symbols.update(shard_failed_symbols)
+                else:
+                    print(f"Shard {shard.shard_id} failed on a worker:\n{message[2]}")
+                    give_up_or_retry(shard)
+
+            # slow workers: send their shard to another worker as well
+            for shard in list(busy.values()):
+                if (
+                    shard.shard_id not in results
+                    and shard.shard_id not in failed
+                    and monotonic() > shard.deadline
+                    and shard not in pending
+                ):
+                    shard.deadline = float("inf")
+                    give_up_or_retry(shard)
+
+        index_scores, stock_scores = [], []
+        for shard in shards:
+            scores = results.get(shard.shard_id, [])
+            if shard.asset_kind == "index":
+                index_scores.extend(scores)
+            else:
+                stock_scores.extend(scores)
+        for shard in failed.values():
+            failed_symbols.update(shard.symbols)
+        return index_scores, stock_scores, sorted(failed_symbols)
+
+    def close(self) -> None:
+        """Stops the workers and the listener."""
+        self._closed = True
+        # unblock the accepting thread
+        try:
+            socket.create_connection(self.address, timeout=1).close()
+        except OSError:
+            pass
+        while not self._new_workers.empty():
+            self._idle_workers.append(self._new_workers.get())
+        for worker in self._idle_workers:
+            try:
+                worker.send(("stop",))
+            except (OSError, EOFError):
+                pass
+            worker.close()
+        self._idle_workers.clear()
+        self.listener.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def run_worker(
+    address: Tuple[str, int],
+    authkey: bytes,
+    path_to_datasets: Path,
+    max_workers: int = None,
+    name: str = None,
+) -> None:
+    """Connects to the coordinator at `address` and scans the shards it receives, until stopped.
+
+    Args:
+        address (Tuple[str, int]): address of the coordinator
+        authkey (bytes): secret shared with the coordinator, required
+        path_to_datasets (Path): path of the datasets on this machine
+        max_workers (int): number of processes scanning a shard. Defaults to the number of CPUs.
+        name (str): name of the worker, for logs
+
+    Raises:
+        ValueError: if `authkey` is empty
+    """
+    if not authkey:
+        raise ValueError("An authkey is required to connect to the coordinator")
+    connection = Client(address, authkey=authkey)
+    connection.send(("ready", name or f"{socket.gethostname()}:{os.getpid()}"))
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=mp.get_context("spawn"),
+    ) as executor:
+        while True:
+            try:
+                message = connection.recv()
+            except (OSError, EOFError):
+                break
+            if message[0] == "stop":
+                break
+            _, shard_id, symbols, asset_kind, indicators, interval = message
+            failed_symbols = []
+            try:
+                scores = list(
+                    scan_in_chunks(
+                        symbols,
+                        LOADING_FUNCTIONS[asset_kind],
+                        Path(path_to_datasets),
+                        indicators,
+                        interval=interval,
+                        executor=executor,
+                        on_error=lambda symbol, _: failed_symbols.append(symbol),
+                    )
+                )
+                connection.send(("result", shard_id, scores, failed_symbols))
+            except Exception:
+                connection.send(("error", shard_id, traceback.format_exc()))
+    connection.close()
+
+
+def start_local_workers(
+    nb_workers: int,
+    address: Tuple[str, int],
+    authkey: bytes,
+    path_to_datasets: Path,
+    max_workers: int = 1,
+) -> List[mp.Process]:
+    """Starts `nb_workers` worker processes on this machine.
+
+    Returns:
+        List[mp.Process]: worker processes
+    """
+    context = mp.get_context("spawn")
+    workers = [
+        context.Process(
+            target=run_worker,
+            args=(address, authkey, path_to_datasets, max_workers, f"local-{i}"),
+            daemon=False,
+        )
+        for i in range(nb_workers)
+    ]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def _parse_address(address: str) -> Tuple[str, int]:
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+if __name__ == "__main__":
+    import pandas as pd
+    import toml
+    from models.indicator import EMA, MACD, RSI, CipherB, SentimentScore, StochRSI
+
+    parser = argparse.ArgumentParser(description="Sharded scans")
+    parser.add_argument("mode", choices=["worker", "local"])
+    parser.add_argument("--address", default="localhost:6000")
+    parser.add_argument("--authkey", default=os.environ.get("SCREENER_AUTHKEY", ""))
+    parser.add_argument("--workers", type=int, default=2, help="local workers")
+    parser.add_argument(
+        "--processes", type=int, default=None, help="processes per worker"
+    )
+    parser.add_argument("--config", type=Path, default=Path("config.toml"))
+    args = parser.parse_args()
+    if args.authkey == "":
+        parser.error("--authkey or the SCREENER_AUTHKEY environment variable is required")
+
+    config = toml.load(args.config)
+    path_to_datasets = Path(config["data_access"]["path_to_datasets"])
+    authkey = args.authkey.encode()
+
+    if args.mode == "worker":
+        run_worker(
+            _parse_address(args.address), authkey, path_to_datasets, args.processes
+        )
+    else:
+        index_symbols = list(
+            pd.read_csv(config["data_access"]["path_to_index_symbols"])["symbol"]
+        )
+        stock_symbols = list(
+            pd.read_csv(config["data_access"]["path_to_stock_symbols"])["symbol"]
+        )
+        indicators = [RSI(), StochRSI(), EMA(), MACD(), CipherB(), SentimentScore()]
+        with ScanCoordinator(("localhost", 0), authkey) as coordinator:
+            workers = start_local_workers(
+                args.workers,
+                coordinator.address,
+                authkey,
+                path_to_datasets,
+                args.processes or 1,
+            )
+            start = monotonic()
+            index_scores, stock_scores, failed_symbols = coordinator.scan(
+                index_symbols, stock_symbols, indicators
+            )
+            print(
+                f"Scanned {len(index_scores) + len(stock_scores)} assets "
+                f"in {monotonic() - start:.1f}s on {args.workers} workers, "
+                f"{len(failed_symbols)} failed."
+            )
+        for worker in workers:
+            worker.join()
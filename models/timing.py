@@ -0,0 +1,197 @@
+"""Timing spans of the hot paths: loading, indicators, scans, plotting and widgets.
+
+Spans are recorded in the `Timeline` active in the current context, eg the
+page being rendered, and cost nothing when no timeline is active.
+
+    with Timeline("page") as timeline:
+        with span("load_universe", interval="1d"):
+            ...
+    timeline.summary()
+
+Functions running in worker processes are submitted through `run_traced`:
+their spans are sent back with their result, and merged into the timeline of
+the caller by `collect`.
+"""
+import json
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from functools import wraps
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+TIMING_LOG_VARIABLE = "SCREENER_TIMING_LOG"
+"""Environment variable holding the path of the JSON lines timing log"""
+
+_current_timeline: "ContextVar[Optional[Timeline]]" = ContextVar(
+    "current_timeline", default=None
+)
+
+
+@dataclass
+class Span:
+    name: str
+    start: Optional[float]
+    """seconds since the start of the timeline. None for the spans of the workers."""
+    duration: float
+    """seconds"""
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    depth: int = 0
+    worker: bool = False
+
+
+class Timeline:
+    """Spans recorded while it is active, see `span`."""
+
+    def __init__(self, name: str = "timeline") -> None:
+        self.name = name
+        self.spans: List[Span] = []
+        self.started_at = datetime.now(timezone.utc)
+        self.duration = None
+        self._start = perf_counter()
+        self._depth = 0
+        self._tokens = []
+
+    def __enter__(self) -> "Timeline":
+        self._tokens.append(_current_timeline.set(self))
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.duration = perf_counter() - self._start
+        _current_timeline.reset(self._tokens.pop())
+
+    def summary(self) -> List[dict]:
+        """Count, total and maximum duration of the spans of each name, slowest total first.
+        Durations are in milliseconds; the spans of the workers add up their CPU time."""
+        stats: Dict[Tuple[str, bool], dict] = {}
+        for recorded_span in self.spans:
+            key = (recorded_span.name, recorded_span.worker)
+            if key not in stats:
+                stats[key] = {
+                    "name": recorded_span.name,
+                    "worker": recorded_span.worker,
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                }
+            stats[key]["count"] += 1
+            stats[key]["total_ms"] += 1000 * recorded_span.duration
+            stats[key]["max_ms"] = max(stats[key]["max_ms"], 1000 * recorded_span.duration)
+        return sorted(stats.values(), key=lambda stat: stat["total_ms"], reverse=True)
+
+    def to_record(self) -> dict:
+        """Structured record of the timeline: the spans of this process, and the summary."""
+        return {
+            "timeline": self.name,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": None if self.duration is None else 1000 * self.duration,
+            "spans": [
+                {
+                    "name": recorded_span.name,
+                    "start_ms": 1000 * recorded_span.start,
+                    "duration_ms": 1000 * recorded_span.duration,
+                    "depth": recorded_span.depth,
+                    **recorded_span.attributes,
+                }
+                for recorded_span in self.spans
+                if not recorded_span.worker
+            ],
+            "summary": self.summary(),
+        }
+
+    def log(self, path: Path = None) -> None:
+        """Appends the record of the timeline to the JSON lines log at `path`.
+        Defaults to the `SCREENER_TIMING_LOG` environment variable, and does nothing if it is not set.
+        """
+        if path is None:
+            path = os.environ.get(TIMING_LOG_VARIABLE)
+            if not path:
+                return
+        with open(path, "a") as log_file:
+            log_file.write(json.dumps(self.to_record(), default=str) + "\n")
+
+
+def current_timeline() -> Optional[Timeline]:
+    return _current_timeline.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Records the duration of the block in the active timeline, if any.
+
+    Args:
+        name (str): name of the span, eg `load_universe`
+        attributes: stored with the span, eg the interval
+    """
+    timeline = _current_timeline.get()
+    if timeline is None:
+        yield
+        return
+    start = perf_counter()
+    timeline._depth += 1
+    try:
+        yield
+    finally:
+        timeline._depth -= 1
+        timeline.spans.append(
+            Span(
+                name=name,
+                start=start - timeline._start,
+                duration=perf_counter() - start,
+                attributes=attributes,
+                depth=timeline._depth,
+            )
+        )
+
+
+def timed(name: str = None) -> Callable:
+    """Decorator recording each call of the function as a span.
+
+    Args:
+        name (str): name of the span. Defaults to the qualified name of the function.
+    """
+
+    def decorator(function: Callable) -> Callable:
+        span_name = name or function.__qualname__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def run_traced(function: Callable, *args, **kwargs) -> Tuple[Any, List[Tuple[str, float]]]:
+    """Calls `function` in a new timeline, eg in a worker process.
+
+    Returns:
+        Tuple[Any, List[Tuple[str, float]]]: result of the function, and the name
+            and duration of its spans, to give to `collect`
+    """
+    with Timeline() as timeline:
+        result = function(*args, **kwargs)
+    return result, [
+        (recorded_span.name, recorded_span.duration) for recorded_span in timeline.spans
+    ]
+
+
+def collect(traced_result: Tuple[Any, List[Tuple[str, float]]]) -> Any:
+    """Merges the spans of a `run_traced` call into the active timeline, if any.
+
+    Returns:
+        Any: result of the traced function
+    """
+    result, spans = traced_result
+    timeline = _current_timeline.get()
+    if timeline is not None:
+        timeline.spans.extend(
+            Span(name=name, start=None, duration=duration, worker=True)
+            for name, duration in spans
+        )
+    return result
@@ -1,4 +1,8 @@
+import concurrent.futures
 import os
+import threading
+from time import monotonic
+from typing import Callable, List, Optional
 
 import requests
 import streamlit as st
@@ -6,21 +10,182 @@ import streamlit.components.v1 as components
 import tweepy
 
 from models.asset import Stock
+from models.cache import TTLCache
+
+
+class TimeoutSession(requests.Session):
+    """Session giving its requests a timeout, unless they set one."""
+
+    def __init__(self, timeout: float) -> None:
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(*args, **kwargs)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a service which failed too many times in a row."""
+
+
+class CircuitBreaker:
+    """Stops calling a failing service for a while, so that it cannot stall every page.
+
+    After `max_failures` failures in a row, the circuit opens: calls fail
+    immediately with `CircuitOpenError` during `reset_timeout` seconds. The
+    circuit is then half-open: a single call probes the service, while the
+    others keep failing immediately. The probe closes the circuit if it
+    succeeds, and opens it again for `reset_timeout` otherwise.
+    """
+
+    def __init__(
+        self,
+        max_failures: int = 3,
+        reset_timeout: float = 60,
+        is_failure: Callable[[Exception], bool] = None,
+    ) -> None:
+        """
+        Args:
+            max_failures (int): number of failures in a row opening the circuit
+            reset_timeout (float): seconds during which the circuit stays open
+            is_failure (Callable[[Exception], bool]): whether an error is a failure of
+                the service. The other errors are raised without counting, as the
+                service answered. Defaults to None, every error is a failure.
+        """
+        self.max_failures = max_failures
+        self.reset_timeout = reset_timeout
+        self.is_failure = is_failure
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        """Whether the calls fail immediately."""
+        with self._lock:
+            return self._is_open()
+
+    def _is_open(self) -> bool:
+        return self.opened_at is not None and (
+            self.probing or monotonic() - self.opened_at < self.reset_timeout
+        )
+
+    def call(self, function: Callable, *args, **kwargs):
+        """Calls `function(*args, **kwargs)`, unless the circuit is open.
+
+        Raises:
+            CircuitOpenError: if the circuit is open
+        """
+        with self._lock:
+            if self._is_open():
+                raise CircuitOpenError(f"{function.__qualname__} failed too many times")
+            # half-open: this call is the probe
+            self.probing = self.opened_at is not None
+        try:
+            result = function(*args, **kwargs)
+        except Exception as error:
+            if self.is_failure is None or self.is_failure(error):
+                with self._lock:
+                    self.failures += 1
+                    if self.probing or self.failures >= self.max_failures:
+                        self.opened_at = monotonic()
+                    self.probing = False
+            else:
+                self._close()
+            raise
+        self._close()
+        return result
+
+    def _close(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+
+def is_service_failure(error: Exception) -> bool:
+    """Whether a request error is a failure of the service: a timeout, a connection
+    error, a server error or too many requests. The other HTTP errors, eg 404 for a
+    deleted tweet, concern the requested resource only."""
+    if isinstance(error, (requests.Timeout, requests.ConnectionError)):
+        return True
+    if isinstance(error, (tweepy.TwitterServerError, tweepy.TooManyRequests)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    return False
+
+
+OEMBED_BREAKER = CircuitBreaker(is_failure=is_service_failure)
+"""Circuit of the Twitter oEmbed API. A missing or private tweet is not a failure."""
+SEARCH_BREAKER = CircuitBreaker(is_failure=is_service_failure)
+"""Circuit of the Twitter search API"""
+REQUEST_TIMEOUT = 5
+"""Seconds after which a request to Twitter fails, counting as a failure of its circuit"""
+OEMBED_CACHE = TTLCache(ttl=24 * 60 * 60, max_size=10_000)
+"""tweet id -> embed HTML"""
+SEARCH_CACHE = TTLCache(ttl=15 * 60, max_size=2_000)
+"""query -> ids of the tweets found, most liked first"""
 
 
 class Tweet(object):
     """Streamlit component containing an embed tweet."""
 
-    def __init__(self, tweet_id):
+    def __init__(self, tweet_id, text: str = None):
+        self.tweet_id = tweet_id
+        self.text = text if text is not None else Tweet.fetch_html(tweet_id)
+
+    @staticmethod
+    def _request_html(tweet_id) -> str:
         api = "https://publish.twitter.com/oembed?url=https://twitter.com/twitter/statuses/{tweet_id}".format(
             tweet_id=tweet_id
         )
-        response = requests.get(api, timeout=5)
-        self.text = response.json()["html"]
-        self.text = self.text.replace(
+        response = requests.get(api, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response.json()["html"].replace(
             'class="twitter-tweet"', 'class="twitter-tweet" width="50"'
         )
 
+    @staticmethod
+    def fetch_html(tweet_id) -> str:
+        """Embed HTML of a tweet, cached for a day.
+
+        Raises:
+            CircuitOpenError: if the oEmbed API failed too many times lately
+        """
+        html = OEMBED_CACHE.get(tweet_id)
+        if html is None:
+            html = OEMBED_BREAKER.call(Tweet._request_html, tweet_id)
+            OEMBED_CACHE.put(tweet_id, html)
+        return html
+
+    @classmethod
+    def fetch_many(cls, tweet_ids: List, max_workers: int = 8) -> List[Optional["Tweet"]]:
+        """Fetches the embed HTML of several tweets concurrently.
+
+        Args:
+            tweet_ids (List): ids of the tweets
+            max_workers (int): number of concurrent requests
+
+        Returns:
+            List[Optional[Tweet]]: tweets, in the order of `tweet_ids`. None for the tweets which could not be fetched.
+        """
+        if len(tweet_ids) == 0:
+            return []
+
+        def fetch(tweet_id) -> Optional[Tweet]:
+            try:
+                return cls(tweet_id, cls.fetch_html(tweet_id))
+            except Exception:
+                return None
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(max_workers, len(tweet_ids))
+        ) as executor:
+            return list(executor.map(fetch, tweet_ids))
+
     def _repr_html_(self):
         return self.text
 
@@ -29,32 +194,48 @@ class Tweet(object):
 
 
 class TweetsSearch:
-    """Contains the result of a tweet search."""
+    """Contains the result of a tweet search.
+    Results are cached for 15 minutes. A failing search gives no tweets, instead of an error."""
 
     def __init__(self, stock: Stock) -> None:
-        bearer_token = os.environ.get("TWITTER_BEARER")
-        self.client = tweepy.Client(bearer_token)
         self.stock = stock
         # if isinstance(stock, Stock):
         #     name = stock.financials.get("longName", "stock").split()[0].lower()
         # else:
         #     name = stock.symbol
-        name = stock.financials.get("longName", "stock").split()[0].lower()
+        financials = getattr(stock, "financials", {})
+        name = financials.get("longName", "stock").split()[0].lower()
 
         self.query = f"{name} #{stock.symbol} lang:en -is:retweet"
-        self.tweet_search = self.client.search_recent_tweets(
-            query=self.query,
+        self.tweet_ids = SEARCH_CACHE.get(self.query)
+        if self.tweet_ids is None:
+            try:
+                self.tweet_ids = SEARCH_BREAKER.call(self._search, self.query)
+                SEARCH_CACHE.put(self.query, self.tweet_ids)
+            except Exception:
+                self.tweet_ids = []
+
+    @staticmethod
+    def _search(query: str) -> List:
+        client = tweepy.Client(os.environ.get("TWITTER_BEARER"))
+        # tweepy sends its requests without timeout: a hanging search would stall the page
+        client.session = TimeoutSession(REQUEST_TIMEOUT)
+        tweet_search = client.search_recent_tweets(
+            query=query,
             max_results=100,
             tweet_fields=["id", "public_metrics"],
         )[0]
-        if self.tweet_search is None:
-            self.tweet_search = []
-        self.tweet_search.sort(
-            key=lambda t: t.public_metrics["like_count"], reverse=True
-        )
+        if tweet_search is None:
+            return []
+        tweet_search.sort(key=lambda t: t.public_metrics["like_count"], reverse=True)
+        return [tweet.id for tweet in tweet_search]
 
     def __len__(self):
-        return len(self.tweet_search)
+        return len(self.tweet_ids)
 
     def __getitem__(self, i):
-        return Tweet(self.tweet_search[i].id)
+        return Tweet(self.tweet_ids[i])
+
+    def tweets(self, start: int, length: int) -> List[Optional[Tweet]]:
+        """Fetches the tweets from `start` to `start + length` concurrently, None for the failing ones."""
+        return Tweet.fetch_many(self.tweet_ids[start : start + length])
@@ -0,0 +1,211 @@
+import threading
+import traceback
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Set, Tuple, Union
+
+from get_data.manifest import (
+    Manifest,
+    build_manifest,
+    changed_symbols,
+    manifest_updated_at,
+    manifest_version,
+)
+from models.asset import Index, Stock, load_asset
+
+
+@dataclass(frozen=True)
+class Universe:
+    """Assets loaded from one version of the datasets.
+
+    Shared between every session: the assets must be treated as read-only.
+    """
+
+    version: str
+    manifest: Manifest
+    indices: List[Index]
+    stocks: List[Stock]
+    updated_at: datetime
+
+
+class UniverseCache:
+    """Process-wide cache of the loaded universes, one per (symbols, timeframe).
+
+    A universe is loaded once, by the first session asking for it, and is then
+    shared by every session. When the datasets change, the assets whose files
+    changed are loaded into a new universe: the previous one is left untouched
+    for the sessions still using it.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._universes: Dict[Tuple, Universe] = {}
+        self._loading_locks: Dict[Tuple, threading.Lock] = {}
+
+    @staticmethod
+    def _key(
+        index_symbols: List[str],
+        stock_symbols: List[str],
+        path_to_datasets: Path,
+        interval: str,
+    ) -> Tuple:
+        return (
+            tuple(index_symbols),
+            tuple(stock_symbols),
+            str(path_to_datasets),
+            interval,
+        )
+
+    def is_loaded(
+        self,
+        index_symbols: List[str],
+        stock_symbols: List[str],
+        path_to_datasets: Path,
+        interval: str,
+    ) -> bool:
+        """Whether a universe, possibly of a previous version of the datasets, is cached."""
+        key = self._key(index_symbols, stock_symbols, path_to_datasets, interval)
+        with self._lock:
+            return key in self._universes
+
+    def get(
+        self,
+        index_symbols: List[str],
+        stock_symbols: List[str],
+        path_to_datasets: Path,
+        interval: str = "1d",
+        manifest: Manifest = None,
+        wait: bool = False,
+    ) -> Universe:
+        """Returns the cached universe, and makes sure it follows the datasets.
+
+        The first call loads every asset. Once the datasets change, only the
+        assets whose files changed are loaded again, in a background thread:
+        until they are, the previous universe is returned.
+
+        Args:
+            index_symbols (List[str]): list of symbols to create Index instances with
+            stock_symbols (List[str]): list of symbols to create Stock instances with
+            path_to_datasets (Path): path to the datasets
+            interval (str): timeframe of the klines, eg `1d` or `1wk`.
+            manifest (Manifest): current manifest of the datasets. Built if not given.
+            wait (bool): wait for the changed assets to be loaded again,
+                instead of returning the previous universe.
+
+        Returns:
+            Universe: loaded universe
+        """
+        key = self._key(index_symbols, stock_symbols, path_to_datasets, interval)
+        if manifest is None:
+            manifest = build_manifest(path_to_datasets)
+        version = manifest_version(manifest)
+
+        with self._lock:
+            universe = self._universes.get(key)
+            if universe is not None and universe.version == version:
+                return universe
+            loading_lock = self._loading_locks.setdefault(key, threading.Lock())
+
+        if universe is not None and not wait:
+            # at most one reload at once, without blocking the sessions
+            if loading_lock.acquire(blocking=False):
+                threading.Thread(
+                    target=self._reload_in_background,
+                    args=(key, manifest, loading_lock),
+                    daemon=True,
+                ).start()
+            return universe
+
+        # concurrent sessions wait for the first one to load the universe
+        with loading_lock:
+            try:
+                return self._reload(key, manifest)
+            except Exception:
+                # eg symbols without datasets: the lock must not outlive a failed key
+                with self._lock:
+                    if (
+                        key not in self._universes
+                        and self._loading_locks.get(key) is loading_lock
+                    ):
+                        del self._loading_locks[key]
+                raise
+
+    def _reload_in_background(
+        self, key: Tuple, manifest: Manifest, loading_lock: threading.Lock
+    ) -> None:
+        try:
+            self._reload(key, manifest)
+        except Exception:
+            # eg a file being written by the update job: retried on the next call
+            print(f"Could not reload the universe:\n{traceback.format_exc()}")
+        finally:
+            loading_lock.release()
+
+    def _reload(self, key: Tuple, manifest: Manifest) -> Universe:
+        """Loads the universe described by `manifest`, reusing the assets whose files did not change.
+        Must be called with the loading lock of `key` held."""
+        index_symbols, stock_symbols, path_to_datasets, interval = key
+        version = manifest_version(manifest)
+        with self._lock:
+            previous = self._universes.get(key)
+        if previous is not None and previous.version == version:
+            return previous
+
+        if previous is None:
+            previous_indices, previous_stocks, changed = None, None, None
+        else:
+            previous_indices, previous_stocks = previous.indices, previous.stocks
+            changed = changed_symbols(previous.manifest, manifest)
+        indices = _load_changed_assets(
+            index_symbols,
+            previous_indices,
+            changed,
+            Index.load_index,
+            Path(path_to_datasets),
+            interval,
+        )
+        stocks = _load_changed_assets(
+            stock_symbols,
+            previous_stocks,
+            changed,
+            Stock.load_stock,
+            Path(path_to_datasets),
+            interval,
+        )
+        universe = Universe(
+            version, manifest, indices, stocks, manifest_updated_at(manifest)
+        )
+        with self._lock:
+            # the previous version is released once no session uses it anymore
+            self._universes[key] = universe
+        return universe
+
+    def clear(self) -> None:
+        with self._lock:
+            self._universes.clear()
+            self._loading_locks.clear()
+
+
+def _load_changed_assets(
+    symbols: Tuple[str],
+    previous_assets: List[Union[Index, Stock]],
+    changed: Set[str],
+    loading_function: Callable,
+    path_to_datasets: Path,
+    interval: str,
+) -> List[Union[Index, Stock]]:
+    """Loads the assets of `symbols` which `changed`, and reuses the `previous_assets` of the others.
+    Every asset is loaded if there are no `previous_assets`."""
+    if previous_assets is None:
+        return load_asset(list(symbols), loading_function, path_to_datasets, interval)
+    symbols_to_load = [symbol for symbol in symbols if symbol in changed]
+    if len(symbols_to_load) == 0:
+        return previous_assets
+    loaded_assets = {
+        asset.symbol: asset
+        for asset in load_asset(
+            symbols_to_load, loading_function, path_to_datasets, interval
+        )
+    }
+    return [loaded_assets.get(asset.symbol, asset) for asset in previous_assets]